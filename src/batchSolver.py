@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+import logging
+import argparse
+import json
+import pathlib
+import time
+import traceback
+import subway.simulation.utils as u
+import problemLoader
+import solver
+from evaluation import EvaluationEngine
+from solutionWriter import OUTPUT_FORMATS
+from utils import natural_keys, getWorkerCount
+
+LOGGER = logging.getLogger('jmetal')
+
+u.ENABLE_LOG = False
+u.ENABLE_DEBUG_PRINT = False
+
+
+def getProblemPaths(inputPath):
+    """ Problem files of a batch: every *Problem.json of a directory, or the
+        files listed in a manifest, either a JSON list or one path per line,
+        relative to the manifest.
+    """
+    inputPath = pathlib.Path(inputPath)
+    if inputPath.is_dir():
+        return sorted(inputPath.glob('*Problem.json'), key=lambda path: natural_keys(path.name))
+    with open(inputPath) as f:
+        content = f.read()
+    try:
+        paths = json.loads(content)
+    except ValueError:
+        paths = [line.strip() for line in content.splitlines()
+                 if line.strip() and not line.strip().startswith('#')]
+    return [inputPath.parent / path for path in paths]
+
+
+def allocateSeconds(problemObjs, totalSeconds, minSeconds=1.0):
+    """ Splits totalSeconds between the lines in proportion to their
+        problemLoader.getProblemSize, giving every line at least minSeconds.
+    """
+    sizes = {lineKey: problemLoader.getProblemSize(problemObj) for lineKey, problemObj in problemObjs.items()}
+    totalSize = sum(sizes.values())
+    return {lineKey: max(minSeconds, totalSeconds * size / totalSize) for lineKey, size in sizes.items()}
+
+
+def main(inputPath, max_seconds, outputDir='../output/', numWorkers=None, evaluator='analytic',
+         numReplicas=None, batchSize=None, outputFormat='json', telemetryFormat=None):
+    # Lines are optimized one after the other, each with replica-exchange
+    # annealing over one worker pool shared by all lines, so every line
+    # keeps all cores busy for its share of max_seconds. With a
+    # telemetryFormat the chains of every line are recorded to
+    # telemetry.csv or telemetry.ndjson in the output folder of the line.
+    problemPaths = getProblemPaths(inputPath)
+    if not problemPaths:
+        raise ValueError(f"No problem files found in {inputPath}.")
+    problemObjs = {}
+    for path in problemPaths:
+        lineKey = pathlib.Path(path).stem
+        if lineKey in problemObjs:
+            raise ValueError(f"Problem file names must be unique, {lineKey} is given twice.")
+        problemObjs[lineKey] = problemLoader.getJsonProblem(path)
+    lineSeconds = allocateSeconds(problemObjs, max_seconds)
+    outputDir = pathlib.Path(outputDir)
+
+    numCores = numWorkers if numWorkers else getWorkerCount()
+    replicas = numReplicas if numReplicas else max(4, numCores)
+    summary = {}
+    t1 = time.time()
+    with EvaluationEngine(numWorkers=numCores, batchSize=batchSize if batchSize else -(-replicas // numCores),
+                          evaluator=evaluator, problemObjs=problemObjs) as evaluationEngine:
+        for path in problemPaths:
+            lineKey = pathlib.Path(path).stem
+            print(f"Line {lineKey}: {lineSeconds[lineKey]:.1f} seconds.")
+            lineOutputPath = outputDir / lineKey
+            lineStart = time.time()
+            try:
+                bestSolution = solver.main(path, lineSeconds[lineKey], evaluator, numWorkers=numCores,
+                                           algorithmName='tempering', numReplicas=replicas,
+                                           outputPath=lineOutputPath, outputFormat=outputFormat,
+                                           evaluationEngine=evaluationEngine.forLine(lineKey),
+                                           telemetryPath=lineOutputPath / f'telemetry.{telemetryFormat}'
+                                           if telemetryFormat else None)
+            except Exception as e:
+                LOGGER.error(f"Line {lineKey} failed: {e}")
+                traceback.print_exc()
+                summary[lineKey] = {'error': str(e)}
+                continue
+            summary[lineKey] = {
+                'objective': bestSolution.objectives[0],
+                'seconds': lineSeconds[lineKey],
+                'wallSeconds': time.time() - lineStart,
+                'output': str(lineOutputPath)
+            }
+
+    outputDir.mkdir(parents=True, exist_ok=True)
+    with open(outputDir / 'batchSummary.json', 'w') as f:
+        f.write(json.dumps(summary, indent=2))
+    print(f"{len(problemPaths)} lines in {time.time() - t1} seconds, summary written to output folder.")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_seconds', '-s', help="Time Limit in Seconds for all lines together",
+                        required=True, type=float)
+    parser.add_argument('--input', '-i', help="Directory of *Problem.json files or a manifest listing them",
+                        default='../data/', type=str)
+    parser.add_argument('--output_dir', '-o', help="Each line is written to a folder of its own in here",
+                        default='../output/', type=str)
+    parser.add_argument('--workers', '-w', help="Worker processes, by default all cores but two",
+                        default=None, type=int)
+    parser.add_argument('--evaluator', '-e', help="Objective evaluator used during the search",
+                        choices=['analytic', 'simulation'], default='analytic', type=str)
+    parser.add_argument('--replicas', help="Replicas per line", default=None, type=int)
+    parser.add_argument('--batch_size', help="Candidates sent to a worker at once", default=None, type=int)
+    parser.add_argument('--output_format', help="Format of the solution logs, see solver.py",
+                        choices=OUTPUT_FORMATS, default='json', type=str)
+    parser.add_argument('--telemetry', help="Record the annealing chains of every line in this format",
+                        choices=['csv', 'ndjson'], default=None, type=str)
+    args = parser.parse_args()
+    main(args.input, args.max_seconds, args.output_dir, args.workers, args.evaluator,
+         args.replicas, args.batch_size, args.output_format, args.telemetry)
@@ -0,0 +1,294 @@
+import argparse
+import copy
+import json
+import os
+import pathlib
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import numpy as np
+import simpy
+import problemLoader
+import solver
+from problemGenerator import generateProblem
+from evaluation import ProblemEvaluator, runSimulation
+from optimization import TimePeriodSolution, RandomMutationAll
+from utils import getVariableBounds, secondsToString, stringToSeconds
+
+# Lines benchmarked by default: (name, stations, trains, depots). Stations
+# are split evenly between the two directions of the line, every line has
+# enough trains for its configured headways.
+SCALED_LINES = (
+    ('base', None, None, None),
+    ('s20-t32-d1', 20, 32, 1),
+    ('s100-t200-d2', 100, 200, 2),
+    ('s400-t200-d2', 400, 200, 2),
+    ('s400-t400-d4', 400, 400, 4),
+)
+
+# Lines made by generateProblem: (name, keyword arguments), branching,
+# with LaunchAndForgetDepots and 5 minute demand.
+GENERATED_LINES = (
+    ('gen-s200-t150-d3-lf1', dict(numStations=200, numDepots=3, numTrains=150, numBranches=2,
+                              numLaunchAndForgetDepots=1, demandResolution=300)),
+    ('gen-s400-t300-d4-lf2', dict(numStations=400, numDepots=4, numRoutes=6, numTrains=300, numBranches=3,
+                              numLaunchAndForgetDepots=2, demandResolution=300)),
+)
+
+STAGES = ('load', 'simulation', 'analyticEvaluation', 'mutation', 'export', 'solve')
+
+
+def scaleProblem(problemObj, numStations, numTrains, numDepots):
+    """ A copy of problemObj stretched to numStations stations, numTrains
+        trains and numDepots depots.
+
+        Stations, their demand and the travel durations between them are
+        repeated from problemObj, which has to be a single depot line whose
+        first route runs out along its stations and back. The first depot
+        keeps serving the whole line; every further depot is placed along
+        the line and serves it from there to the end and back, trains being
+        split evenly between the depots.
+    """
+    assert numStations % 2 == 0 and numStations >= 4, "A line needs an even number of stations, at least 4."
+    assert numDepots >= 1 and numTrains >= numDepots, "Every depot needs a train."
+    problemObj = copy.deepcopy(problemObj)
+    stationObjs = {station['id']: station for station in problemObj['lineNodes']['stations']}
+    travelDurations = {(scheme['fromNode'], scheme['toNode']): scheme['travelDuration']
+                       for scheme in problemObj['lineScheme']}
+    baseDepot = problemObj['lineNodes']['depots'][0]
+    baseRoute = problemObj['routes'][0]
+    baseSequence = baseRoute['nodeIdSequence']
+    half = numStations // 2
+
+    # Outbound station i and inbound station i face each other, a train
+    # runs out to the last station and comes back on the inbound ones.
+    outboundIds = [10000 + i for i in range(half)]
+    inboundIds = [20000 + i for i in range(half)]
+    lineSequence = outboundIds + inboundIds[::-1]
+    stations = []
+    for i, stationId in enumerate(lineSequence):
+        station = copy.deepcopy(stationObjs[baseSequence[i % len(baseSequence)]])
+        station.update(id=stationId, name=f"{station['name']} {stationId}")
+        stations.append(station)
+    baseLegs = [travelDurations[(fromNode, toNode)] for fromNode, toNode in zip(baseSequence[:-1], baseSequence[1:])]
+    lineScheme = [{'fromNode': fromNode, 'toNode': toNode, 'travelDuration': baseLegs[i % len(baseLegs)]}
+                  for i, (fromNode, toNode) in enumerate(zip(lineSequence[:-1], lineSequence[1:]))]
+    lineScheme.append({'fromNode': lineSequence[-1], 'toNode': lineSequence[0],
+                       'travelDuration': travelDurations[(baseSequence[-1], baseSequence[0])]})
+    depotLeg = travelDurations[(baseDepot['id'], baseSequence[0])]
+
+    depots = []
+    routes = []
+    trainIds = list(range(1, numTrains + 1))
+    for k in range(numDepots):
+        depotId = baseDepot['id'] + k * 1000
+        position = k * half // numDepots
+        sequence = outboundIds[position:] + inboundIds[position:][::-1]
+        depot = copy.deepcopy(baseDepot)
+        depot.update(id=depotId, name=f"{baseDepot['name']} {k}", routingIdSequence=[k + 1],
+                     stationedTrains=trainIds[k::numDepots])
+        # Later depots launch a little after each other.
+        depot['firstLaunchTime'] = secondsToString(stringToSeconds(baseDepot['firstLaunchTime']) + 120 * k)
+        depots.append(depot)
+        route = copy.deepcopy(baseRoute)
+        route.update(id=k + 1, name=f"Route {k}", launchDepot=depotId, circulatingDepot=depotId,
+                     nodeIdSequence=sequence)
+        routes.append(route)
+        lineScheme.append({'fromNode': depotId, 'toNode': sequence[0], 'travelDuration': depotLeg})
+        lineScheme.append({'fromNode': sequence[-1], 'toNode': depotId, 'travelDuration': depotLeg})
+
+    problemObj['lineName'] = f"{problemObj['lineName']} x{numStations}/{numTrains}/{numDepots}"
+    problemObj['lineNodes'] = {'stations': stations, 'depots': depots}
+    problemObj['lineScheme'] = lineScheme
+    problemObj['routes'] = routes
+    return problemObj
+
+
+def seed(value):
+    random.seed(value)
+    np.random.seed(value)
+
+
+def measure(function, repeats, seedValue):
+    """ Seconds of repeats calls of function, seeded the same way before
+        each call.
+    """
+    times = []
+    for _ in range(repeats):
+        seed(seedValue)
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        'repeats': repeats,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'max': max(times)
+    }
+
+
+def getVersion():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def benchmarkLine(problemPath, stages, repeats, seedValue, mutations, solveEvaluations, workDir):
+    """ {stage: timings} of one JSON problem, see STAGES. """
+    problemObj = problemLoader.getJsonProblem(problemPath)
+    subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
+    problemConfig = next(problemLoader.problemConfigGenerator(problemObj, subwayProblem))
+    variables = problemConfig['timePeriodConfig']
+    bounds = getVariableBounds(problemConfig)
+    solution = TimePeriodSolution(variables, bounds['variableBounds'], bounds['intervalBounds'])
+    results = {}
+    os.makedirs(workDir / 'export', exist_ok=True)
+
+    def load():
+        problemLoader.createSubwayProblemFromJson(problemLoader.getJsonProblem(problemPath))
+
+    def simulate():
+        newSubwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
+        problemLoader.loadHeadways(problemConfig, newSubwayProblem, variables)
+        env = simpy.Environment()
+        problemLoader.loadEnvironment(env, newSubwayProblem)
+        runSimulation(env, newSubwayProblem)
+
+    # Compiled once, so that only the replay itself is timed.
+    problemEvaluator = ProblemEvaluator(problemObj, 'analytic')
+    problemEvaluator.evaluate(problemConfig, variables)
+
+    def evaluateAnalytic():
+        problemEvaluator.evaluate(problemConfig, variables)
+
+    def mutate():
+        mutation = RandomMutationAll(0.5)
+        for _ in range(mutations):
+            mutation.execute(copy.copy(solution))
+
+    def export():
+        solver.writeJsonSolution(problemObj, problemConfig, variables, workDir / 'export')
+
+    # With one worker the single annealing chain runs in this process, so
+    # the seed fixes the solution found as well.
+    solveObjectives = []
+
+    def solve():
+        bestSolution = solver.main(problemPath, 1, 'analytic', numWorkers=1, maxEvaluations=solveEvaluations,
+                                   outputPath=workDir / 'solve')
+        solveObjectives.append(bestSolution.objectives[0])
+
+    functions = {'load': load, 'simulation': simulate, 'analyticEvaluation': evaluateAnalytic,
+                 'mutation': mutate, 'export': export, 'solve': solve}
+    for stage in stages:
+        print(f"  {stage}")
+        # The end-to-end solve is far slower than the other stages.
+        results[stage] = measure(functions[stage], 1 if stage == 'solve' else repeats, seedValue)
+    if 'mutation' in results:
+        results['mutation']['perCall'] = results['mutation']['median'] / mutations
+    if 'solve' in results:
+        results['solve']['objective'] = solveObjectives[-1]
+    return results
+
+
+def getLines(baseProblem, lines=None):
+    """ Yields (lineName, problemObj) of the benchmarked lines, all of them
+        if lines is None.
+    """
+    for lineName, numStations, numTrains, numDepots in SCALED_LINES:
+        if lines is None or lineName in lines:
+            if numStations is None:
+                yield lineName, baseProblem
+            else:
+                yield lineName, scaleProblem(baseProblem, numStations, numTrains, numDepots)
+    for lineName, generatorArguments in GENERATED_LINES:
+        if lines is None or lineName in lines:
+            yield lineName, generateProblem(**generatorArguments)
+
+
+def compareResults(results, baseline):
+    """ Prints the median time of every stage against a baseline result file. """
+    for lineName, line in results['lines'].items():
+        baselineLine = baseline['lines'].get(lineName)
+        if baselineLine is None:
+            continue
+        for stage, timings in line['stages'].items():
+            if stage not in baselineLine['stages']:
+                continue
+            ratio = timings['median'] / baselineLine['stages'][stage]['median']
+            print(f"{lineName:>16} {stage:>20}: {timings['median']:.4f}s, {ratio:.2f}x baseline")
+
+
+def main(problemPath='../data/Line9780Problem.json', outputPath='../output/benchmark.json', lines=None,
+         stages=STAGES, repeats=5, seedValue=0, mutations=1000, solveEvaluations=200, baselinePath=None):
+    """ Times every stage on the base problem and the scaled lines, with the
+        same seeds every run, and writes the timings to outputPath as JSON.
+    """
+    problemPath = pathlib.Path(problemPath)
+    baseProblem = problemLoader.getJsonProblem(problemPath)
+    results = {
+        'version': getVersion(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': seedValue,
+        'repeats': repeats,
+        'mutations': mutations,
+        'solveEvaluations': solveEvaluations,
+        'lines': {}
+    }
+    with tempfile.TemporaryDirectory(prefix='ttpBenchmark') as workDir:
+        workDir = pathlib.Path(workDir)
+        for lineName, lineObj in getLines(baseProblem, lines):
+            linePath = problemPath
+            if lineObj is not baseProblem:
+                linePath = workDir / f'{lineName}Problem.json'
+                with open(linePath, 'w') as f:
+                    f.write(json.dumps(lineObj))
+            print(f"Line {lineName}")
+            results['lines'][lineName] = {
+                'stations': len(lineObj['lineNodes']['stations']),
+                'trains': sum(len(depot['stationedTrains']) for depot in lineObj['lineNodes']['depots']),
+                'depots': len(lineObj['lineNodes']['depots']),
+                'stages': benchmarkLine(linePath, stages, repeats, seedValue, mutations, solveEvaluations,
+                                        workDir / lineName)
+            }
+
+    outputPath = pathlib.Path(outputPath)
+    os.makedirs(outputPath.parent, exist_ok=True)
+    with open(outputPath, 'w') as f:
+        f.write(json.dumps(results, indent=2))
+    print(f"Benchmark written to {outputPath}")
+    if baselinePath is not None:
+        with open(baselinePath) as f:
+            compareResults(results, json.load(f))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', '-i', help="JSON problem the scaled lines are made from",
+                        default='../data/Line9780Problem.json', type=str)
+    parser.add_argument('--output', '-o', help="JSON file the timings are written to",
+                        default='../output/benchmark.json', type=str)
+    parser.add_argument('--lines', help="Lines to benchmark, by default all",
+                        choices=[line[0] for line in SCALED_LINES + GENERATED_LINES], nargs='+', default=None)
+    parser.add_argument('--stages', help="Stages to benchmark, by default all",
+                        choices=STAGES, nargs='+', default=list(STAGES))
+    parser.add_argument('--repeats', help="Timed runs of every stage but solve", default=5, type=int)
+    parser.add_argument('--seed', help="Seed of every timed run", default=0, type=int)
+    parser.add_argument('--mutations', help="Mutations per timed run of the mutation stage",
+                        default=1000, type=int)
+    parser.add_argument('--solve_evaluations', help="Evaluations of the end-to-end solve",
+                        default=200, type=int)
+    parser.add_argument('--baseline', help="Earlier benchmark JSON to compare against", default=None, type=str)
+    args = parser.parse_args()
+    main(args.input, args.output, args.lines, args.stages, args.repeats, args.seed, args.mutations,
+         args.solve_evaluations, args.baseline)
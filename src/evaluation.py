@@ -0,0 +1,500 @@
+import sqlite3
+import hashlib
+import json
+import logging
+import multiprocessing as mp
+from collections import OrderedDict
+import simpy
+import problemLoader
+import subway.simulation.utils as u
+from subway.simulation.errors import SimulationError, AnalyticEvaluationError
+from subway.analytic import LaunchReplay, checkAnalyticSupport, getRouteOffsets
+from sharedProblems import SharedProblems
+from profiling import startWorkerProfile
+from utils import getWorkerCount
+
+LOGGER = logging.getLogger('jmetal')
+
+INF = float('inf')
+
+
+def runSimulation(env, newSubwayProblem):
+    try:
+        env.run(until=newSubwayProblem.dayEndTimeSeconds)
+        totalWaiting = sum(station.accumulatedWaiting for _id, station in newSubwayProblem.Station)
+    except SimulationError:
+        totalWaiting = INF
+        # print("Current solution not feasible for simulation.")
+    except Exception:
+        totalWaiting = INF
+        # print("Unknown error during simulation for current simulation.")
+    return totalWaiting
+
+
+def runAnalyticSimulation(newSubwayProblem, replay=None):
+    # Same objective as runSimulation, computed from the launch schedule
+    # without SimPy. runSimulation stays the reference implementation.
+    try:
+        if replay is None:
+            replay = LaunchReplay(newSubwayProblem)
+        totalWaiting = replay.run()
+    except SimulationError:
+        totalWaiting = INF
+    except Exception:
+        totalWaiting = INF
+    return totalWaiting
+
+
+def getVariablesKey(variables):
+    """ Canonical, hashable form of TimePeriodSolution.variables:
+        ((depotId, (t0, t1, ...)), ...) ordered by depot id.
+    """
+    return tuple((depotId, tuple(variables[depotId])) for depotId in sorted(variables))
+
+
+def keyToString(key):
+    return ';'.join(f"{depotId}:{','.join(map(str, timePeriods))}" for depotId, timePeriods in key)
+
+
+def stringToVariables(keyString):
+    variables = {}
+    for depotString in keyString.split(';'):
+        depotId, timePeriods = depotString.split(':')
+        variables[int(depotId)] = list(map(int, timePeriods.split(',')))
+    return variables
+
+
+def getFirstChangeTime(variables, otherVariables):
+    """ Earliest time at which the headway schedules of two time period
+        vectors can differ, None if they can not be compared.
+    """
+    if variables.keys() != otherVariables.keys():
+        return None
+    changeTime = INF
+    for depotId, timePeriods in variables.items():
+        otherTimePeriods = otherVariables[depotId]
+        if len(timePeriods) != len(otherTimePeriods):
+            return None
+        for time, otherTime in zip(timePeriods, otherTimePeriods):
+            if time != otherTime:
+                changeTime = min(changeTime, time, otherTime)
+    return changeTime
+
+
+def getProblemHash(problemObj, problemConfig):
+    """ Content hash of a JSON problem and the configuration being
+        optimized, so that stored objectives are only ever reused for the
+        exact problem they were computed on.
+    """
+    content = json.dumps([problemObj, repr(sorted(problemConfig.items()))], sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class SharedEvaluationStore(object):
+    """ Objective values kept in an SQLite file, so that several processes
+        (eg. the joblib workers) or later solver runs see each other's
+        evaluations. Entries are grouped by problemHash, see getProblemHash.
+        The connection is opened lazily in every process that uses it.
+    """
+    def __init__(self, path, problemHash=''):
+        self.path = str(path)
+        self.problemHash = problemHash
+        self.connection = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['connection'] = None
+        return state
+
+    def getConnection(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS evaluations '
+                                    '(problemHash TEXT NOT NULL, key TEXT NOT NULL, objective REAL NOT NULL, '
+                                    'PRIMARY KEY (problemHash, key))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS evaluationsByObjective '
+                                    'ON evaluations (problemHash, objective)')
+        return self.connection
+
+    def get(self, key):
+        row = self.getConnection().execute('SELECT objective FROM evaluations WHERE problemHash = ? AND key = ?',
+                                           (self.problemHash, keyToString(key))).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, objective):
+        self.getConnection().execute('INSERT OR REPLACE INTO evaluations (problemHash, key, objective) '
+                                     'VALUES (?, ?, ?)',
+                                     (self.problemHash, keyToString(key), objective))
+
+    def getBest(self):
+        """ Returns (variables, objective) of the best stored evaluation
+            of this problem, or None if there are none.
+        """
+        row = self.getConnection().execute('SELECT key, objective FROM evaluations WHERE problemHash = ? '
+                                           'ORDER BY objective LIMIT 1', (self.problemHash,)).fetchone()
+        return None if row is None else (stringToVariables(row[0]), row[1])
+
+    def __len__(self):
+        return self.getConnection().execute('SELECT COUNT(*) FROM evaluations WHERE problemHash = ?',
+                                            (self.problemHash,)).fetchone()[0]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class EvaluationCache(object):
+    """ Memoizes objective values of time period vectors.
+
+        Keeps at most maxSize entries in memory, evicting the least recently
+        used one. When a sharedStore is given, in-memory misses are looked up
+        there and every new evaluation is written through to it. A
+        recordStore only has new evaluations written to it.
+    """
+    def __init__(self, maxSize=100000, sharedStore=None, recordStore=None):
+        self.maxSize = maxSize
+        self.sharedStore = sharedStore
+        self.recordStore = recordStore
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.sharedHits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def remember(self, key, objective):
+        self.entries[key] = objective
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def get(self, variables):
+        """ Returns the cached objective of variables or None. """
+        key = getVariablesKey(variables)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.sharedStore is not None:
+            objective = self.sharedStore.get(key)
+            if objective is not None:
+                self.remember(key, objective)
+                self.sharedHits += 1
+                return objective
+        self.misses += 1
+        return None
+
+    def put(self, variables, objective):
+        key = getVariablesKey(variables)
+        self.remember(key, objective)
+        if self.sharedStore is not None:
+            self.sharedStore.put(key, objective)
+        if self.recordStore is not None:
+            self.recordStore.put(key, objective)
+
+    def getStats(self):
+        lookups = self.hits + self.sharedHits + self.misses
+        return {
+            'hits': self.hits,
+            'sharedHits': self.sharedHits,
+            'misses': self.misses,
+            'hitRate': (self.hits + self.sharedHits) / lookups if lookups else 0.0,
+            'size': len(self.entries)
+        }
+
+
+def compileProblem(problemObj, evaluator='analytic'):
+    """ Builds the SubwayProblem of a JSON problem for repeated evaluation.
+        Returns (subwayProblem, evaluator, routeOffsets), evaluator being
+        'simulation' if the analytic evaluator does not support the problem,
+        and routeOffsets {route: getRouteOffsets(route)} for the analytic
+        evaluator, None otherwise.
+    """
+    subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
+    # Only the objective is read back during the search.
+    subwayProblem.setTraceEvents(False)
+    routeOffsets = None
+    if evaluator == 'analytic':
+        try:
+            checkAnalyticSupport(subwayProblem)
+            routeOffsets = {route: getRouteOffsets(route) for _id, route in subwayProblem.Route}
+        except AnalyticEvaluationError as e:
+            LOGGER.warning(f'Analytic evaluator not applicable, simulating instead: {e}')
+            evaluator = 'simulation'
+    return subwayProblem, evaluator, routeOffsets
+
+
+def shareProblems(problemObjs, evaluator='analytic'):
+    """ SharedProblems of the compiled {lineKey: problemObj}, see
+        compileProblem, for ProblemEvaluators in other processes.
+    """
+    return SharedProblems({lineKey: compileProblem(problemObj, evaluator)
+                           for lineKey, problemObj in problemObjs.items()})
+
+
+class ProblemEvaluator(object):
+    """ Scores time period vectors of one JSON problem.
+
+        The SubwayProblem is built from JSON on first use and only its
+        mutable simulation state is reset for each later evaluation.
+        evaluator: 'analytic' or 'simulation', analytic falls back to
+            simulation for problems it does not support.
+        sharedProblems: SharedProblems holding the compiled problem under
+            lineKey, used instead of building it from problemObj.
+
+        The analytic evaluator is incremental: the replays of the last
+        maxReplays evaluations are kept with checkpoints at every time
+        period boundary and every checkpointInterval seconds, and a new
+        vector is replayed from the latest checkpoint before its first
+        change (eg. a mutated boundary late in the day).
+    """
+    def __init__(self, problemObj, evaluator='analytic', maxReplays=8, checkpointInterval=3600,
+                 sharedProblems=None, lineKey=None):
+        self.problemObj = problemObj
+        self.evaluator = evaluator
+        self.maxReplays = maxReplays
+        self.checkpointInterval = checkpointInterval
+        self.sharedProblems = sharedProblems
+        self.lineKey = lineKey
+        self.subwayProblem = None
+        self.routeOffsets = None
+        self.replays = OrderedDict()
+
+    def __getstate__(self):
+        # The compiled problem is rebuilt, or mapped from sharedProblems,
+        # lazily in each worker process.
+        state = self.__dict__.copy()
+        state['subwayProblem'] = None
+        state['routeOffsets'] = None
+        state['replays'] = OrderedDict()
+        if self.sharedProblems is not None:
+            state['problemObj'] = None
+        return state
+
+    def getSubwayProblem(self):
+        if self.subwayProblem is None:
+            if self.sharedProblems is not None:
+                compiledProblem = self.sharedProblems.get(self.lineKey)
+            else:
+                compiledProblem = compileProblem(self.problemObj, self.evaluator)
+            self.subwayProblem, self.evaluator, self.routeOffsets = compiledProblem
+        else:
+            self.subwayProblem.reset()
+        return self.subwayProblem
+
+    def getCheckpointTimes(self, subwayProblem, variables):
+        times = set(range(0, subwayProblem.dayEndTimeSeconds, self.checkpointInterval))
+        for timePeriods in variables.values():
+            times.update(timePeriods)
+        return times
+
+    def createReplay(self, problemConfig, variables, subwayProblem):
+        """ Returns a LaunchReplay of variables, restored from the latest
+            valid checkpoint of the recent replays if there is one.
+        """
+        replay = LaunchReplay(subwayProblem, self.getCheckpointTimes(subwayProblem, variables), self.routeOffsets)
+        configKey = repr(sorted(problemConfig['headwayConfig'].items()))
+        bestCheckpoints, bestIndex, bestTime = None, None, -1
+        for (otherConfigKey, _key), (otherVariables, checkpoints) in self.replays.items():
+            if otherConfigKey != configKey:
+                continue
+            changeTime = getFirstChangeTime(variables, otherVariables)
+            if changeTime is None:
+                continue
+            for index in range(len(checkpoints) - 1, -1, -1):
+                if checkpoints[index].time <= bestTime:
+                    break
+                if checkpoints[index].isValidFrom(changeTime):
+                    bestCheckpoints, bestIndex, bestTime = checkpoints, index, checkpoints[index].time
+                    break
+        if bestCheckpoints is not None:
+            replay.restore(bestCheckpoints, bestIndex)
+        return replay
+
+    def rememberReplay(self, problemConfig, variables, replay):
+        key = (repr(sorted(problemConfig['headwayConfig'].items())), getVariablesKey(variables))
+        self.replays[key] = ({depotId: list(timePeriods) for depotId, timePeriods in variables.items()},
+                            replay.checkpoints)
+        self.replays.move_to_end(key)
+        if len(self.replays) > self.maxReplays:
+            self.replays.popitem(last=False)
+
+    def evaluate(self, problemConfig, variables):
+        """ Returns (totalWaiting, headwayFunctions) for the time periods
+            in variables, {depotId: [t0, t1, ...]}.
+        """
+        subwayProblem = self.getSubwayProblem()
+        headwayFunctions = problemLoader.loadHeadways(problemConfig, subwayProblem, variables)
+        if self.evaluator == 'analytic':
+            replay = self.createReplay(problemConfig, variables, subwayProblem)
+            waiting = runAnalyticSimulation(subwayProblem, replay)
+            self.rememberReplay(problemConfig, variables, replay)
+        else:
+            env = simpy.Environment()
+            problemLoader.loadEnvironment(env, subwayProblem)
+            waiting = runSimulation(env, subwayProblem)
+        return waiting, headwayFunctions
+
+
+# Evaluators of the current worker process, see EvaluationEngine
+workerEvaluatorType = None
+workerEvaluators = OrderedDict()
+# Lines a worker keeps compiled, the least recently used are dropped first
+maxWorkerLines = 16
+
+
+def initializeWorker(sharedProblems, evaluator, profileSettings=None):
+    global workerEvaluatorType
+    u.ENABLE_LOG = False
+    u.ENABLE_DEBUG_PRINT = False
+    startWorkerProfile(profileSettings)
+    workerEvaluatorType = evaluator
+    workerEvaluators.clear()
+    if sharedProblems is not None and len(sharedProblems.keys()) == 1:
+        getWorkerEvaluator(next(iter(sharedProblems.keys())), sharedProblems)
+
+
+def getWorkerEvaluator(lineKey, sharedProblems):
+    # Lines are mapped on their first evaluation in each worker.
+    key = (sharedProblems.path, lineKey)
+    if key not in workerEvaluators:
+        workerEvaluators[key] = ProblemEvaluator(None, workerEvaluatorType,
+                                                 sharedProblems=sharedProblems, lineKey=lineKey)
+        workerEvaluators[key].getSubwayProblem()
+        if len(workerEvaluators) > maxWorkerLines:
+            workerEvaluators.popitem(last=False)
+    workerEvaluators.move_to_end(key)
+    return workerEvaluators[key]
+
+
+def evaluateInWorker(lineKey, problemConfig, variablesBatch, sharedProblems):
+    evaluator = getWorkerEvaluator(lineKey, sharedProblems)
+    return [evaluator.evaluate(problemConfig, variables)[0] for variables in variablesBatch]
+
+
+def evaluateBatchCached(evaluationEngine, cache, problemConfig, feasibleSolutions):
+    """ Sets the objective of every solution, from the EvaluationCache or
+        else scored by evaluationEngine, all misses in one batch. The workers
+        only return objectives, headwayFunctions of the solutions are
+        cleared. Returns feasibleSolutions.
+    """
+    misses = {}
+    for solution in feasibleSolutions:
+        solution.headwayFunctions = None
+        waiting = cache.get(solution.variables)
+        if waiting is None:
+            misses.setdefault(getVariablesKey(solution.variables), solution.variables)
+        solution.objectives[0] = waiting
+    if misses:
+        objectives = evaluationEngine.evaluate(problemConfig, list(misses.values()))
+        for variables, waiting in zip(misses.values(), objectives):
+            cache.put(variables, waiting)
+        objectives = dict(zip(misses.keys(), objectives))
+        for solution in feasibleSolutions:
+            if solution.objectives[0] is None:
+                solution.objectives[0] = objectives[getVariablesKey(solution.variables)]
+    return feasibleSolutions
+
+
+class EvaluationEngine(object):
+    """ A persistent pool of worker processes that scores batches of
+        candidate time periods. The problems are compiled once, in this
+        process, and mapped by the workers, see SharedProblems.
+
+        numWorkers: worker processes, by default all but two cores
+        batchSize: candidates sent to a worker at once
+        problemObjs: {lineKey: problemObj} to share the pool between several
+            lines instead of serving problemObj only, see forLine
+        sharedProblems: the problems already compiled by shareProblems,
+            used instead of problemObj(s) and left open on close
+        profileSettings: profile every worker until the engine is closed,
+            see profiling.ProfileSettings
+
+        Without any problem the pool starts empty, lines can be added and
+        removed while it runs, see addProblems.
+    """
+    def __init__(self, problemObj=None, numWorkers=None, batchSize=8, evaluator='analytic', problemObjs=None,
+                 sharedProblems=None, profileSettings=None):
+        self.numWorkers = numWorkers if numWorkers else getWorkerCount()
+        self.batchSize = batchSize
+        self.evaluator = evaluator
+        # {lineKey: SharedProblems the line is compiled in}
+        self.lineProblems = {}
+        self.ownedProblems = []
+        if problemObjs is None and problemObj is not None:
+            problemObjs = {None: problemObj}
+        if sharedProblems is not None:
+            self.addProblems(sharedProblems, owned=False)
+        elif problemObjs:
+            sharedProblems = shareProblems(problemObjs, evaluator)
+            self.addProblems(sharedProblems)
+        self.pool = mp.Pool(self.numWorkers, initializer=initializeWorker,
+                            initargs=(sharedProblems, evaluator, profileSettings))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def lineKeys(self):
+        return self.lineProblems.keys()
+
+    def addProblems(self, sharedProblems, owned=True):
+        """ Serves the lines of sharedProblems, see shareProblems. Owned
+            SharedProblems are closed once all their lines are removed.
+        """
+        for lineKey in sharedProblems.keys():
+            self.lineProblems[lineKey] = sharedProblems
+        if owned:
+            self.ownedProblems.append(sharedProblems)
+
+    def removeProblems(self, lineKeys):
+        for lineKey in lineKeys:
+            self.lineProblems.pop(lineKey, None)
+        servedProblems = set(map(id, self.lineProblems.values()))
+        for sharedProblems in [owned for owned in self.ownedProblems if id(owned) not in servedProblems]:
+            self.ownedProblems.remove(sharedProblems)
+            sharedProblems.close()
+
+    def evaluate(self, problemConfig, variablesList, lineKey=None):
+        """ Returns the objectives of variablesList, in the same order. """
+        if lineKey not in self.lineProblems:
+            raise KeyError(f"Line {lineKey} is not served by this evaluation engine.")
+        sharedProblems = self.lineProblems[lineKey]
+        batches = [variablesList[i:i + self.batchSize] for i in range(0, len(variablesList), self.batchSize)]
+        results = self.pool.starmap(evaluateInWorker, [(lineKey, problemConfig, batch, sharedProblems)
+                                                       for batch in batches])
+        return [objective for batch in results for objective in batch]
+
+    def forLine(self, lineKey):
+        return LineEvaluationEngine(self, lineKey)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            for sharedProblems in self.ownedProblems:
+                sharedProblems.close()
+            self.ownedProblems = []
+
+
+class LineEvaluationEngine(object):
+    """ The part of a shared EvaluationEngine that serves one line. Closing
+        it leaves the pool running for the other lines.
+    """
+    def __init__(self, engine, lineKey):
+        self.engine = engine
+        self.lineKey = lineKey
+
+    def evaluate(self, problemConfig, variablesList):
+        return self.engine.evaluate(problemConfig, variablesList, self.lineKey)
+
+    def close(self):
+        pass
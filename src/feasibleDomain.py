@@ -0,0 +1,150 @@
+from bisect import bisect_right
+from itertools import accumulate
+import numpy as np
+import random
+
+class DepotDomain(object):
+    """ Every time period vector of one depot on a grid of
+        timeUnitInSeconds within its variable bounds whose intervals are
+        within its interval bounds.
+
+        The grid of every variable runs through its anchor, the configured
+        time period, as the mutations step from it by multiples of
+        timeUnitInSeconds; without anchors it starts at the lower bounds.
+        Variable i takes the values lower_i + j * timeUnitInSeconds. counts[i][j]
+        is the number of feasible vectors t_i..t_n with t_i at grid point j,
+        computed backwards with prefix sums in one pass over the grid. The
+        domain is then counted, ranked and sampled without enumerating it;
+        domains of at most tableSize vectors are enumerated into a table on
+        the first sample, after which sampling is a single random row.
+
+        The domain only provides feasible starting points and membership
+        checks. Moves are generated by the mutations and
+        optimization.BoundaryNeighbourhood alone, which stay inside it.
+    """
+    def __init__(self, variableBounds, intervalBounds, timeUnitInSeconds=600, tableSize=100000, anchors=None):
+        assert len(variableBounds) == len(intervalBounds) + 1
+        self.timeUnitInSeconds = timeUnitInSeconds
+        if anchors is not None:
+            variableBounds = [(anchor - (anchor - lower) // timeUnitInSeconds * timeUnitInSeconds,
+                               anchor + (upper - anchor) // timeUnitInSeconds * timeUnitInSeconds)
+                              for anchor, (lower, upper) in zip(anchors, variableBounds)]
+        self.lowers = [lower for lower, upper in variableBounds]
+        self.sizes = [max(0, (upper - lower) // timeUnitInSeconds + 1) for lower, upper in variableBounds]
+        self.intervalBounds = intervalBounds
+        self.counts = [None] * len(self.sizes)
+        self.prefixes = [None] * len(self.sizes)
+        self.counts[-1] = [1] * self.sizes[-1]
+        self.prefixes[-1] = [0] + list(accumulate(self.counts[-1]))
+        for i in reversed(range(len(self.sizes) - 1)):
+            prefix = self.prefixes[i + 1]
+            self.counts[i] = [prefix[last] - prefix[first] for first, last in
+                              (self.getSuccessors(i, j) for j in range(self.sizes[i]))]
+            self.prefixes[i] = [0] + list(accumulate(self.counts[i]))
+        self.size = self.prefixes[0][-1]
+        self.tableSize = tableSize
+        self.table = None
+
+    def getSuccessors(self, i, j):
+        """ Range of grid points of variable i + 1 whose interval to grid
+            point j of variable i is within its bounds.
+        """
+        value = self.lowers[i] + j * self.timeUnitInSeconds
+        minSize, maxSize = self.intervalBounds[i]
+        first = min(self.sizes[i + 1], max(0, -(-(value + minSize - self.lowers[i + 1]) // self.timeUnitInSeconds)))
+        last = min(self.sizes[i + 1], (value + maxSize - self.lowers[i + 1]) // self.timeUnitInSeconds + 1)
+        return first, max(first, last)
+
+    def getGridPoints(self, timePeriods):
+        # None if a value is off the grid or outside its variable bounds
+        gridPoints = []
+        for value, lower, size in zip(timePeriods, self.lowers, self.sizes):
+            j, offset = divmod(value - lower, self.timeUnitInSeconds)
+            if offset or not 0 <= j < size:
+                return None
+            gridPoints.append(j)
+        return gridPoints
+
+    def contains(self, timePeriods):
+        if len(timePeriods) != len(self.sizes):
+            return False
+        gridPoints = self.getGridPoints(timePeriods)
+        if gridPoints is None:
+            return False
+        for i in range(len(gridPoints) - 1):
+            first, last = self.getSuccessors(i, gridPoints[i])
+            if not first <= gridPoints[i + 1] < last:
+                return False
+        return True
+
+    def rank(self, timePeriods):
+        """ Index of a vector of the domain in the order of enumerate. """
+        gridPoints = self.getGridPoints(timePeriods)
+        index = self.prefixes[0][gridPoints[0]]
+        for i in range(1, len(gridPoints)):
+            first = self.getSuccessors(i - 1, gridPoints[i - 1])[0]
+            index += self.prefixes[i][gridPoints[i]] - self.prefixes[i][first]
+        return index
+
+    def unrank(self, index):
+        """ The feasible vector at index in the order of enumerate. """
+        if not 0 <= index < self.size:
+            raise IndexError(f"Time period vector {index} of {self.size}")
+        first = 0
+        timePeriods = []
+        for i in range(len(self.sizes)):
+            # The grid point whose completions cover index
+            j = bisect_right(self.prefixes[i], index + self.prefixes[i][first]) - 1
+            index -= self.prefixes[i][j] - self.prefixes[i][first]
+            timePeriods.append(self.lowers[i] + j * self.timeUnitInSeconds)
+            if i + 1 < len(self.sizes):
+                first = self.getSuccessors(i, j)[0]
+        return timePeriods
+
+    def sample(self):
+        """ A uniformly drawn feasible vector. """
+        if self.size == 0:
+            raise ValueError("No feasible time periods")
+        if self.table is None and self.size <= self.tableSize:
+            self.table = self.enumerate()
+        index = random.randrange(self.size)
+        if self.table is not None:
+            return self.table[index].tolist()
+        return self.unrank(index)
+
+    def enumerate(self):
+        """ All feasible vectors as rows of an array, in lexicographic order. """
+        rows = [[j] for j in range(self.sizes[0]) if self.counts[0][j]]
+        for i in range(len(self.sizes) - 1):
+            rows = [row + [k] for row in rows for k in range(*self.getSuccessors(i, row[-1]))
+                    if self.counts[i + 1][k]]
+        gridPoints = np.array(rows, dtype=np.int64).reshape(len(rows), len(self.sizes))
+        return np.array(self.lowers, dtype=np.int64) + gridPoints * self.timeUnitInSeconds
+
+class TimePeriodDomain(object):
+    """ The feasible time periods of all depots, a DepotDomain per depot
+        anchored at the time periods of anchors, {depotId: [t0, t1, ...]},
+        if given. Depots are independent, so a uniform sample of every depot
+        is a uniform sample of the whole domain.
+    """
+    def __init__(self, variableBounds, intervalBounds, timeUnitInSeconds=600, tableSize=100000, anchors=None):
+        self.depots = {depotId: DepotDomain(variableBounds[depotId], intervalBounds[depotId],
+                                            timeUnitInSeconds, tableSize,
+                                            anchors[depotId] if anchors is not None else None)
+                       for depotId in variableBounds}
+
+    def getSize(self):
+        size = 1
+        for domain in self.depots.values():
+            size *= domain.size
+        return size
+
+    def getEmptyDepots(self):
+        return [depotId for depotId, domain in self.depots.items() if domain.size == 0]
+
+    def contains(self, variables):
+        return variables.keys() == self.depots.keys() and \
+               all(domain.contains(variables[depotId]) for depotId, domain in self.depots.items())
+
+    def sample(self):
+        return {depotId: domain.sample() for depotId, domain in self.depots.items()}
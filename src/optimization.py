@@ -1,8 +1,14 @@
 from jmetal.core.problem import Problem
 from jmetal.core.operator import Mutation
 from jmetal.core.solution import Solution
+from jmetal.core.algorithm import Algorithm
+from jmetal.util.observable import DefaultObservable
 from abc import ABC, abstractmethod
+import numpy as np
 import random
+import math
+import copy
+import time
 from utils import secondsToString
 
 class TimePeriodSolution(object):
@@ -32,72 +38,60 @@ class TimePeriodSolution(object):
 
     def __copy__(self):
         new_solution = TimePeriodSolution(self.variables, self.variableBounds, self.intervalBounds)
-        new_solution.objectives = self.objectives
+        new_solution.objectives = list(self.objectives)
         new_solution.headwayFunctions = self.headwayFunctions
+        return new_solution
 
 class RandomGenerator(object):
     def new(self, problem: Problem, solution):
         return problem.create_solution(solution)
 
+timeUnitInSeconds = 600
+validMoveDirections = ('left', 'right')
+directionMultipliers = {'left': -1, 'right': 1}
+
+def getMaxStepSize(timePeriods, timeSlot, moveDirection, variableBounds, intervalBounds):
+    """ Largest step the boundary timePeriods[timeSlot] can move in
+        moveDirection keeping itself within its variable bounds and the two
+        intervals next to it within their interval bounds.
+    """
+    leftInterval = timeSlot - 1
+    rightInterval = timeSlot
+    variableValue = timePeriods[timeSlot]
+    leftIntervalSize = variableValue - timePeriods[leftInterval]
+    rightIntervalSize = timePeriods[timeSlot + 1] - variableValue
+    if moveDirection == 'left':
+        # left interval will shrink & right will grow
+        # this should be within bounds
+        maxStepSizeByLeftInterval = leftIntervalSize - intervalBounds[leftInterval][0]
+        maxStepSizeByRightInterval = intervalBounds[rightInterval][1] - rightIntervalSize
+        maxStepSizeByVariable = variableValue - variableBounds[timeSlot][0]
+    else:
+        # right interval shrinks, left grows
+        maxStepSizeByLeftInterval = intervalBounds[leftInterval][1] - leftIntervalSize
+        maxStepSizeByRightInterval = rightIntervalSize - intervalBounds[rightInterval][0]
+        maxStepSizeByVariable = variableBounds[timeSlot][1] - variableValue
+    return min(maxStepSizeByLeftInterval, maxStepSizeByRightInterval, maxStepSizeByVariable)
+
+def randomMove(timePeriods, timeSlot, moveDirection, variableBounds, intervalBounds):
+    # Moves the boundary a random multiple of timeUnitInSeconds within bounds.
+    maxStepSize = getMaxStepSize(timePeriods, timeSlot, moveDirection, variableBounds, intervalBounds)
+    stepSize = random.random() * maxStepSize
+    stepSize -= stepSize % timeUnitInSeconds
+    stepSize = int(stepSize)
+    timePeriods[timeSlot] += directionMultipliers[moveDirection] * stepSize
+
 class RandomMutationSingle(Mutation[TimePeriodSolution]):
     def __init__(self, probability=0.5):
         super().__init__(probability=probability)
 
     def execute(self, solution:TimePeriodSolution):
-        timeUnitInSeconds = 600
-        validMoveDirections = ('left', 'right')
-        directionMultipliers = {'left': -1, 'right': 1}
         variables = solution.variables
         for depotId, timePeriods in variables.items():
-            variableBounds = solution.variableBounds[depotId]
-            intervalBounds = solution.intervalBounds[depotId]
             timeSlot = random.choice(range(1, len(timePeriods) - 1))
             moveDirection = random.choice(validMoveDirections)
-            intervalSizes = [t2 - t1 for t1, t2 in zip(timePeriods[:-1], timePeriods[1:])]
-
-            leftInterval = timeSlot - 1
-            rightInterval = timeSlot
-            if moveDirection == 'left':
-                # left interval will shrink & right will grow
-                # this should be within bounds
-                leftIntervalSize = intervalSizes[leftInterval]
-                leftIntervalLowerBound = intervalBounds[leftInterval][0]
-                maxStepSizeByLeftInterval = leftIntervalSize - leftIntervalLowerBound
-
-                rightIntervalSize = intervalSizes[rightInterval]
-                rightIntervalUpperBound = intervalBounds[rightInterval][1]
-                maxStepSizeByRightInterval = rightIntervalUpperBound - rightIntervalSize
-
-                maxStepSizeByIntervals = min(maxStepSizeByLeftInterval, maxStepSizeByRightInterval)
-
-                variableValue = timePeriods[timeSlot]
-                variableValueLowerBound = variableBounds[timeSlot][0]
-                maxStepSizeByVariable = variableValue - variableValueLowerBound
-
-                maxStepSize = min(maxStepSizeByIntervals, maxStepSizeByVariable)
-            else:
-                # right interval shrinks, left grows
-                leftIntervalSize = intervalSizes[leftInterval]
-                leftIntervalUpperBound = intervalBounds[leftInterval][1]
-                maxStepSizeByLeftInterval = leftIntervalUpperBound - leftIntervalSize
-
-                rightIntervalSize = intervalSizes[rightInterval]
-                rightIntervalLowerBound = intervalBounds[rightInterval][0]
-                maxStepSizeByRightInterval = rightIntervalSize - rightIntervalLowerBound
-
-                maxStepSizeByIntervals = min(maxStepSizeByLeftInterval, maxStepSizeByRightInterval)
-
-                variableValue = timePeriods[timeSlot]
-                variableValueUpperBound = variableBounds[timeSlot][1]
-                maxStepSizeByVariable = variableValueUpperBound - variableValue
-
-                maxStepSize = min(maxStepSizeByIntervals, maxStepSizeByVariable)
-
-            stepSize = random.random() * maxStepSize
-            stepSize -= stepSize % timeUnitInSeconds
-            stepSize = int(stepSize)
-            delta = directionMultipliers[moveDirection] * stepSize
-            timePeriods[timeSlot] += delta
+            randomMove(timePeriods, timeSlot, moveDirection,
+                       solution.variableBounds[depotId], solution.intervalBounds[depotId])
         return solution
 
     def get_name(self) -> str:
@@ -108,9 +102,6 @@ class RandomMutationAll(Mutation[TimePeriodSolution]):
         super().__init__(probability=probability)
 
     def execute(self, solution:TimePeriodSolution):
-        timeUnitInSeconds = 600
-        validMoveDirections = ('left', 'right')
-        directionMultipliers = {'left': -1, 'right': 1}
         variables = solution.variables
         for depotId, timePeriods in variables.items():
             variableBounds = solution.variableBounds[depotId]
@@ -118,56 +109,77 @@ class RandomMutationAll(Mutation[TimePeriodSolution]):
             for timeSlot in range(1, len(timePeriods) - 1):
                 if random.random() < self.probability:
                     moveDirection = random.choice(validMoveDirections)
-                    intervalSizes = [t2 - t1 for t1, t2 in zip(timePeriods[:-1], timePeriods[1:])]
-
-                    leftInterval = timeSlot - 1
-                    rightInterval = timeSlot
-                    if moveDirection == 'left':
-                        # left interval will shrink & right will grow
-                        # this should be within bounds
-                        leftIntervalSize = intervalSizes[leftInterval]
-                        leftIntervalLowerBound = intervalBounds[leftInterval][0]
-                        maxStepSizeByLeftInterval = leftIntervalSize - leftIntervalLowerBound
-
-                        rightIntervalSize = intervalSizes[rightInterval]
-                        rightIntervalUpperBound = intervalBounds[rightInterval][1]
-                        maxStepSizeByRightInterval = rightIntervalUpperBound - rightIntervalSize
-
-                        maxStepSizeByIntervals = min(maxStepSizeByLeftInterval, maxStepSizeByRightInterval)
-
-                        variableValue = timePeriods[timeSlot]
-                        variableValueLowerBound = variableBounds[timeSlot][0]
-                        maxStepSizeByVariable = variableValue - variableValueLowerBound
-
-                        maxStepSize = min(maxStepSizeByIntervals, maxStepSizeByVariable)
-                    else:
-                        # right interval shrinks, left grows
-                        leftIntervalSize = intervalSizes[leftInterval]
-                        leftIntervalUpperBound = intervalBounds[leftInterval][1]
-                        maxStepSizeByLeftInterval = leftIntervalUpperBound - leftIntervalSize
-
-                        rightIntervalSize = intervalSizes[rightInterval]
-                        rightIntervalLowerBound = intervalBounds[rightInterval][0]
-                        maxStepSizeByRightInterval = rightIntervalSize - rightIntervalLowerBound
-
-                        maxStepSizeByIntervals = min(maxStepSizeByLeftInterval, maxStepSizeByRightInterval)
-
-                        variableValue = timePeriods[timeSlot]
-                        variableValueUpperBound = variableBounds[timeSlot][1]
-                        maxStepSizeByVariable = variableValueUpperBound - variableValue
-
-                        maxStepSize = min(maxStepSizeByIntervals, maxStepSizeByVariable)
-
-                    stepSize = random.random() * maxStepSize
-                    stepSize -= stepSize % timeUnitInSeconds
-                    stepSize = int(stepSize)
-                    delta = directionMultipliers[moveDirection] * stepSize
-                    timePeriods[timeSlot] += delta
+                    randomMove(timePeriods, timeSlot, moveDirection, variableBounds, intervalBounds)
         return solution
 
     def get_name(self) -> str:
         return 'RandomMutation'
 
+class BoundaryNeighbourhood(object):
+    """ Every feasible move of a single time period boundary of a solution
+        by up to maxSteps steps of stepSize seconds, left or right.
+
+        The time periods of all depots are flattened into one row, depots in
+        the order of solution.variables. moves holds per move the column of
+        the boundary in that row and its delta in seconds, and a batch of
+        moves turns into a candidate array of rows in one NumPy operation.
+    """
+    def __init__(self, solution, stepSize=timeUnitInSeconds, maxSteps=1):
+        self.solution = solution
+        self.depotIds = list(solution.variables)
+        self.row = np.array([t for depotId in self.depotIds for t in solution.variables[depotId]],
+                            dtype=np.int64)
+        self.offsets = np.cumsum([0] + [len(solution.variables[depotId]) for depotId in self.depotIds])
+        columns = []
+        maxLeftSteps = []
+        maxRightSteps = []
+        for depotId, offset in zip(self.depotIds, self.offsets):
+            timePeriods = self.row[offset:offset + len(solution.variables[depotId])]
+            variableBounds = np.array(solution.variableBounds[depotId], dtype=np.int64).reshape(-1, 2)[1:-1]
+            intervalBounds = np.array(solution.intervalBounds[depotId], dtype=np.int64).reshape(-1, 2)
+            intervalSizes = np.diff(timePeriods)
+            boundaries = timePeriods[1:-1]
+            # Same bounds as getMaxStepSize, for all boundaries of the depot at once
+            maxLeftSteps.append(np.minimum.reduce([intervalSizes[:-1] - intervalBounds[:-1, 0],
+                                                   intervalBounds[1:, 1] - intervalSizes[1:],
+                                                   boundaries - variableBounds[:, 0]]))
+            maxRightSteps.append(np.minimum.reduce([intervalBounds[:-1, 1] - intervalSizes[:-1],
+                                                    intervalSizes[1:] - intervalBounds[1:, 0],
+                                                    variableBounds[:, 1] - boundaries]))
+            columns.append(offset + np.arange(1, len(timePeriods) - 1))
+        columns = np.concatenate(columns)
+        steps = stepSize * np.arange(1, maxSteps + 1)
+        deltas = np.concatenate([-steps[::-1], steps])
+        feasible = np.concatenate([steps[::-1] <= np.concatenate(maxLeftSteps)[:, None],
+                                   steps <= np.concatenate(maxRightSteps)[:, None]], axis=1)
+        boundaryIndex, deltaIndex = np.nonzero(feasible)
+        self.moves = np.column_stack([columns[boundaryIndex], deltas[deltaIndex]])
+
+    def __len__(self):
+        return len(self.moves)
+
+    def sample(self, size):
+        """ At most size moves drawn without replacement. """
+        if size >= len(self.moves):
+            return self.moves
+        return self.moves[sorted(random.sample(range(len(self.moves)), size))]
+
+    def getCandidates(self, moves=None):
+        """ One row of time periods per move, all moves by default. """
+        moves = self.moves if moves is None else moves
+        candidates = np.repeat(self.row[None, :], len(moves), axis=0)
+        candidates[np.arange(len(moves)), moves[:, 0]] += moves[:, 1]
+        return candidates
+
+    def getSolutions(self, moves=None):
+        solutions = []
+        for candidate in self.getCandidates(moves).tolist():
+            variables = {depotId: candidate[start:end] for depotId, start, end in
+                         zip(self.depotIds, self.offsets[:-1], self.offsets[1:])}
+            solutions.append(TimePeriodSolution(variables, self.solution.variableBounds,
+                                                self.solution.intervalBounds))
+        return solutions
+
 class TimePeriodsProblemBase(object):
     """ Class representing integer problems. """
 
@@ -179,16 +191,245 @@ class TimePeriodsProblemBase(object):
         # self.number_of_variables = len(list(feasibleSolution.values())[0])
         self.obj_directions = [self.MINIMIZE]
         self.obj_labels = ['TotalWaitingTime']
+        # A TimePeriodDomain to draw new solutions from, see create_solution
+        self.feasibleDomain = None
 
     @abstractmethod
     def evaluate(self, feasibleSolution):
         pass
 
+    def evaluateBatch(self, feasibleSolutions):
+        # Problems that can score several solutions at once override this.
+        return [self.evaluate(solution) for solution in feasibleSolutions]
+
     def create_solution(self, solution: TimePeriodSolution) -> TimePeriodSolution:
+        if self.feasibleDomain is not None:
+            return TimePeriodSolution(self.feasibleDomain.sample(),
+                                      self.feasibleSolution.variableBounds,
+                                      self.feasibleSolution.intervalBounds)
         new_solution = TimePeriodSolution(self.feasibleSolution.variables,
                                           self.feasibleSolution.variableBounds,
                                           self.feasibleSolution.intervalBounds)
         return RandomMutationSingle().execute(solution=new_solution)
 
     def get_name(self) -> str:
-        return 'TimePeriodsProblem'
\ No newline at end of file
+        return 'TimePeriodsProblem'
+
+class ReplicaExchangeAnnealing(Algorithm[TimePeriodSolution, TimePeriodSolution]):
+    """ Parallel tempering: simulated annealing chains (replicas) run at a
+        ladder of fixed temperatures and periodically swap their states.
+
+        Every step each replica proposes a mutated copy of its state. All
+        proposals are scored in one problem.evaluateBatch call and accepted
+        with the Metropolis rule at the replica's temperature. Every
+        exchangeInterval steps neighbouring replicas try to swap states, so
+        that good states found by the hot chains move down to the cold ones.
+
+        Temperatures are geometrically spaced between minTemperature and
+        maxTemperature, both relative to the initial objective value.
+    """
+    def __init__(self, problem, mutation, termination_criterion, initial_solution,
+                 numReplicas=8, minTemperature=1e-5, maxTemperature=1e-3, exchangeInterval=10):
+        super().__init__()
+        self.observable = DefaultObservable()
+        self.problem = problem
+        self.mutation = mutation
+        self.termination_criterion = termination_criterion
+        self.observable.register(termination_criterion)
+        self.initial_solution = initial_solution
+        if numReplicas > 1:
+            ratio = (maxTemperature / minTemperature) ** (1 / (numReplicas - 1))
+            self.relativeTemperatures = [minTemperature * ratio ** i for i in range(numReplicas)]
+        else:
+            self.relativeTemperatures = [minTemperature]
+        self.exchangeInterval = exchangeInterval
+        self.temperatures = None
+        self.best = None
+        # Per replica, for telemetry, see getChainStates
+        self.bestObjectives = None
+        self.proposals = [0] * len(self.relativeTemperatures)
+        self.acceptances = [0] * len(self.relativeTemperatures)
+        self.steps = 0
+        self.exchangeAttempts = 0
+        self.exchangesAccepted = 0
+
+    def create_initial_solutions(self):
+        return [copy.copy(self.initial_solution) for _ in self.relativeTemperatures]
+
+    def evaluate(self, solution_list):
+        return self.problem.evaluateBatch(solution_list)
+
+    def init_progress(self):
+        self.evaluations = len(self.solutions)
+        self.best = copy.copy(min(self.solutions, key=lambda solution: solution.objectives[0]))
+        scale = abs(self.best.objectives[0]) or 1
+        self.temperatures = [scale * temperature for temperature in self.relativeTemperatures]
+        self.bestObjectives = [solution.objectives[0] for solution in self.solutions]
+
+    def stopping_condition_is_met(self):
+        return self.termination_criterion.is_met
+
+    @staticmethod
+    def accept(current, new, temperature):
+        if new <= current:
+            return True
+        return random.random() < math.exp(-(new - current) / temperature)
+
+    def step(self):
+        candidates = [self.mutation.execute(copy.copy(solution)) for solution in self.solutions]
+        candidates = self.evaluate(candidates)
+        for replica, candidate in enumerate(candidates):
+            current = self.solutions[replica]
+            self.proposals[replica] += 1
+            if self.accept(current.objectives[0], candidate.objectives[0], self.temperatures[replica]):
+                self.solutions[replica] = candidate
+                self.acceptances[replica] += 1
+                self.bestObjectives[replica] = min(self.bestObjectives[replica], candidate.objectives[0])
+                if candidate.objectives[0] < self.best.objectives[0]:
+                    self.best = copy.copy(candidate)
+        self.evaluations += len(candidates)
+        self.steps += 1
+        if self.steps % self.exchangeInterval == 0:
+            self.exchange()
+
+    def exchange(self):
+        # Even and odd neighbouring pairs take turns, replica 0 is the coldest.
+        first = (self.steps // self.exchangeInterval) % 2
+        for cold in range(first, len(self.solutions) - 1, 2):
+            hot = cold + 1
+            coldObjective = self.solutions[cold].objectives[0]
+            hotObjective = self.solutions[hot].objectives[0]
+            exponent = (1 / self.temperatures[cold] - 1 / self.temperatures[hot]) * (coldObjective - hotObjective)
+            self.exchangeAttempts += 1
+            if exponent >= 0 or random.random() < math.exp(exponent):
+                self.solutions[cold], self.solutions[hot] = self.solutions[hot], self.solutions[cold]
+                self.exchangesAccepted += 1
+                self.bestObjectives[cold] = min(self.bestObjectives[cold], hotObjective)
+                self.bestObjectives[hot] = min(self.bestObjectives[hot], coldObjective)
+
+    def update_progress(self):
+        observable_data = self.get_observable_data()
+        self.observable.notify_all(**observable_data)
+
+    def getChainStates(self):
+        """ Per replica, coldest first: temperature, currentObjective,
+            bestObjective, proposals and acceptances.
+        """
+        return [{
+            'temperature': temperature,
+            'currentObjective': solution.objectives[0],
+            'bestObjective': bestObjective,
+            'proposals': proposals,
+            'acceptances': acceptances
+        } for temperature, solution, bestObjective, proposals, acceptances in
+            zip(self.temperatures, self.solutions, self.bestObjectives, self.proposals, self.acceptances)]
+
+    def get_observable_data(self):
+        ctime = time.time() - self.start_computing_time
+        return {'PROBLEM': self.problem, 'EVALUATIONS': self.evaluations, 'SOLUTIONS': self.get_result(),
+                'COMPUTING_TIME': ctime, 'CHAINS': self.getChainStates()}
+
+    def get_result(self):
+        return self.best
+
+    def get_name(self):
+        return 'ReplicaExchangeAnnealing'
+
+class NeighbourhoodSearch(Algorithm[TimePeriodSolution, TimePeriodSolution]):
+    """ Steepest descent or tabu search over BoundaryNeighbourhood moves.
+
+        Every step the whole neighbourhood of the current solution, or a
+        random sample of sampleSize moves, is scored in one
+        problem.evaluateBatch call and the best move is taken. Without a
+        tabu tenure only improving moves are taken and the search stops in
+        a local optimum. With one, the best move is taken even if it is
+        worse, and moving a boundary back is tabu for tabuTenure steps
+        unless it finds a new best solution.
+    """
+    def __init__(self, problem, termination_criterion, initial_solution,
+                 sampleSize=None, tabuTenure=0, maxSteps=1):
+        super().__init__()
+        self.observable = DefaultObservable()
+        self.problem = problem
+        self.termination_criterion = termination_criterion
+        self.observable.register(termination_criterion)
+        self.initial_solution = initial_solution
+        self.sampleSize = sampleSize
+        self.tabuTenure = tabuTenure
+        self.maxSteps = maxSteps
+        self.best = None
+        # (column, moves right): last step the move is tabu
+        self.tabu = {}
+        self.steps = 0
+        self.moves = 0
+        self.converged = False
+
+    def create_initial_solutions(self):
+        return [copy.copy(self.initial_solution)]
+
+    def evaluate(self, solution_list):
+        return self.problem.evaluateBatch(solution_list)
+
+    def init_progress(self):
+        self.evaluations = len(self.solutions)
+        self.best = copy.copy(self.solutions[0])
+
+    def stopping_condition_is_met(self):
+        return self.converged or self.termination_criterion.is_met
+
+    def step(self):
+        current = self.solutions[0]
+        neighbourhood = BoundaryNeighbourhood(current, maxSteps=self.maxSteps)
+        moves = neighbourhood.moves if self.sampleSize is None else neighbourhood.sample(self.sampleSize)
+        self.steps += 1
+        if len(moves) == 0:
+            self.converged = True
+            return
+        candidates = self.evaluate(neighbourhood.getSolutions(moves))
+        self.evaluations += len(candidates)
+        objectives = np.array([candidate.objectives[0] for candidate in candidates], dtype=float)
+        admissible = objectives < self.best.objectives[0]
+        for index, (column, delta) in enumerate(moves.tolist()):
+            if self.tabu.get((column, delta > 0), 0) < self.steps:
+                admissible[index] = True
+        if not admissible.any():
+            return
+        chosen = np.flatnonzero(admissible)[np.argmin(objectives[admissible])]
+        candidate = candidates[chosen]
+        if self.tabuTenure == 0 and candidate.objectives[0] >= current.objectives[0]:
+            # A local optimum, unless a sample missed the improving moves
+            self.converged = self.sampleSize is None or len(moves) == len(neighbourhood)
+            return
+        column, delta = moves[chosen].tolist()
+        self.tabu[(column, delta < 0)] = self.steps + self.tabuTenure
+        self.solutions[0] = candidate
+        self.moves += 1
+        if candidate.objectives[0] < self.best.objectives[0]:
+            self.best = copy.copy(candidate)
+
+    def update_progress(self):
+        observable_data = self.get_observable_data()
+        self.observable.notify_all(**observable_data)
+
+    def getChainStates(self):
+        """ The search as a single chain without a temperature, every
+            evaluation counted as a proposal and every move taken accepted.
+        """
+        return [{
+            'temperature': None,
+            'currentObjective': self.solutions[0].objectives[0],
+            'bestObjective': self.best.objectives[0],
+            'proposals': self.evaluations,
+            'acceptances': self.moves
+        }]
+
+    def get_observable_data(self):
+        ctime = time.time() - self.start_computing_time
+        return {'PROBLEM': self.problem, 'EVALUATIONS': self.evaluations, 'SOLUTIONS': self.get_result(),
+                'COMPUTING_TIME': ctime, 'CHAINS': self.getChainStates()}
+
+    def get_result(self):
+        return self.best
+
+    def get_name(self):
+        return 'NeighbourhoodSearch' if self.tabuTenure == 0 else 'TabuSearch'
@@ -0,0 +1,266 @@
+import argparse
+import json
+import math
+import os
+import pathlib
+import numpy as np
+from utils import stringToSeconds, secondsToString
+
+# Time period boundaries of a generated day, between dayBeginTime and
+# dayEndTime: early, AM shoulder, AM peak, midday, PM peak, evening, late.
+PERIOD_BOUNDARIES = ('06:30:00', '07:30:00', '10:00:00', '16:30:00', '19:30:00', '21:30:00')
+# Headway of every time period relative to the peak headway of the depot
+HEADWAY_FACTORS = (3, 1.5, 1, 2, 1, 1.5, 3)
+# Demand peaks (hour, spread in hours), the AM peak being heavier towards
+# the centre and the PM peak away from it
+AM_PEAK = (8.25, 0.9)
+PM_PEAK = (18.0, 1.1)
+MIDDAY = (13.0, 2.5)
+
+
+def getDemandRates(timeSlots, inbound):
+    """ Passengers per 10 minutes at a station of weight 1 for every time
+        slot (seconds): a morning and an evening peak over a midday hump and
+        a low base level. inbound stations, those run towards the centre,
+        have the heavier morning peak.
+    """
+    hours = np.asarray(timeSlots, dtype=float) / 3600
+    bump = lambda peak: np.exp(-0.5 * ((hours - peak[0]) / peak[1]) ** 2)
+    amWeight, pmWeight = (1.0, 0.5) if inbound else (0.5, 1.0)
+    return 150 * (0.2 + amWeight * bump(AM_PEAK) + pmWeight * bump(PM_PEAK) + 0.35 * bump(MIDDAY))
+
+
+def getDemand(rng, weight, dayBeginSeconds, dayEndSeconds, resolution, inbound):
+    """ passengerDemand of one station, Poisson arrivals every resolution
+        seconds. There are none in the first quarter hour of the day.
+    """
+    timeSlots = list(range(dayBeginSeconds + resolution, dayEndSeconds, resolution))
+    rates = getDemandRates(timeSlots, inbound) * weight * resolution / 600
+    rates[np.asarray(timeSlots) < dayBeginSeconds + 900] = 0
+    counts = rng.poisson(rates)
+    return {secondsToString(timeSlot): int(count) for timeSlot, count in zip(timeSlots, counts)}
+
+
+def roundUp(seconds, step):
+    return int(math.ceil(seconds / step) * step)
+
+
+def getTimePeriods(dayBeginSeconds, dayEndSeconds, shift):
+    """ Time period boundaries of the day, the inner ones moved by shift
+        seconds and kept between the day bounds.
+    """
+    inner = [min(max(stringToSeconds(boundary) + shift, dayBeginSeconds + 3600), dayEndSeconds - 3600)
+             for boundary in PERIOD_BOUNDARIES]
+    return [dayBeginSeconds] + sorted(inner) + [dayEndSeconds]
+
+
+def getTimePeriodConfigurations(dayBeginSeconds, dayEndSeconds, numConfigurations):
+    # Every configuration moves the peaks 10 minutes earlier than the last.
+    sequences = []
+    windows = []
+    for configuration in range(numConfigurations):
+        timePeriods = getTimePeriods(dayBeginSeconds, dayEndSeconds, -600 * configuration)
+        sequences.append(list(map(secondsToString, timePeriods)))
+        windows.append(['00:00:00'] + ['01:00:00'] * (len(timePeriods) - 2) + ['00:00:00'])
+    return {'timePeriodSequence': sequences, 'plusOrMinusWindows': windows}
+
+
+def getHeadwayConfigurations(peakHeadway, dayBeginSeconds, dayEndSeconds, numConfigurations):
+    # Every configuration runs a quarter less frequently than the last, so
+    # all of them can be served by the trains of the depot. Period sizes
+    # may shrink to half an hour and grow by two hours.
+    timePeriods = getTimePeriods(dayBeginSeconds, dayEndSeconds, 0)
+    sizes = [end - begin for begin, end in zip(timePeriods[:-1], timePeriods[1:])]
+    headways = []
+    for configuration in range(numConfigurations):
+        scale = peakHeadway * (1 + 0.25 * configuration)
+        headways.append([secondsToString(roundUp(scale * factor, 30)) for factor in HEADWAY_FACTORS])
+    return {
+        'headwaySequence': headways,
+        'timePeriodMinSizes': [[secondsToString(min(1800, size)) for size in sizes]] * numConfigurations,
+        'timePeriodMaxSizes': [[secondsToString(size + 7200) for size in sizes]] * numConfigurations
+    }
+
+
+def splitEvenly(total, parts):
+    return [total // parts + (1 if part < total % parts else 0) for part in range(parts)]
+
+
+def generateProblem(numStations=40, numDepots=1, numRoutes=None, numTrains=32, numBranches=1,
+                    numLaunchAndForgetDepots=0, trainsPerLaunchAndForgetDepot=4, demandResolution=600,
+                    numConfigurations=1, seed=0, lineId=90000, dayBeginTime='05:00:00', dayEndTime='25:00:00'):
+    """ A JSON problem, in the schema ttpJsonBuilder writes, of a line of
+        numStations stations (both directions counted).
+
+        The line is a trunk running out from the centre, splitting into
+        numBranches branches at its outer end. The depots stand along the
+        trunk, depot k serving routes from its position out to the end of a
+        branch and back; numRoutes (by default one per depot and branch)
+        are handed out to the depots in turn. LaunchAndForgetDepots stand at
+        the branch ends and launch their trains inbound, towards a depot
+        that takes them over.
+
+        Travel and dwell times are drawn from seed. Demand is peak shaped,
+        see getDemandRates, at demandResolution seconds. Every depot has
+        numConfigurations headway and time period configurations, the
+        problem numConfigurations ** (2 * depots) configurations. The
+        trains are split between the depots and the peak headway of each
+        depot set so that its trains can run it, so the generated time
+        periods are feasible.
+    """
+    half = numStations // 2
+    numRoutes = numRoutes if numRoutes else numDepots * numBranches
+    assert numStations % 2 == 0, "Stations come in pairs, one per direction."
+    assert 1 <= numBranches and numDepots <= numRoutes, "Every depot needs a route."
+    branchLength = half // (numBranches + 1) if numBranches > 1 else 0
+    trunkLength = half - branchLength * numBranches
+    assert trunkLength >= numDepots, "Every depot needs a trunk station of its own."
+    numRegularTrains = numTrains - numLaunchAndForgetDepots * trainsPerLaunchAndForgetDepot
+    assert numRegularTrains >= 2 * numDepots, "Every depot needs at least two trains."
+
+    rng = np.random.default_rng(seed)
+    dayBeginSeconds = stringToSeconds(dayBeginTime)
+    dayEndSeconds = stringToSeconds(dayEndTime)
+
+    # Segments of the line as lists of outbound station positions, the
+    # inbound station of a position facing the outbound one. Branches
+    # continue the trunk; with one branch the trunk is the whole line.
+    positions = list(range(half))
+    trunk = positions[:trunkLength]
+    branches = [positions[trunkLength + b * branchLength:trunkLength + (b + 1) * branchLength]
+                for b in range(numBranches)]
+    outboundIds = [position + 1 for position in positions]
+    inboundIds = [half + position + 1 for position in positions]
+    hopTimes = [roundUp(seconds, 10) for seconds in rng.uniform(60, 180, half)]
+    minDwells = [roundUp(seconds, 10) for seconds in rng.uniform(20, 40, half)]
+
+    stations = []
+    for position in positions:
+        # Stations near the centre are busier, branch stations less so.
+        weight = float(rng.lognormal(0, 0.5)) * (1.5 - position / half if position < trunkLength else 0.6)
+        for stationId, direction, inbound in ((outboundIds[position], 'Out', False),
+                                              (inboundIds[position], 'In', True)):
+            stations.append({
+                'id': stationId,
+                'name': f"Station {position + 1} {direction}",
+                'minDwellDuration': secondsToString(minDwells[position]),
+                'maxDwellDuration': secondsToString(max(90, minDwells[position])),
+                'passengerDemand': getDemand(rng, weight, dayBeginSeconds, dayEndSeconds, demandResolution, inbound)
+            })
+
+    # Hops between consecutive positions in both directions, and the turn
+    # back from the outbound to the inbound platform at every line end.
+    lineScheme = {}
+
+    def addHop(fromNode, toNode, seconds):
+        lineScheme[(fromNode, toNode)] = secondsToString(seconds)
+
+    for chain in [trunk] + [trunk[-1:] + branch for branch in branches]:
+        for previous, position in zip(chain[:-1], chain[1:]):
+            addHop(outboundIds[previous], outboundIds[position], hopTimes[position])
+            addHop(inboundIds[position], inboundIds[previous], hopTimes[position])
+    for segment in branches if branchLength else [trunk]:
+        addHop(outboundIds[segment[-1]], inboundIds[segment[-1]], 60)
+
+    def getRouteSequence(start, branch):
+        segment = trunk[start:] + (branches[branch] if branchLength else [])
+        return [outboundIds[position] for position in segment] + \
+               [inboundIds[position] for position in reversed(segment)]
+
+    def getRouteSeconds(sequence, depotLeg):
+        # A round trip from the depot: hops, dwells and the turn back.
+        hops = sum(stringToSeconds(lineScheme[hop]) for hop in zip(sequence[:-1], sequence[1:]))
+        dwells = sum(minDwells[(nodeId - 1) % half] for nodeId in sequence)
+        return 2 * depotLeg + hops + dwells + 420
+
+    depotIds = [numStations + 1 + k for k in range(numDepots + numLaunchAndForgetDepots)]
+    depotPositions = [trunk[k * trunkLength // numDepots] for k in range(numDepots)]
+    depotLegs = [roundUp(seconds, 30) for seconds in rng.uniform(180, 420, len(depotIds))]
+    routes = []
+    depotRoutes = [[] for _ in depotIds]
+    for r in range(numRoutes):
+        k = r % numDepots
+        sequence = getRouteSequence(depotPositions[k], r % numBranches)
+        routes.append({'id': r + 1, 'name': f"Route {r + 1}", 'launchDepot': depotIds[k],
+                       'circulatingDepot': depotIds[k], 'nodeIdSequence': sequence,
+                       'routeEndTurnAroundTime': '00:07:00'})
+        depotRoutes[k].append(r + 1)
+        addHop(depotIds[k], sequence[0], depotLegs[k])
+        addHop(sequence[-1], depotIds[k], depotLegs[k])
+    for l in range(numLaunchAndForgetDepots):
+        k = numDepots + l
+        branch = l % numBranches
+        outerPosition = branches[branch][-1] if branchLength else trunk[-1]
+        receivingDepot = l % numDepots
+        sequence = [inboundIds[position] for position in
+                    range(outerPosition, depotPositions[receivingDepot] - 1, -1)
+                    if position in trunk or position in branches[branch]]
+        routes.append({'id': len(routes) + 1, 'name': f"Inbound {l + 1}", 'launchDepot': depotIds[k],
+                       'circulatingDepot': depotIds[receivingDepot], 'nodeIdSequence': sequence,
+                       'routeEndTurnAroundTime': '00:07:00'})
+        depotRoutes[k].append(len(routes))
+        addHop(depotIds[k], sequence[0], depotLegs[k])
+        addHop(sequence[-1], depotIds[receivingDepot], depotLegs[receivingDepot])
+
+    depots = []
+    trainIds = iter(range(1, numTrains + 1))
+    trainCounts = splitEvenly(numRegularTrains, numDepots) + \
+                  [trainsPerLaunchAndForgetDepot] * numLaunchAndForgetDepots
+    routeSeconds = {route['id']: getRouteSeconds(route['nodeIdSequence'], stringToSeconds(lineScheme[
+                    (route['launchDepot'], route['nodeIdSequence'][0])])) for route in routes}
+    for k, depotId in enumerate(depotIds):
+        isRegular = k < numDepots
+        # One train is kept in reserve for the headway ramps.
+        peakHeadway = max(120, max(routeSeconds[routeId] for routeId in depotRoutes[k]) / (trainCounts[k] - 1)) \
+            if isRegular else 600
+        depots.append({
+            'id': depotId,
+            'name': f"Depot {k + 1}" if isRegular else f"Launch Depot {k - numDepots + 1}",
+            'type': 'depot' if isRegular else 'LaunchAndForgetDepot',
+            'stationedTrains': [next(trainIds) for _ in range(trainCounts[k])],
+            'firstLaunchTime': secondsToString(dayBeginSeconds + 1500 + 120 * k),
+            'routingIdSequence': depotRoutes[k],
+            'headwayConfigurations': getHeadwayConfigurations(peakHeadway, dayBeginSeconds, dayEndSeconds,
+                                                              numConfigurations),
+            'timePeriodConfigurations': getTimePeriodConfigurations(dayBeginSeconds, dayEndSeconds,
+                                                                    numConfigurations)
+        })
+
+    return {
+        'lineId': lineId,
+        'lineName': f"Synthetic Line {lineId}",
+        'dayBeginTime': dayBeginTime,
+        'dayEndTime': dayEndTime,
+        'lineNodes': {'stations': stations, 'depots': depots},
+        'lineScheme': [{'fromNode': fromNode, 'toNode': toNode, 'travelDuration': duration}
+                       for (fromNode, toNode), duration in lineScheme.items()],
+        'routes': routes
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stations', help="Stations of both directions together", default=40, type=int)
+    parser.add_argument('--depots', help="Depots circulating trains", default=1, type=int)
+    parser.add_argument('--routes', help="Routes of those depots, by default one per depot and branch",
+                        default=None, type=int)
+    parser.add_argument('--trains', help="Trains of all depots together", default=32, type=int)
+    parser.add_argument('--branches', help="Branches at the outer end of the line", default=1, type=int)
+    parser.add_argument('--launch_and_forget', help="LaunchAndForgetDepots at the branch ends",
+                        default=0, type=int)
+    parser.add_argument('--resolution', help="Seconds between passenger demand figures", default=600, type=int)
+    parser.add_argument('--configurations', help="Headway and time period configurations per depot",
+                        default=1, type=int)
+    parser.add_argument('--seed', help="Seed of travel times, dwell times and demand", default=0, type=int)
+    parser.add_argument('--line_id', help="lineId of the problem", default=90000, type=int)
+    parser.add_argument('--output', '-o', help="JSON file written, by default Line<line_id>Problem.json "
+                                               "in ../output/", default=None, type=str)
+    args = parser.parse_args()
+    problemObj = generateProblem(args.stations, args.depots, args.routes, args.trains, args.branches,
+                                 args.launch_and_forget, demandResolution=args.resolution,
+                                 numConfigurations=args.configurations, seed=args.seed, lineId=args.line_id)
+    outputPath = pathlib.Path(args.output if args.output else f"../output/Line{args.line_id}Problem.json")
+    os.makedirs(outputPath.parent, exist_ok=True)
+    with open(outputPath, "w") as file:
+        file.write(json.dumps(problemObj, indent=2))
+    print(f"Output written to {outputPath}.")
@@ -1,16 +1,14 @@
 from utils import secondsToString, stringToSeconds, atof, natural_keys, timeit, getFeasibleTimePeriods, argmin
 from subway.simulation.utils import debugPrint
 from subway.world import SubwayProblem
-from subway.functions import getHeadwayFunction, smooth
+from subway.functions import getHeadwayFunction, CumulativeDemand
 import itertools
 import json
-from scipy.interpolate import interp1d
 from itertools import accumulate
-import copy
 
 
 def getDepotClassFromType(depotType, subwayProblem):
-    depotLikeClasses = [subwayProblem.Depot] + subwayProblem.Depot.__subclasses__()
+    depotLikeClasses = subwayProblem.depotClasses
     for depotClass in depotLikeClasses:
         debugPrint(depotClass.__name__)
         if depotType.lower() == depotClass.__name__.lower():
@@ -19,16 +17,9 @@ def getDepotClassFromType(depotType, subwayProblem):
 
 
 def getDepotLikeObj(objId, subwayProblem):
-    depotLikeClasses = [subwayProblem.Depot] + subwayProblem.Depot.__subclasses__()
-    depotObj = None
-    for DepotClass in depotLikeClasses:
-        try:
-            depotObj = DepotClass[objId]
-            debugPrint(f"{objId} is a {depotObj.__class__.__name__} object.")
-            return depotObj
-        except KeyError:
-            continue
-    if depotObj is None:
+    try:
+        return subwayProblem.getDepot(objId)
+    except KeyError:
         raise ProblemLoadingRuntimeError("Given Object is Not OneOf <Depot, LaunchAndForgetDepot>")
 
 
@@ -65,7 +56,7 @@ def loadDepots(problemObj, subwayProblem):
         # headwayMinutesSequence = depot['headwayConfigurationsInMinutes']
         # headwaySecondsSequence = tuple(int(x*60) for x in headwayMinutesSequence)
 
-        # userHeadwayFunction = getHeadwayFunction(timePeriodSequence, headwaySecondsSequence, smooth(step=60))
+        # userHeadwayFunction = getHeadwayFunction(timePeriodSequence, headwaySecondsSequence, step=60)
         # print(f"Depot: {depot['id']} headways: {userHeadwayFunction.headways}")
 
         depotClass = getDepotClassFromType(depotType, subwayProblem)
@@ -83,7 +74,7 @@ def loadHeadways(problemConfig, subwayProblem, timePeriodConfig):
         timePeriodSequence = timePeriodConfig[depotId]
         headwayFunction = getHeadwayFunction(timePeriodSequence,
                                              headwaySecondsSequence,
-                                             smooth(step=60))
+                                             step=60)
         headwayFunctions[depotId] = headwayFunction
         getDepotLikeObj(depotId, subwayProblem).setHeadwayFunction(headwayFunction)
         # print(f"Depot: {depotId} headways: {headwayFunction.headways}")
@@ -92,13 +83,13 @@ def loadHeadways(problemConfig, subwayProblem, timePeriodConfig):
 
 def loadStations(problemObj, subwayProblem):
     # Creating Station Objects
-    # We form an cumDemand function and pass it to Station Object
+    # We form an cumDemand lookup table and pass it to Station Object
     for station in problemObj['lineNodes']['stations']:
         timeSlots = list(map(stringToSeconds, station['passengerDemand'].keys()))
         cumDemands = list(accumulate(map(int, station['passengerDemand'].values())))
         timeSlots = [0] + timeSlots + [subwayProblem.dayEndTimeSeconds]
         cumDemands = [0] + cumDemands + [cumDemands[-1]]
-        arrivalsFunction = interp1d(timeSlots, cumDemands)
+        arrivalsFunction = CumulativeDemand(timeSlots, cumDemands)
         """
         # testing
         for timeSlot, cumDemand in zip(timeSlots, cumDemands):
@@ -127,7 +118,7 @@ def loadLineInfo(problemObj, subwayProblem):
 
 
 def loadEnvironment(env, subwayProblem):
-    depotClasses = [subwayProblem.Depot] + subwayProblem.Depot.__subclasses__()
+    depotClasses = subwayProblem.depotClasses
     allSimulationClasses = depotClasses + [subwayProblem.Station,
                                            subwayProblem.Train]  # only the classes that can be bound with env
     for SimulationClass in allSimulationClasses:
@@ -139,7 +130,7 @@ def loadEnvironment(env, subwayProblem):
 def loadRouteSequences(problemObj, subwayProblem):
     # Create and add Train objects to all Depots
     # Set Routing Sequence to all Depots
-    depotClasses = [subwayProblem.Depot] + subwayProblem.Depot.__subclasses__()
+    depotClasses = subwayProblem.depotClasses
     for depotClass in depotClasses:
         for obj_id, obj in depotClass:
             depotObj = obj
@@ -173,7 +164,7 @@ def loadRoutes(problemObj, subwayProblem):
 
 def headwayConfigGenerator(problemObj, subwayProblem):
     headwayConfigurations = {}
-    depotClasses = [subwayProblem.Depot] + subwayProblem.Depot.__subclasses__()
+    depotClasses = subwayProblem.depotClasses
     for depotClass in depotClasses:
         for obj_id, obj in depotClass:
             depotObj = obj
@@ -207,21 +198,16 @@ def headwayConfigGenerator(problemObj, subwayProblem):
     alltimePeriodMinSizeConfigs = itertools.product(*headwayConfigsPerProblem['timePeriodMinSizes'].values())
     alltimePeriodMaxSizeConfigs = itertools.product(*headwayConfigsPerProblem['timePeriodMaxSizes'].values())
 
-    problemConfigs = []
-
     for headwayConfig, periodMinSizes, periodMaxSizes \
             in zip(allHeadwayConfigs, alltimePeriodMinSizeConfigs, alltimePeriodMaxSizeConfigs):
         headwayConfigDict = dict(zip(depotIds, headwayConfig))
         periodMinSizesDict = dict(zip(depotIds, periodMinSizes))
         periodMaxSizesDict = dict(zip(depotIds, periodMaxSizes))
-        problemConfigs.append({
+        yield {
             'headwayConfig': headwayConfigDict,
             'periodMinSizes': periodMinSizesDict,
             'periodMaxSizes': periodMaxSizesDict
-        })
-
-    for problemConfig in problemConfigs:
-        yield problemConfig
+        }
 
 
 def makeInsideOutDict(dictObj):
@@ -240,7 +226,7 @@ def makeInsideOutDict(dictObj):
 
 def timePeriodConfigGenerator(problemObj, subwayProblem):
     timePeriodConfigurations = {}
-    depotClasses = [subwayProblem.Depot] + subwayProblem.Depot.__subclasses__()
+    depotClasses = subwayProblem.depotClasses
     for depotClass in depotClasses:
         for obj_id, obj in depotClass:
             depotObj = obj
@@ -267,31 +253,24 @@ def timePeriodConfigGenerator(problemObj, subwayProblem):
 
     # prettifier = lambda x: [list(map(secondsToString, y)) for y in x]
 
-    problemConfigs = []
-
     for timePeriodConfig, plusOrMinusWindows in zip(allTimePeriodConfigs, allPlusOrMinusWindows):
         timePeriodConfigDict = dict(zip(depotIds, timePeriodConfig))
         plusOrMinusWindowsDict = dict(zip(depotIds, plusOrMinusWindows))
-        problemConfigs.append({
+        yield {
             'timePeriodConfig': timePeriodConfigDict,
             'plusOrMinusWindows': plusOrMinusWindowsDict
-        })
-
-    for config in problemConfigs:
-        yield config
+        }
 
 
 def problemConfigGenerator(problemObj, subwayProblem):
-    timePeriodConfigs = timePeriodConfigGenerator(problemObj, subwayProblem)
-    headwayConfigs = headwayConfigGenerator(problemObj, subwayProblem)
-
-    nestedGenerator =  itertools.product(timePeriodConfigs, headwayConfigs)
-
-    for gen in nestedGenerator:
-        timePeriodConfig, headwayConfig = gen
-        problemConfig = headwayConfig.copy()
-        problemConfig.update(timePeriodConfig)
-        yield problemConfig
+    # Configurations are produced one at a time: itertools.product would
+    # materialise both generators, so the headway configurations are
+    # generated again for every time period configuration instead.
+    for timePeriodConfig in timePeriodConfigGenerator(problemObj, subwayProblem):
+        for headwayConfig in headwayConfigGenerator(problemObj, subwayProblem):
+            problemConfig = headwayConfig.copy()
+            problemConfig.update(timePeriodConfig)
+            yield problemConfig
 
 
 class ProblemLoadingRuntimeError(RuntimeError):
@@ -339,14 +318,11 @@ def getJsonProblem(jsonPath):
     return problemObj
 
 
-def fastCopySubwayProblem(old, problemObj, memo={}, excludeItems=set(['Depot', 'LaunchAndForgetDepot'])):
-    result = SubwayProblem()
-    memo[id(old)] = result
-    for k, v in old.__dict__.items():
-        if k not in excludeItems:
-            setattr(result, k, copy.deepcopy(v, memo))
-    loadDepots(problemObj, result)
-    loadRoutes(problemObj, result)
-    loadRouteSequences(problemObj, result)
-    return result
 
+def getProblemSize(problemObj):
+    """ Rough cost of simulating a JSON problem: station visits of one trip
+        on every route, times the length of the operating day.
+    """
+    stationVisits = sum(len(route['nodeIdSequence']) for route in problemObj['routes'])
+    daySeconds = stringToSeconds(problemObj['dayEndTime']) - stringToSeconds(problemObj['dayBeginTime'])
+    return stationVisits * daySeconds
@@ -0,0 +1,360 @@
+import cProfile
+import inspect
+import json
+import os
+import pathlib
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from multiprocessing import util
+from contextlib import contextmanager
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+# Phases the profiled time is broken down into, see getPhase
+PHASES = ('problem load', 'headways', 'demand interpolation', 'SimPy scheduling', 'simulation model',
+          'event logging', 'analytic replay', 'evaluation', 'mutation', 'jMetal and annealing',
+          'parallel wait and IPC', 'solution export', 'telemetry and logging', 'other')
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The profiler running in this process, only one at a time
+activeProfiler = None
+# {filename: {(firstLineNumber, name): qualname}}, see getQualname
+qualnames = {}
+COMPREHENSIONS = ('<listcomp>', '<dictcomp>', '<setcomp>', '<genexpr>')
+
+
+class ProfileSettings(object):
+    """ What every process of a run profiles and where to: mode is
+        'cprofile' (deterministic, every call) or 'sample' (stacks of the
+        profiled thread every interval seconds). Each profiler writes one
+        file to directory, see writeProfile.
+    """
+    def __init__(self, mode='cprofile', directory=None, interval=0.005):
+        assert mode in PROFILE_MODES, f"Unknown profile mode {mode}."
+        self.mode = mode
+        self.directory = directory if directory else tempfile.mkdtemp(prefix='ttpSolverProfile')
+        self.interval = interval
+
+
+def getQualname(filename, lineNumber, name):
+    """ Qualified name of the function defined at lineNumber of filename,
+        name if the source can not be read (eg. built-in functions).
+    """
+    if filename not in qualnames:
+        qualnames[filename] = {}
+        try:
+            with open(filename, 'rb') as f:
+                codes = [(compile(f.read(), filename, 'exec'), '')]
+        except (OSError, SyntaxError, ValueError):
+            codes = []
+        # Built the way Python qualifies names, code.co_qualname only
+        # exists from Python 3.11: <locals> after a function or lambda,
+        # nothing after a class body or comprehension.
+        while codes:
+            code, prefix = codes.pop()
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    qualname = prefix + const.co_name
+                    qualnames[filename][(const.co_firstlineno, const.co_name)] = qualname
+                    isFunction = const.co_flags & inspect.CO_OPTIMIZED and const.co_name not in COMPREHENSIONS
+                    codes.append((const, qualname + ('.<locals>.' if isFunction else '.')))
+    return qualnames[filename].get((lineNumber, name), name)
+
+
+def getPhase(filename, qualname):
+    """ Phase of the time spent in a function itself, None for functions
+        whose time belongs to the phase of their caller (standard library,
+        built-ins).
+    """
+    path = filename.replace('\\', '/')
+    if '/simpy/' in path:
+        return 'SimPy scheduling'
+    if '/jmetal/' in path:
+        return 'jMetal and annealing'
+    if '/multiprocessing/' in path or '/joblib/' in path or '/concurrent/' in path or \
+            os.path.basename(path) in ('threading.py', 'selectors.py', 'queue.py'):
+        return 'parallel wait and IPC'
+    if '/logging/' in path:
+        return 'telemetry and logging'
+    if not filename.startswith(SOURCE_DIR):
+        return None
+    module = os.path.relpath(filename, SOURCE_DIR).replace('\\', '/')
+    name = qualname.split('.<locals>.')[-1]
+    if module == 'problemLoader.py':
+        return {'loadHeadways': 'headways', 'loadEnvironment': 'simulation model'}.get(name, 'problem load')
+    if module == 'sharedProblems.py' or name == 'compileProblem' or name.startswith('Registry.') or \
+            name == 'stringToSeconds':
+        return 'problem load'
+    if module == 'subway/functions.py':
+        return 'demand interpolation' if name.startswith('CumulativeDemand') else 'headways'
+    if module == 'subway/world.py':
+        if name.endswith('__init__') or name.startswith('SubwayProblem.set'):
+            return 'problem load'
+        if name in ('Train.addEventLog', 'Train.finishTrip'):
+            return 'event logging'
+        return 'simulation model'
+    if module.startswith('subway/simulation/'):
+        return 'simulation model'
+    if module == 'subway/eventStore.py':
+        return 'event logging'
+    if module == 'subway/analytic.py':
+        return 'analytic replay'
+    if module == 'evaluation.py':
+        return 'evaluation'
+    if module == 'optimization.py':
+        return 'mutation' if name.startswith(('RandomMutation', 'TimePeriodSolution')) else 'jMetal and annealing'
+    if module == 'solutionWriter.py' or name.endswith(('writeJsonSolution', 'printJsonSolution')):
+        return 'solution export'
+    if module in ('telemetry.py', 'profiling.py'):
+        return 'telemetry and logging'
+    if module == 'solver.py':
+        if 'TimePeriodsProblem' in name:
+            return 'evaluation'
+        if 'MySimulatedAnnealing' in name or 'PrintObjectivesMyObserver' in name:
+            return 'jMetal and annealing'
+    return None
+
+
+def getStatsPhases(stats, iterations=200):
+    """ {phase: seconds} of a pstats.Stats. The own time of a function
+        without a phase is split between the phases of its callers, in
+        proportion to the time it spent on behalf of each. Recursion makes
+        this a fixed point, found by iterating; time that can not be traced
+        to any phase is 'other'.
+    """
+    fixed = {}
+    weights = {}
+    for function, (cc, nc, tt, ct, callers) in stats.stats.items():
+        filename, lineNumber, name = function
+        phase = getPhase(filename, getQualname(filename, lineNumber, name))
+        if phase is not None:
+            fixed[function] = {phase: 1.0}
+            continue
+        callerWeights = {caller: timing[2] for caller, timing in callers.items() if caller in stats.stats}
+        if sum(callerWeights.values()) <= 0:
+            callerWeights = {caller: timing[1] for caller, timing in callers.items() if caller in stats.stats}
+        total = sum(callerWeights.values())
+        weights[function] = {caller: weight / total for caller, weight in callerWeights.items()} if total > 0 else {}
+
+    shares = {function: {} for function in weights}
+    for _ in range(iterations):
+        newShares = {}
+        for function, callerWeights in weights.items():
+            result = {}
+            for caller, weight in callerWeights.items():
+                for phase, share in fixed.get(caller, shares.get(caller, {})).items():
+                    result[phase] = result.get(phase, 0.0) + share * weight
+            newShares[function] = result
+        if newShares == shares:
+            break
+        shares = newShares
+
+    phases = {}
+    for function, (cc, nc, tt, ct, callers) in stats.stats.items():
+        functionShares = fixed.get(function, shares.get(function, {}))
+        for phase, share in functionShares.items():
+            phases[phase] = phases.get(phase, 0.0) + tt * share
+        phases['other'] = phases.get('other', 0.0) + tt * max(0.0, 1 - sum(functionShares.values()))
+    return phases
+
+
+def getFramePhase(frame):
+    # The phase of the innermost frame that has one.
+    while frame is not None:
+        code = frame.f_code
+        phase = getPhase(code.co_filename, getQualname(code.co_filename, code.co_firstlineno, code.co_name))
+        if phase is not None:
+            return phase
+        frame = frame.f_back
+    return 'other'
+
+
+def getCollapsedStack(frame):
+    # Outermost frame first, as flamegraph.pl and speedscope expect.
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        qualname = getQualname(code.co_filename, code.co_firstlineno, code.co_name)
+        names.append(f"{qualname} ({os.path.basename(code.co_filename)})".replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """ Samples the stack of one thread every interval seconds from a
+        background thread, counting collapsed stacks and the seconds of
+        every phase.
+    """
+    def __init__(self, threadId, interval):
+        self.threadId = threadId
+        self.interval = interval
+        self.stacks = {}
+        self.phases = {}
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        last = time.perf_counter()
+        while self.running:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.threadId)
+            if frame is not None:
+                stack = getCollapsedStack(frame)
+                phase = getFramePhase(frame)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.phases[phase] = self.phases.get(phase, 0.0) + now - last
+            last = now
+
+    def stop(self):
+        self.running = False
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+class Profiler(object):
+    """ Profiles the calling thread of one process from start to stop and
+        writes what it found to the directory of settings, named after
+        label and the process.
+    """
+    def __init__(self, settings, label):
+        self.settings = settings
+        self.label = label
+        self.pid = os.getpid()
+        self.profile = None
+        self.sampler = None
+        self.startTime = None
+
+    def start(self):
+        global activeProfiler
+        activeProfiler = self
+        self.startTime = time.perf_counter()
+        if self.settings.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), self.settings.interval)
+            self.sampler.start()
+        return self
+
+    def stop(self):
+        global activeProfiler
+        if activeProfiler is not self:
+            return
+        activeProfiler = None
+        seconds = time.perf_counter() - self.startTime
+        fd, path = tempfile.mkstemp(prefix=f'{self.label}-{os.getpid()}-', dir=self.settings.directory)
+        os.close(fd)
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(path + '.prof')
+        else:
+            self.sampler.stop()
+            with open(path + '.json', 'w') as f:
+                f.write(json.dumps({'seconds': seconds, 'stacks': self.sampler.stacks,
+                                    'phases': self.sampler.phases}))
+        os.remove(path)
+
+
+def getActiveProfiler():
+    # A forked process inherits the profiler of its parent, which is
+    # dropped: the parent writes its own profile.
+    global activeProfiler
+    if activeProfiler is not None and activeProfiler.pid != os.getpid():
+        if activeProfiler.profile is not None:
+            activeProfiler.profile.disable()
+        activeProfiler = None
+    return activeProfiler
+
+
+@contextmanager
+def profile(settings, label):
+    """ Profiles the block, unless settings is None or this process is
+        already being profiled, eg. the main process, by an outer profiler.
+    """
+    if settings is None or getActiveProfiler() is not None:
+        yield
+        return
+    profiler = Profiler(settings, label).start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+
+
+def startWorkerProfile(settings, label='worker'):
+    """ Profiles a pool worker process until it exits, idle time included. """
+    if settings is not None and getActiveProfiler() is None:
+        profiler = Profiler(settings, label).start()
+        util.Finalize(profiler, profiler.stop, exitpriority=10)
+
+
+def writeProfile(settings, outputPath, writeStats=False):
+    """ Adds up the profiles of all processes: returns and writes to
+        outputPath/profile.json the seconds of every phase, in total and
+        per profiled process. With writeStats the merged profile is also
+        written, profile.pstats for cProfile or the collapsed stacks of all
+        samples, profile.collapsed, for flame graphs. The profiles are
+        removed.
+    """
+    outputPath = pathlib.Path(outputPath)
+    processes = {}
+    mergedStats = None
+    stacks = {}
+    for path in sorted(pathlib.Path(settings.directory).iterdir()):
+        process = path.stem
+        if path.suffix == '.prof':
+            stats = pstats.Stats(str(path))
+            processes[process] = getStatsPhases(stats)
+            if mergedStats is None:
+                mergedStats = stats
+            else:
+                mergedStats.add(stats)
+        elif path.suffix == '.json':
+            with open(path) as f:
+                sampled = json.load(f)
+            processes[process] = sampled['phases']
+            label = process.rsplit('-', 2)[0]
+            for stack, count in sampled['stacks'].items():
+                stack = f'{label};{stack}'
+                stacks[stack] = stacks.get(stack, 0) + count
+    shutil.rmtree(settings.directory, ignore_errors=True)
+
+    phases = {phase: sum(process.get(phase, 0.0) for process in processes.values()) for phase in PHASES}
+    summary = {
+        'mode': settings.mode,
+        'seconds': sum(phases.values()),
+        'phases': {phase: seconds for phase, seconds in phases.items() if seconds > 0},
+        'processes': {process: dict(sorted(processPhases.items(), key=lambda item: -item[1]))
+                      for process, processPhases in processes.items()}
+    }
+    os.makedirs(outputPath, exist_ok=True)
+    with open(outputPath / 'profile.json', 'w') as f:
+        f.write(json.dumps(summary, indent=2))
+    if writeStats and mergedStats is not None:
+        mergedStats.dump_stats(str(outputPath / 'profile.pstats'))
+    if writeStats and stacks:
+        with open(outputPath / 'profile.collapsed', 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f'{stack} {count}\n')
+    printProfile(summary)
+    return summary
+
+
+def printProfile(summary):
+    total = summary['seconds'] or 1
+    print(f"Profile ({summary['mode']}) of {len(summary['processes'])} processes, "
+          f"{summary['seconds']:.2f} seconds:")
+    for phase, seconds in sorted(summary['phases'].items(), key=lambda item: -item[1]):
+        print(f"{phase:>24}: {seconds:9.3f}s {100 * seconds / total:5.1f}%")
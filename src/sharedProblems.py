@@ -0,0 +1,144 @@
+import io
+import mmap
+import os
+import pickle
+import tempfile
+from array import array
+import numpy as np
+
+# Arrays are laid out at multiples of this many bytes.
+ALIGNMENT = 64
+
+# {path: mmap} of the problem files mapped by the current process
+mappedFiles = {}
+
+
+class ArrayPickler(pickle.Pickler):
+    """ Pickles NumPy arrays and array.array tables by reference, collecting
+        them in arrays to be written out as raw data.
+    """
+    def __init__(self, file, arrays, arrayIds):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays = arrays
+        self.arrayIds = arrayIds
+
+    def persistent_id(self, obj):
+        if not ((isinstance(obj, np.ndarray) and not obj.dtype.hasobject) or type(obj) is array):
+            return None
+        if id(obj) not in self.arrayIds:
+            self.arrayIds[id(obj)] = len(self.arrays)
+            self.arrays.append(obj)
+        return self.arrayIds[id(obj)]
+
+
+class ArrayUnpickler(pickle.Unpickler):
+    """ Unpickles what ArrayPickler wrote, arrays being read-only views of
+        buffer: ndarrays for NumPy arrays and memoryviews for array.array.
+    """
+    def __init__(self, file, buffer, layout):
+        super().__init__(file)
+        self.buffer = buffer
+        self.layout = layout
+
+    def persistent_load(self, index):
+        kind, offset, typeCode, shape = self.layout[index]
+        if kind == 'ndarray':
+            count = int(np.prod(shape, dtype=np.int64))
+            view = np.frombuffer(self.buffer, dtype=np.dtype(typeCode), count=count, offset=offset)
+            return view.reshape(shape)
+        size = shape * array(typeCode).itemsize
+        return memoryview(self.buffer)[offset:offset + size].cast(typeCode)
+
+
+def getArrayBytes(obj):
+    if type(obj) is array:
+        return obj.tobytes()
+    return np.ascontiguousarray(obj).tobytes()
+
+
+def getArrayLayout(obj, offset):
+    if type(obj) is array:
+        return ('array', offset, obj.typecode, len(obj))
+    return ('ndarray', offset, obj.dtype.str, obj.shape)
+
+
+class SharedProblems(object):
+    """ Compiled problems written once to a memory mapped file, so that
+        worker processes map them instead of building them from JSON.
+
+        problems: {key: object}, anything picklable, eg. what
+            evaluation.compileProblem returns.
+
+        The NumPy arrays and array.array tables of the problems (travel time
+        matrix, cumulative demands, ...) are stored as raw data, each problem
+        itself as a small pickle referring to them. get unpickles a fresh
+        copy of the object graph, the arrays in it being read-only views of
+        the mapped file, so all processes read the same pages.
+
+        An instance pickles to a handle of the file that workers can get
+        problems from. The file is kept in /dev/shm when there is one and is
+        removed by close in the process that created it. Processes that
+        have mapped it by then keep their mapping.
+    """
+    def __init__(self, problems, directory=None):
+        arrays = []
+        arrayIds = {}
+        pickles = {}
+        for key, problem in problems.items():
+            f = io.BytesIO()
+            ArrayPickler(f, arrays, arrayIds).dump(problem)
+            pickles[key] = f.getvalue()
+
+        if directory is None and os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        fd, self.path = tempfile.mkstemp(prefix='ttpSolverProblems', suffix='.bin', dir=directory)
+        self.layout = []
+        self.pickles = {}
+        self.isOwner = True
+        with os.fdopen(fd, 'wb') as f:
+            for obj in arrays:
+                offset = -(-f.tell() // ALIGNMENT) * ALIGNMENT
+                f.write(b'\0' * (offset - f.tell()))
+                self.layout.append(getArrayLayout(obj, offset))
+                f.write(getArrayBytes(obj))
+            for key, data in pickles.items():
+                self.pickles[key] = (f.tell(), len(data))
+                f.write(data)
+            # An empty file can not be mapped.
+            if f.tell() == 0:
+                f.write(b'\0')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['isOwner'] = False
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.pickles
+
+    def keys(self):
+        return self.pickles.keys()
+
+    def getBuffer(self):
+        if self.path not in mappedFiles:
+            with open(self.path, 'rb') as f:
+                mappedFiles[self.path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mappedFiles[self.path]
+
+    def get(self, key):
+        """ A new copy of the problem stored under key, sharing its arrays. """
+        buffer = self.getBuffer()
+        offset, size = self.pickles[key]
+        return ArrayUnpickler(io.BytesIO(buffer[offset:offset + size]), buffer, self.layout).load()
+
+    def close(self):
+        if self.isOwner and os.path.exists(self.path):
+            os.remove(self.path)
+        # Views handed out by get keep the mapping alive as long as needed.
+        mappedFiles.pop(self.path, None)
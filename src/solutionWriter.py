@@ -0,0 +1,130 @@
+import json
+import pathlib
+from utils import natural_keys
+
+OUTPUT_FORMATS = ('json', 'compact', 'ndjson', 'npy')
+
+
+def writeJsonObject(f, items, indent=None):
+    """ Writes the (key, value) pairs of items to f as one JSON object,
+        encoding one value at a time. The text is the same as
+        json.dump(dict(items), f, indent=indent) would write, with compact
+        separators when indent is None.
+    """
+    keySeparator = ': ' if indent else ':'
+    separators = (',', keySeparator)
+    f.write('{')
+    empty = True
+    for key, value in items:
+        if not empty:
+            f.write(',')
+        if indent:
+            f.write('\n' + ' ' * indent)
+        text = json.dumps(value, indent=indent, separators=separators)
+        if indent:
+            text = text.replace('\n', '\n' + ' ' * indent)
+        f.write(json.dumps(key) + keySeparator + text)
+        empty = False
+    if indent and not empty:
+        f.write('\n')
+    f.write('}')
+
+
+class SolutionLogWriter(object):
+    """ Writes the event logs of a simulated solution to outputPath.
+
+        outputFormat:
+            'json': TrainLog.json, TripsLog.json, DepotDeparturesLog.json and
+                StationDeparturesLog.json, indented
+            'compact': the same files without indentation
+            'ndjson': TripsLog.ndjson with one trip per line, {"trip", "train",
+                "route", "events"}, written as soon as the trip is over (see
+                SubwayProblem.setEventSink). The train log holds the same
+                records grouped by train and is not written. The departure
+                logs are written compact.
+            'npy': EventLog, a directory of one .npy per column of the
+                subway.eventStore.EventStore the other formats can be
+                derived from, see writeEventStore. Readers can memory map it.
+                The departure logs are written compact.
+    """
+    def __init__(self, outputPath, outputFormat='json'):
+        if outputFormat not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {outputFormat}, expected one of {OUTPUT_FORMATS}.")
+        self.outputPath = pathlib.Path(outputPath)
+        self.outputFormat = outputFormat
+        self.indent = 2 if outputFormat == 'json' else None
+        self.tripsFile = None
+
+    def __enter__(self):
+        if self.isStreaming():
+            self.tripsFile = open(self.outputPath / 'TripsLog.ndjson', 'w')
+        return self
+
+    def __exit__(self, *args):
+        if self.tripsFile is not None:
+            self.tripsFile.close()
+            self.tripsFile = None
+
+    def isStreaming(self):
+        return self.outputFormat == 'ndjson'
+
+    def writeTrip(self, trainName, tripNumberKey, tripLog):
+        record = {'trip': tripNumberKey, 'train': trainName, 'route': tripLog['route'], 'events': tripLog['events']}
+        self.tripsFile.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def writeTrainLogs(self, trainLogs):
+        """ trainLogs: [(trainName, train.eventsLog)] after the simulation.
+            When streaming, these are the trips still running at the end of
+            the day.
+        """
+        if self.isStreaming():
+            for trainName, eventsLog in trainLogs:
+                for tripNumberKey, tripLog in eventsLog.items():
+                    self.writeTrip(trainName, tripNumberKey, tripLog)
+            return
+
+        with open(self.outputPath / 'TrainLog.json', 'w') as f:
+            writeJsonObject(f, trainLogs, self.indent)
+
+        # Trips refer to the events of the train log instead of copying them.
+        trips = [(tripNumberKey, trainName, tripLog) for trainName, eventsLog in trainLogs
+                 for tripNumberKey, tripLog in eventsLog.items()]
+        trips.sort(key=lambda trip: natural_keys(trip[0]))
+        tripItems = ((tripNumberKey, {'train': trainName, 'route': tripLog['route'], 'events': tripLog['events']})
+                     for tripNumberKey, trainName, tripLog in trips)
+        with open(self.outputPath / 'TripsLog.json', 'w') as f:
+            writeJsonObject(f, tripItems, self.indent)
+
+    def writeEventStore(self, eventStore):
+        """ Writes the train and trip logs of an EventStore, each derived
+            one train or one trip at a time.
+        """
+        if self.outputFormat == 'npy':
+            eventStore.save(self.outputPath / 'EventLog')
+            return
+        if self.isStreaming():
+            for tripNumberKey, trainName, routeName, events in eventStore.getTripLogs():
+                self.writeTrip(trainName, tripNumberKey, {'route': routeName, 'events': events})
+            return
+
+        with open(self.outputPath / 'TrainLog.json', 'w') as f:
+            writeJsonObject(f, eventStore.getTrainLogs(), self.indent)
+        tripItems = ((tripNumberKey, {'train': trainName, 'route': routeName, 'events': events})
+                     for tripNumberKey, trainName, routeName, events in eventStore.getTripLogs())
+        with open(self.outputPath / 'TripsLog.json', 'w') as f:
+            writeJsonObject(f, tripItems, self.indent)
+
+    def writeDepartures(self, fileName, departures):
+        with open(self.outputPath / fileName, 'w') as f:
+            writeJsonObject(f, departures.items(), self.indent)
+
+
+if __name__ == '__main__':
+    import argparse
+    from subway.eventStore import EventStore
+    parser = argparse.ArgumentParser(description="Derives the train and trip logs from an EventLog")
+    parser.add_argument('event_log', help="EventLog directory written with --output_format npy", type=str)
+    parser.add_argument('--output_format', choices=('json', 'compact', 'ndjson'), default='json', type=str)
+    args = parser.parse_args()
+    with SolutionLogWriter(pathlib.Path(args.event_log).parent, args.output_format) as writer:
+        writer.writeEventStore(EventStore.load(args.event_log))
@@ -2,20 +2,23 @@
 # coding: utf-8
 
 # In[1]:
-import sys
-
 import logging
 import subway.simulation.utils as u
 import simpy
 import pathlib
 from joblib import Parallel, delayed
-import multiprocessing as mp
 import time
 import problemLoader
-from utils import secondsToString, natural_keys, timeit, getVariableBounds, argmin
-from subway.simulation.errors import SimulationError
+from utils import secondsToString, getVariableBounds, argmin, getWorkerCount
+from evaluation import EvaluationCache, SharedEvaluationStore, getProblemHash, evaluateBatchCached, \
+     ProblemEvaluator, EvaluationEngine, runSimulation, shareProblems, INF
+from solutionWriter import SolutionLogWriter, OUTPUT_FORMATS
+from telemetry import TelemetryWriter, TelemetryObserver, PrometheusEndpoint
+from profiling import ProfileSettings, Profiler, profile, writeProfile, PROFILE_MODES
+from subway.eventStore import EventStore
+from feasibleDomain import TimePeriodDomain
 from optimization import TimePeriodsProblemBase, TimePeriodSolution, \
-     RandomMutationAll, RandomGenerator
+     RandomMutationAll, RandomGenerator, ReplicaExchangeAnnealing, BoundaryNeighbourhood, NeighbourhoodSearch
 from jmetal.algorithm.singleobjective.simulated_annealing import SimulatedAnnealing
 from jmetal.util.termination_criterion import StoppingByEvaluations, StoppingByTime
 from jmetal.util.observer import PrintObjectivesObserver
@@ -23,23 +26,14 @@ import os
 print(os.getcwd())
 import json
 import argparse
+import tempfile
+import shutil
+import itertools
 
 # In[2]:
 
 LOGGER = logging.getLogger('jmetal')
 
-def runSimulation(env, newSubwayProblem):
-    try:
-        env.run(until=newSubwayProblem.dayEndTimeSeconds)
-        totalWaiting = sum(station.accumulatedWaiting for _id, station in newSubwayProblem.Station)
-    except SimulationError:
-        totalWaiting = INF
-        # print("Current solution not feasible for simulation.")
-    except Exception:
-        totalWaiting = INF
-        # print("Unknown error during simulation for current simulation.")
-    return totalWaiting
-
 def print_variables_to_file(solutions, filename: str):
     LOGGER.info('Output file (variables): ' + filename)
 
@@ -56,101 +50,243 @@ def print_variables_to_file(solutions, filename: str):
             of.write(str(solution) + " ")
             of.write("\n")
 
-INF = 2 ** 31
 u.ENABLE_LOG = False
 u.ENABLE_DEBUG_PRINT = False
 
-def main(jsonInputFilePath, max_seconds):
+def writeJsonSolution(problemObj, problemConfig, variables, outputPath, outputFormat='json'):
+    """ Simulates the time periods in variables on a fresh SubwayProblem and
+        writes the train, depot and station logs to outputPath.
+    """
+    subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
+
+    problemLoader.loadHeadways(problemConfig, subwayProblem, variables)
+    env = simpy.Environment()
+    problemLoader.loadEnvironment(env, subwayProblem)
+    with SolutionLogWriter(outputPath, outputFormat) as writer:
+        # Trips are streamed out as they end, otherwise events are
+        # recorded column by column and the logs derived from them.
+        eventStore = None
+        if writer.isStreaming():
+            subwayProblem.setEventSink(writer.writeTrip)
+        else:
+            eventStore = EventStore.fromProblem(subwayProblem)
+            subwayProblem.setEventStore(eventStore)
+        runSimulation(env, subwayProblem)
+        if eventStore is None:
+            writer.writeTrainLogs([(str(train), train.eventsLog) for _id, train in subwayProblem.Train])
+        else:
+            writer.writeEventStore(eventStore)
+
+        depotDepartures = {}
+        depotIdList = [depot['id'] for depot in problemObj['lineNodes']['depots']]
+        for _id in depotIdList:
+            depotObj = problemLoader.getDepotLikeObj(_id, subwayProblem)
+            depotDepartures[f'{str(depotObj)}'] = list(map(secondsToString, depotObj.departureTimes))
+        writer.writeDepartures('DepotDeparturesLog.json', depotDepartures)
+
+        stationDepartures = {}
+        for _id, station in subwayProblem.Station:
+            stationDepartures[f'{str(station)}'] = list(map(secondsToString, station.departureTimes))
+        writer.writeDepartures('StationDeparturesLog.json', stationDepartures)
+
+def main(jsonInputFilePath, max_seconds, evaluator='analytic', cacheSize=100000, sharedCache=False,
+         evaluationStorePath=None, skipSeen=False, numWorkers=None, algorithmName='multistart',
+         numReplicas=None, batchSize=None, allConfigs=False, configSeconds=None,
+         screeningFraction=0.2, pruneMargin=0.01, outputPath='../output/', evaluationEngine=None,
+         outputFormat='json', telemetryPath=None, telemetryInterval=1.0, telemetryPort=None,
+         maxEvaluations=None, profileMode=None, profileInterval=0.005, profileStats=False,
+         neighbourhoodSample=None, tabuTenure=8, randomStart=False):
+    """ Optimizes the time periods of a JSON problem and writes the best
+        solution to outputPath. Returns the best TimePeriodSolution.
+        evaluationEngine: an engine shared with other runs, used instead of
+            creating one for --algorithm tempering, and left open.
+        telemetryPath: CSV or NDJSON time series the state of every chain is
+            recorded to every telemetryInterval seconds, see TelemetryObserver
+        telemetryPort: serve the latest telemetry in the Prometheus text
+            format on this port while optimizing, recorded to
+            outputPath/telemetry.ndjson if there is no telemetryPath
+        maxEvaluations: stop every chain (or the replicas together) after this
+            many evaluations instead of after max_seconds; with allConfigs
+            per configuration, split between screening and the resumed run
+            like the seconds
+        profileMode: 'cprofile' or 'sample' to profile this process, the
+            annealing chains and the evaluation workers; the time of every
+            phase is written to outputPath/profile.json, and with
+            profileStats the merged profile.pstats or profile.collapsed
+        neighbourhoodSample: moves scored per step of --algorithm descent or
+            tabu, by default the whole neighbourhood
+        tabuTenure: steps moving a boundary back is tabu for with --algorithm tabu
+        randomStart: start every annealing chain from a uniformly drawn
+            feasible solution instead of a mutation of the initial one
+    """
+    profileSettings = None
+    if profileMode is not None:
+        profileSettings = ProfileSettings(profileMode, interval=profileInterval)
+        mainProfiler = Profiler(profileSettings, 'main').start()
+
     jsonPath = jsonInputFilePath
     problemObj = problemLoader.getJsonProblem(jsonPath)
     subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
 
     problemConfigs = problemLoader.problemConfigGenerator(problemObj, subwayProblem)
-    problemConfig = list(problemConfigs)[0]
+    problemConfig = next(problemConfigs)
+
+    # With a shared cache, every annealing chain also reuses the
+    # evaluations of the other chains through an SQLite file.
+    if sharedCache:
+        sharedCacheDir = tempfile.mkdtemp(prefix='ttpSolverCache')
+        sharedCachePath = pathlib.Path(sharedCacheDir) / 'evaluations.sqlite'
+    if evaluationStorePath is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(evaluationStorePath)), exist_ok=True)
+
+    telemetryWriter = None
+    prometheusEndpoint = None
+    if telemetryPort is not None and telemetryPath is None:
+        telemetryPath = pathlib.Path(outputPath) / 'telemetry.ndjson'
+    if telemetryPath is not None:
+        telemetryWriter = TelemetryWriter(telemetryPath)
+        telemetryWriter.create()
+    if telemetryPort is not None:
+        prometheusEndpoint = PrometheusEndpoint(telemetryPath, telemetryPort)
+        print(f"Telemetry served on http://127.0.0.1:{telemetryPort}/metrics")
+
+    def createTerminationCriterion(seconds, evaluations=None):
+        # evaluations is a part of the maxEvaluations budget, all of it by default
+        if maxEvaluations is not None:
+            return StoppingByEvaluations(max_evaluations=evaluations if evaluations else maxEvaluations)
+        return StoppingByTime(max_seconds=seconds)
+
+    numCores = numWorkers if numWorkers else getWorkerCount()
+    # Worker processes map the problem compiled here instead of each
+    # building it from problemObj, see SharedProblems.
+    sharedProblems = None
+    if numCores > 1 and evaluationEngine is None:
+        sharedProblems = shareProblems({None: problemObj}, evaluator)
+
+    def createEvaluationCache(problemConfig):
+        # Stores keep the evaluations of each problem configuration apart.
+        # Evaluations of earlier runs on the same problem are kept in the
+        # evaluation store. They are reused only with skipSeen, otherwise the
+        # store is just written to and provides the initial solution.
+        problemHash = getProblemHash(problemObj, problemConfig)
+        sharedStore = None
+        recordStore = None
+        if sharedCache:
+            sharedStore = SharedEvaluationStore(sharedCachePath, problemHash)
+        if evaluationStorePath is not None:
+            evaluationStore = SharedEvaluationStore(evaluationStorePath, problemHash)
+            if skipSeen:
+                sharedStore = evaluationStore
+            else:
+                recordStore = evaluationStore
+        return EvaluationCache(cacheSize, sharedStore, recordStore)
 
     class TimePeriodsProblem(TimePeriodsProblemBase):
-        def __init__(self, feasibleSolution):
+        def __init__(self, feasibleSolution, evaluationEngine=None, problemConfig=problemConfig):
             super().__init__(feasibleSolution)
+            self.problemConfig = problemConfig
+            self.problemEvaluator = ProblemEvaluator(problemObj, evaluator, sharedProblems=sharedProblems)
+            self.cache = createEvaluationCache(problemConfig)
+            self.evaluationEngine = evaluationEngine
+
+        def __getstate__(self):
+            # Worker pools stay in the process that created them.
+            state = self.__dict__.copy()
+            state['evaluationEngine'] = None
+            return state
 
         def evaluate(self, feasibleSolution, problemObj=problemObj):
-            subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
-
-            headwayFunctions = problemLoader.loadHeadways(problemConfig, subwayProblem, feasibleSolution.variables)
-            env = simpy.Environment()
-            problemLoader.loadEnvironment(env, subwayProblem)
-            # print(feasibleSolution)
-            waiting = runSimulation(env, subwayProblem)
-            # print(waiting)
-            feasibleSolution.objectives[0] = waiting
+            # Revisited time periods are served from the cache, without
+            # headwayFunctions.
+            waiting = self.cache.get(feasibleSolution.variables)
+            headwayFunctions = None
+            if waiting is None:
+                waiting, headwayFunctions = self.problemEvaluator.evaluate(self.problemConfig,
+                                                                           feasibleSolution.variables)
+                self.cache.put(feasibleSolution.variables, waiting)
             feasibleSolution.headwayFunctions = headwayFunctions
+            feasibleSolution.objectives[0] = waiting
             return feasibleSolution
 
-        def printJsonSolution(self, problemObj, outputPath):
-            subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
-
-            headwayFunctions = problemLoader.loadHeadways(
-                problemConfig,
-                subwayProblem,
-                self.feasibleSolution.variables
-            )
-            env = simpy.Environment()
-            problemLoader.loadEnvironment(env, subwayProblem)
-            # print(feasibleSolution)
-            waiting = runSimulation(env, subwayProblem)
-            trainsLog = {}
-            for _id, train in subwayProblem.Train:
-                trainsLog[str(train)] = train.eventsLog
-
-            tripsLog = {}
-            for trainNumber in trainsLog.keys():
-                for tripNumber, tripLog in trainsLog[trainNumber].items():
-                    if not tripNumber in tripsLog:
-                        tripsLog[tripNumber] = {}
-                    tripsLog[tripNumber]['train'] = trainNumber
-                    tripsLog[tripNumber]['route'] = tripLog['route']
-                    tripsLog[tripNumber]['events'] = tripLog['events']
-            tripsLog = {key: tripsLog[key] for key in sorted(tripsLog.keys(), key=natural_keys)}
-
-            depotDepartures = {}
-            depotIdList = [depot['id'] for depot in problemObj['lineNodes']['depots']]
-            for _id in depotIdList:
-                depotObj = problemLoader.getDepotLikeObj(_id, subwayProblem)
-                depotDepartures[f'{str(depotObj)}'] = list(map(secondsToString, depotObj.departureTimes))
-
-            stationDepartures = {}
-            for _id, station in subwayProblem.Station:
-                stationDepartures[f'{str(station)}'] = list(map(secondsToString, station.departureTimes))
-
-            with open(outputPath / 'TrainLog.json', "w") as f:
-                f.write(json.dumps(trainsLog, indent=2))
-
-            with open(outputPath / 'TripsLog.json', "w") as f:
-                f.write(json.dumps(tripsLog, indent=2))
-
-            with open(outputPath / 'DepotDeparturesLog.json', "w") as f:
-                f.write(json.dumps(depotDepartures, indent=2))
-
-            with open(outputPath / 'StationDeparturesLog.json', "w") as f:
-                f.write(json.dumps(stationDepartures, indent=2))
-
-    bounds = getVariableBounds(problemConfig)
-    variableBounds = bounds['variableBounds']
-    intervalBounds = bounds['intervalBounds']
+        def evaluateBatch(self, feasibleSolutions):
+            # Cache misses are scored in parallel on the evaluation engine,
+            # or one by one when there is none.
+            if self.evaluationEngine is None:
+                return [self.evaluate(solution) for solution in feasibleSolutions]
+            return evaluateBatchCached(self.evaluationEngine, self.cache, self.problemConfig, feasibleSolutions)
+
+        def printJsonSolution(self, problemObj, outputPath, outputFormat='json'):
+            writeJsonSolution(problemObj, self.problemConfig, self.feasibleSolution.variables,
+                              outputPath, outputFormat)
+
+    def createInitialSolution(problemConfig, startVariables=None):
+        # Starts from startVariables, else from the best stored evaluation
+        # of this configuration, else from its configured time periods.
+        # Returns it with the feasible domain of the configuration.
+        bounds = getVariableBounds(problemConfig)
+        variableBounds = bounds['variableBounds']
+        intervalBounds = bounds['intervalBounds']
+        initialSolution = problemConfig['timePeriodConfig']
+        if startVariables is not None:
+            initialSolution = startVariables
+        elif evaluationStorePath is not None:
+            evaluationStore = SharedEvaluationStore(evaluationStorePath, getProblemHash(problemObj, problemConfig))
+            print(f"Evaluation store: {len(evaluationStore)} earlier evaluations of this problem.")
+            storedBest = evaluationStore.getBest()
+            if storedBest is not None and storedBest[1] < INF:
+                initialSolution, storedObjective = storedBest
+                print(f"Warm start from stored objective {storedObjective}")
+            evaluationStore.close()
+        feasibleDomain = TimePeriodDomain(variableBounds, intervalBounds,
+                                          anchors=problemConfig['timePeriodConfig'])
+        if feasibleDomain.getEmptyDepots():
+            raise ValueError(f"No feasible time periods for depots {feasibleDomain.getEmptyDepots()}.")
+        if not feasibleDomain.contains(initialSolution):
+            print("Initial time periods are infeasible, starting from a random feasible solution.")
+            initialSolution = feasibleDomain.sample()
+        solution = TimePeriodSolution(initialSolution, variableBounds, intervalBounds)
+        return solution, feasibleDomain
 
     t1 = time.time()
 
-    initialSolution = problemConfig['timePeriodConfig']
-
-    initialSolution = TimePeriodSolution(initialSolution, variableBounds, intervalBounds)
+    initialSolution, feasibleDomain = createInitialSolution(problemConfig)
     problem = TimePeriodsProblem(initialSolution)
+    if randomStart:
+        problem.feasibleDomain = feasibleDomain
     print(f"Inital : {initialSolution}")
 
-    def createAlgorithm(probability=0.5):
+    def createAlgorithm(probability=0.5, problem=problem, initialSolution=initialSolution,
+                        max_seconds=max_seconds, evaluations=None):
         class MySimulatedAnnealing(SimulatedAnnealing):
             def __init__(self, problem, mutation, termination_criterion, initial_solution):
                 super().__init__(problem, mutation, termination_criterion)
                 self.solution_generator = RandomGenerator()
                 self.solution = initial_solution
+                # For telemetry, see get_observable_data
+                self.proposals = 0
+                self.acceptances = 0
+                self.bestObjective = None
+
+            def step(self):
+                current = self.solutions[0]
+                super().step()
+                self.proposals += 1
+                if self.solutions[0] is not current:
+                    self.acceptances += 1
+
+            def get_observable_data(self):
+                data = super().get_observable_data()
+                objective = self.solutions[0].objectives[0]
+                if self.bestObjective is None or objective < self.bestObjective:
+                    self.bestObjective = objective
+                data['CHAINS'] = [{
+                    'temperature': self.temperature,
+                    'currentObjective': objective,
+                    'bestObjective': self.bestObjective,
+                    'proposals': self.proposals,
+                    'acceptances': self.acceptances
+                }]
+                return data
 
             def create_initial_solutions(self):
                 return [self.solution_generator.new(self.problem, self.solution)]
@@ -164,55 +300,180 @@ def main(jsonInputFilePath, max_seconds):
         return MySimulatedAnnealing(
                     problem=problem,
                     mutation=RandomMutationAll(probability),
-                    termination_criterion=StoppingByTime(max_seconds=max_seconds),
+                    termination_criterion=createTerminationCriterion(max_seconds, evaluations),
                     initial_solution=initialSolution
                 )
 
-    def optimize(p):
-        algorithm = createAlgorithm(p)
-
-        class PrintObjectivesMyObserver(PrintObjectivesObserver):
+    class PrintObjectivesMyObserver(PrintObjectivesObserver):
 
-            def __init__(self, frequency: float = 1.0) -> None:
-                super().__init__()
+        def __init__(self, frequency: float = 1.0) -> None:
+            super().__init__(frequency)
 
-            def update(self, *args, **kwargs):
-                evaluations = kwargs['EVALUATIONS']
-                solutions = kwargs['SOLUTIONS']
+        def update(self, *args, **kwargs):
+            evaluations = kwargs['EVALUATIONS']
+            solutions = kwargs['SOLUTIONS']
 
-                if (evaluations % self.display_frequency) == 0 and solutions:
-                    if type(solutions) == list:
-                        fitness = solutions[0].objectives
-                    else:
-                        fitness = solutions.objectives
+            if (evaluations % self.display_frequency) == 0 and solutions:
+                if type(solutions) == list:
+                    fitness = solutions[0].objectives
+                else:
+                    fitness = solutions.objectives
 
-                    LOGGER.info(
-                        'Evaluations: {}. fitness: {}, solution: {}'.format(
-                            evaluations, fitness, solutions
-                        )
+                LOGGER.info(
+                    'Evaluations: {}. fitness: {}, solution: {}'.format(
+                        evaluations, fitness, solutions
                     )
-        progress_bar = PrintObjectivesMyObserver()
-        algorithm.observable.register(progress_bar)
-        algorithm.run()
+                )
+
+    def runAlgorithm(algorithm, run):
+        # run names the chains of algorithm in the telemetry and profile.
+        algorithm.observable.register(PrintObjectivesMyObserver())
+        telemetryObserver = None
+        if telemetryWriter is not None:
+            telemetryObserver = TelemetryObserver(telemetryWriter, run, telemetryInterval)
+            algorithm.observable.register(telemetryObserver)
+        try:
+            with profile(profileSettings, run.replace(' ', '_')):
+                algorithm.run()
+        finally:
+            if telemetryObserver is not None:
+                telemetryObserver.finish()
+
+    def optimize(p):
+        algorithm = createAlgorithm(p)
+        runAlgorithm(algorithm, f'multistart p={p}')
         result = algorithm.get_result()
         cTime = algorithm.total_computing_time
-        return result, cTime
+        return result, cTime, algorithm.problem.cache.getStats()
+
+    def optimizeConfig(problemConfig, seconds, startVariables=None, probability=0.5, run='', evaluations=None):
+        configInitialSolution, configDomain = createInitialSolution(problemConfig, startVariables)
+        configProblem = TimePeriodsProblem(configInitialSolution, problemConfig=problemConfig)
+        if randomStart and startVariables is None:
+            configProblem.feasibleDomain = configDomain
+        algorithm = createAlgorithm(probability, configProblem, configInitialSolution, seconds, evaluations)
+        runAlgorithm(algorithm, run)
+        return algorithm.get_result(), algorithm.total_computing_time, configProblem.cache.getStats()
+
+    def optimizeAllConfigs():
+        # Every problem configuration is first screened with a fraction of its
+        # time budget, numCores configurations at a time, as they are
+        # generated. Configurations clearly worse than the best screened so
+        # far are dropped, the others resume from their screening result for
+        # the rest of their budget. Returns [(result, cTime, cacheStats, problemConfig)].
+        # With maxEvaluations the budget is evaluations instead of seconds.
+        seconds = configSeconds if configSeconds else max_seconds
+        screeningSeconds = seconds * screeningFraction if seconds is not None else None
+        resumeSeconds = seconds - screeningSeconds if seconds is not None else None
+        screeningEvaluations = resumeEvaluations = None
+        if maxEvaluations is not None:
+            screeningEvaluations = max(1, int(maxEvaluations * screeningFraction))
+            resumeEvaluations = max(1, maxEvaluations - screeningEvaluations)
+        configs = problemLoader.problemConfigGenerator(problemObj, subwayProblem)
+        survivors = []
+        bestObjective = INF
+        screened = 0
+        while True:
+            chunk = list(itertools.islice(configs, numCores))
+            if not chunk:
+                break
+            results = Parallel(n_jobs=numCores)(
+                delayed(optimizeConfig)(config, screeningSeconds, run=f'config {screened + index} screening',
+                                        evaluations=screeningEvaluations)
+                for index, config in enumerate(chunk))
+            for index, (config, result) in enumerate(zip(chunk, results)):
+                bestObjective = min(bestObjective, result[0].objectives[0])
+                survivors.append(result + (config, screened + index))
+            screened += len(chunk)
+            survivors = [survivor for survivor in survivors
+                         if survivor[0].objectives[0] <= bestObjective * (1 + pruneMargin)]
+        print(f"{len(survivors)} of {screened} problem configurations survived screening.")
+        results = Parallel(n_jobs=numCores)(
+            delayed(optimizeConfig)(survivor[3], resumeSeconds, survivor[0].variables,
+                                    run=f'config {survivor[4]}', evaluations=resumeEvaluations)
+            for survivor in survivors)
+        return [result + (survivor[3],) for result, survivor in zip(results, survivors)]
+
+    def runWithEngine(algorithm, run, candidatesPerStep):
+        # Every step is one batch of evaluations spread over the worker pool.
+        ownEngine = None
+        if evaluationEngine is None and numCores > 1:
+            ownEngine = EvaluationEngine(problemObj, numCores,
+                                         batchSize if batchSize else -(-candidatesPerStep // numCores),
+                                         evaluator, sharedProblems=sharedProblems,
+                                         profileSettings=profileSettings)
+        problem.evaluationEngine = evaluationEngine if evaluationEngine is not None else ownEngine
+        try:
+            runAlgorithm(algorithm, run)
+        finally:
+            problem.evaluationEngine = None
+            if ownEngine is not None:
+                ownEngine.close()
+
+    def optimizeWithReplicaExchange():
+        replicas = numReplicas if numReplicas else max(4, numCores)
+        algorithm = ReplicaExchangeAnnealing(
+            problem=problem,
+            mutation=RandomMutationAll(0.5),
+            termination_criterion=createTerminationCriterion(max_seconds),
+            initial_solution=initialSolution,
+            numReplicas=replicas
+        )
+        runWithEngine(algorithm, 'tempering', replicas)
+        print(f"Replica exchanges: {algorithm.exchangesAccepted}/{algorithm.exchangeAttempts} accepted")
+        return algorithm.get_result(), algorithm.total_computing_time, problem.cache.getStats()
+
+    def optimizeWithNeighbourhoodSearch(tabuTenure):
+        # The neighbourhood of a solution is scored as one batch per step.
+        neighbourhoodSize = max(1, len(BoundaryNeighbourhood(initialSolution)))
+        algorithm = NeighbourhoodSearch(
+            problem=problem,
+            termination_criterion=createTerminationCriterion(max_seconds),
+            initial_solution=initialSolution,
+            sampleSize=neighbourhoodSample,
+            tabuTenure=tabuTenure
+        )
+        runWithEngine(algorithm, algorithmName, min(neighbourhoodSample or neighbourhoodSize, neighbourhoodSize))
+        print(f"Moves: {algorithm.moves} in {algorithm.steps} steps" +
+              (", local optimum" if algorithm.converged else ""))
+        return algorithm.get_result(), algorithm.total_computing_time, problem.cache.getStats()
 
-    numCores = mp.cpu_count() - 2
-
-    toDecimal = lambda x: x / 100
-    probabilityList = list(map(toDecimal, range(10, 100 + 1, int((1 / numCores) * 100))))
-    algorithms = Parallel(n_jobs=numCores)(delayed(optimize)(p) for p in probabilityList)
+    try:
+        if allConfigs:
+            algorithms = optimizeAllConfigs()
+        elif algorithmName == 'tempering':
+            algorithms = [optimizeWithReplicaExchange()]
+        elif algorithmName == 'descent':
+            algorithms = [optimizeWithNeighbourhoodSearch(0)]
+        elif algorithmName == 'tabu':
+            algorithms = [optimizeWithNeighbourhoodSearch(tabuTenure)]
+        else:
+            toDecimal = lambda x: x / 100
+            probabilityList = list(map(toDecimal, range(10, 100 + 1, max(1, int((1 / numCores) * 100)))))
+            algorithms = Parallel(n_jobs=numCores)(delayed(optimize)(p) for p in probabilityList)
+    finally:
+        if sharedProblems is not None:
+            sharedProblems.close()
+        if prometheusEndpoint is not None:
+            prometheusEndpoint.close()
     # Save results to file
     objectives = []
     cTimes = []
+    cacheStats = []
     for algorithm in algorithms:
         objectives.append(algorithm[0].objectives[0])
         cTimes.append(str(algorithm[1]))
+        cacheStats.append(algorithm[2])
     print(objectives)
     print(cTimes)
+    print(f"Evaluation cache: {cacheStats}")
+    if sharedCache:
+        shutil.rmtree(sharedCacheDir, ignore_errors=True)
     algorithm = algorithms[argmin(objectives)]
     result = algorithm[0]
+    if allConfigs:
+        problemConfig = algorithm[3]
+        print(f"Best problem configuration: {problemConfig}")
 
     print('Problem: ' + problem.get_name())
     print(result)
@@ -223,27 +484,89 @@ def main(jsonInputFilePath, max_seconds):
     bestSolution = result
     print(bestSolution)
 
-    outputPath = pathlib.Path(r'../output/')
-    bestSolutionProblem = TimePeriodsProblem(bestSolution)
-    bestSolutionProblem.printJsonSolution(problemObj, outputPath)
+    outputPath = pathlib.Path(outputPath)
+    os.makedirs(outputPath, exist_ok=True)
+    bestSolutionProblem = TimePeriodsProblem(bestSolution, problemConfig=problemConfig)
+    bestSolutionProblem.printJsonSolution(problemObj, outputPath, outputFormat)
 
     with open(outputPath / 'timePeriods.json', 'w') as f:
         f.write(json.dumps(bestSolution.getSolutionDict(), indent=2))
 
     print('Solution written to output folder.')
+    if profileSettings is not None:
+        mainProfiler.stop()
+        writeProfile(profileSettings, outputPath, profileStats)
+    return bestSolution
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--max_seconds', '-s', help="Time Limit in Seconds", type=int)
     parser.add_argument('--json_input_file', '-i', help="JSON input file name", type=str)
+    parser.add_argument('--evaluator', '-e', help="Objective evaluator used during the search",
+                        choices=['analytic', 'simulation'], default='analytic', type=str)
+    parser.add_argument('--cache_size', help="Evaluations kept in memory per annealing chain",
+                        default=100000, type=int)
+    parser.add_argument('--shared_cache', help="Share evaluations between the annealing chains",
+                        action='store_true')
+    parser.add_argument('--evaluation_store', help="SQLite file keeping evaluations across runs",
+                        default=None, type=str)
+    parser.add_argument('--skip_seen', help="Reuse objectives found in the evaluation store",
+                        action='store_true')
+    parser.add_argument('--workers', '-w', help="Worker processes, by default all cores but two",
+                        default=None, type=int)
+    parser.add_argument('--algorithm', '-a', help="Independent annealing chains, replica exchange, "
+                                                  "or steepest descent or tabu search over boundary moves",
+                        choices=['multistart', 'tempering', 'descent', 'tabu'], default='multistart', type=str)
+    parser.add_argument('--replicas', help="Replicas for --algorithm tempering", default=None, type=int)
+    parser.add_argument('--neighbourhood_sample', help="Moves scored per step of --algorithm descent or tabu, "
+                                                       "by default all", default=None, type=int)
+    parser.add_argument('--random_start', help="Start every annealing chain from a uniformly drawn "
+                                               "feasible solution", action='store_true')
+    parser.add_argument('--tabu_tenure', help="Steps moving a boundary back is tabu for with --algorithm tabu",
+                        default=8, type=int)
+    parser.add_argument('--batch_size', help="Candidates sent to a worker at once", default=None, type=int)
+    parser.add_argument('--all_configs', help="Optimize every headway/time period configuration",
+                        action='store_true')
+    parser.add_argument('--config_seconds', help="Time limit per configuration with --all_configs, "
+                                                 "by default --max_seconds", default=None, type=float)
+    parser.add_argument('--prune_margin', help="Relative margin to the best screened objective "
+                                               "beyond which configurations are dropped", default=0.01, type=float)
+    parser.add_argument('--output_format', help="json, json without indentation, one trip per line "
+                                                "written while simulating, or columnar EventLog .npy files",
+                        choices=OUTPUT_FORMATS,
+                        default='json', type=str)
+    parser.add_argument('--telemetry', help="CSV or NDJSON file the state of every annealing chain is "
+                                            "recorded to", default=None, type=str)
+    parser.add_argument('--telemetry_interval', help="Seconds between telemetry records of a chain",
+                        default=1.0, type=float)
+    parser.add_argument('--telemetry_port', help="Serve the latest telemetry in the Prometheus text format "
+                                                 "on this port", default=None, type=int)
+    parser.add_argument('--max_evaluations', help="Evaluations per annealing chain, instead of --max_seconds",
+                        default=None, type=int)
+    parser.add_argument('--profile', help="Profile every process and write the time of every phase to "
+                                          "profile.json in the output folder, cprofile instruments every call, "
+                                          "sample takes stack samples", choices=PROFILE_MODES, nargs='?',
+                        const='cprofile', default=None)
+    parser.add_argument('--profile_interval', help="Milliseconds between stack samples of --profile sample",
+                        default=5, type=float)
+    parser.add_argument('--profile_stats', help="Also write the merged profile, profile.pstats or "
+                                                "flame graph stacks profile.collapsed", action='store_true')
     args = parser.parse_args()
-    if args.max_seconds == None:
+    if args.max_seconds == None and args.max_evaluations == None:
         raise ValueError("Missing arguments {max_seconds}.")
     max_seconds = args.max_seconds
     json_input_file = args.json_input_file
     jsonFolderPath = pathlib.Path(r'../data/')
     jsonPath = jsonFolderPath / json_input_file
-    main(jsonPath, max_seconds)
+    main(jsonPath, max_seconds, args.evaluator, args.cache_size, args.shared_cache,
+         args.evaluation_store, args.skip_seen, args.workers, args.algorithm,
+         args.replicas, args.batch_size, args.all_configs, args.config_seconds,
+         pruneMargin=args.prune_margin, outputFormat=args.output_format, telemetryPath=args.telemetry,
+         telemetryInterval=args.telemetry_interval, telemetryPort=args.telemetry_port,
+         maxEvaluations=args.max_evaluations, profileMode=args.profile,
+         profileInterval=args.profile_interval / 1000, profileStats=args.profile_stats,
+         neighbourhoodSample=args.neighbourhood_sample, tabuTenure=args.tabu_tenure,
+         randomStart=args.random_start)
 
 
 
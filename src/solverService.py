@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# coding: utf-8
+import asyncio
+import hashlib
+import json
+import logging
+import argparse
+import itertools
+import os
+import signal
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import subway.simulation.utils as u
+import problemLoader
+from evaluation import EvaluationCache, EvaluationEngine, compileProblem, evaluateBatchCached
+from sharedProblems import SharedProblems
+from feasibleDomain import TimePeriodDomain
+from optimization import TimePeriodsProblemBase, TimePeriodSolution, RandomMutationAll, ReplicaExchangeAnnealing
+from jmetal.util.termination_criterion import StoppingByEvaluations, StoppingByTime
+from utils import getVariableBounds, getWorkerCount, stringToSeconds
+
+LOGGER = logging.getLogger('jmetal')
+
+u.ENABLE_LOG = False
+u.ENABLE_DEBUG_PRINT = False
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+class ServiceError(RuntimeError):
+    """ A request the service can not serve, status is the HTTP status
+        it is answered with.
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def getContentHash(problemObj):
+    content = json.dumps(problemObj, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class CachedProblem(object):
+    """ A problem compiled by the service, see SolverService.getProblem.
+        Its evaluations and best time periods are kept across jobs.
+    """
+    def __init__(self, problemHash, problemConfig, cacheSize):
+        self.problemHash = problemHash
+        self.problemConfig = problemConfig
+        bounds = getVariableBounds(problemConfig)
+        self.variableBounds = bounds['variableBounds']
+        self.intervalBounds = bounds['intervalBounds']
+        self.feasibleDomain = TimePeriodDomain(self.variableBounds, self.intervalBounds,
+                                               anchors=problemConfig['timePeriodConfig'])
+        self.cache = EvaluationCache(cacheSize)
+        self.bestVariables = None
+        self.bestObjective = None
+
+
+class ServiceProblem(TimePeriodsProblemBase):
+    def __init__(self, feasibleSolution, cachedProblem, evaluationEngine):
+        super().__init__(feasibleSolution)
+        self.cachedProblem = cachedProblem
+        self.evaluationEngine = evaluationEngine
+
+    def evaluate(self, feasibleSolution):
+        return self.evaluateBatch([feasibleSolution])[0]
+
+    def evaluateBatch(self, feasibleSolutions):
+        return evaluateBatchCached(self.evaluationEngine, self.cachedProblem.cache,
+                                   self.cachedProblem.problemConfig, feasibleSolutions)
+
+
+class ProgressObserver(object):
+    """ Publishes the progress of an algorithm at most every interval
+        seconds.
+    """
+    def __init__(self, publish, interval=0.5):
+        self.publish = publish
+        self.interval = interval
+        self.lastPublished = None
+
+    def update(self, *args, **kwargs):
+        now = time.time()
+        if self.lastPublished is not None and now - self.lastPublished < self.interval:
+            return
+        self.lastPublished = now
+        self.publish({
+            'status': 'running',
+            'evaluations': kwargs['EVALUATIONS'],
+            'objective': kwargs['SOLUTIONS'].objectives[0],
+            'seconds': kwargs['COMPUTING_TIME']
+        })
+
+
+class Job(object):
+    """ One optimization request. Its events are kept, so that every
+        subscriber sees all of them, see subscribe.
+    """
+    def __init__(self, jobId, request):
+        self.jobId = jobId
+        self.request = request
+        self.status = 'queued'
+        self.problemHash = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self.subscribers = []
+
+    def isFinished(self):
+        return self.status in ('done', 'failed')
+
+    def publish(self, event):
+        event = dict(event, jobId=self.jobId)
+        self.status = event['status']
+        self.events.append(event)
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(event)
+
+    def subscribe(self):
+        subscriber = asyncio.Queue()
+        for event in self.events:
+            subscriber.put_nowait(event)
+        if not self.isFinished():
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def getState(self):
+        state = {'jobId': self.jobId, 'status': self.status, 'problemHash': self.problemHash}
+        if self.result is not None:
+            state['result'] = self.result
+        if self.error is not None:
+            state['error'] = self.error
+        return state
+
+
+class SolverService(object):
+    """ Runs optimization jobs one after the other on a warm
+        EvaluationEngine. Problems are compiled on their first job and kept
+        by content hash, maxProblems at most, so that later jobs on the same
+        problem skip loading and reuse its evaluations and best time periods.
+
+        A job request is a JSON object:
+            problem: the JSON problem, or
+            problemHash: the hash of a problem sent before
+            maxSeconds / maxEvaluations: when to stop, 10 seconds by default
+            timePeriods: {depotId: ["05:00:00", ...]} to start from, by
+                default the best time periods found so far for the problem
+            numReplicas: replicas of the replica-exchange annealing
+        Its result is {timePeriods, objective, evaluations, seconds}, the
+        time periods as in timePeriods.json.
+    """
+    def __init__(self, numWorkers=None, batchSize=None, evaluator='analytic', maxProblems=32,
+                 cacheSize=100000, maxJobs=1000):
+        self.numWorkers = numWorkers if numWorkers else getWorkerCount()
+        self.evaluator = evaluator
+        self.maxProblems = maxProblems
+        self.cacheSize = cacheSize
+        self.maxJobs = maxJobs
+        self.defaultReplicas = max(4, self.numWorkers)
+        self.evaluationEngine = EvaluationEngine(numWorkers=self.numWorkers,
+                                                 batchSize=batchSize if batchSize else
+                                                 -(-self.defaultReplicas // self.numWorkers),
+                                                 evaluator=evaluator)
+        # {problemHash: CachedProblem}, the least recently used first. Jobs
+        # change it on the executor thread while /status reads it on the
+        # event loop, both under problemsLock.
+        self.problems = OrderedDict()
+        self.problemsLock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.jobIds = itertools.count(1)
+        self.queue = None
+        # Jobs run one at a time, the engine keeps every core busy.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def close(self):
+        self.executor.shutdown()
+        self.evaluationEngine.close()
+
+    def submit(self, request):
+        if not isinstance(request, dict) or ('problem' not in request and 'problemHash' not in request):
+            raise ServiceError("A job needs a problem or a problemHash.")
+        if 'problem' not in request and request['problemHash'] not in self.problems:
+            raise ServiceError(f"Problem {request['problemHash']} is not cached, send the problem.", 404)
+        job = Job(next(self.jobIds), request)
+        self.jobs[job.jobId] = job
+        finishedJobs = [jobId for jobId, other in self.jobs.items() if other.isFinished()]
+        for jobId in finishedJobs[:max(0, len(self.jobs) - self.maxJobs)]:
+            del self.jobs[jobId]
+        job.publish({'status': 'queued', 'position': self.queue.qsize()})
+        self.queue.put_nowait(job)
+        return job
+
+    def getJob(self, jobId):
+        try:
+            return self.jobs[int(jobId)]
+        except (KeyError, ValueError):
+            raise ServiceError(f"Unknown job {jobId}.", 404)
+
+    async def runJobs(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            job = await self.queue.get()
+
+            def publish(event, job=job):
+                loop.call_soon_threadsafe(job.publish, event)
+            job.publish({'status': 'running'})
+            try:
+                job.result = await loop.run_in_executor(self.executor, self.solve, job, publish)
+                job.publish({'status': 'done', 'result': job.result})
+            except Exception as e:
+                LOGGER.error(f"Job {job.jobId} failed: {e}")
+                traceback.print_exc()
+                job.error = str(e)
+                job.publish({'status': 'failed', 'error': job.error})
+
+    def getProblem(self, request):
+        """ The CachedProblem of a job request, compiling the problem and
+            adding it to the engine when it is not cached yet.
+        """
+        problemObj = request.get('problem')
+        problemHash = request['problemHash'] if problemObj is None else getContentHash(problemObj)
+        with self.problemsLock:
+            cachedProblem = self.problems.get(problemHash)
+            if cachedProblem is not None:
+                self.problems.move_to_end(problemHash)
+                return cachedProblem
+        if problemObj is None:
+            raise ServiceError(f"Problem {problemHash} is not cached, send the problem.", 404)
+        # Compiled without the lock, jobs run one at a time.
+        compiledProblem = compileProblem(problemObj, self.evaluator)
+        problemConfig = next(problemLoader.problemConfigGenerator(problemObj, compiledProblem[0]))
+        compiledProblem[0].reset()
+        self.evaluationEngine.addProblems(SharedProblems({problemHash: compiledProblem}))
+        cachedProblem = CachedProblem(problemHash, problemConfig, self.cacheSize)
+        evictedHash = None
+        with self.problemsLock:
+            self.problems[problemHash] = cachedProblem
+            if len(self.problems) > self.maxProblems:
+                evictedHash, _evicted = self.problems.popitem(last=False)
+        if evictedHash is not None:
+            self.evaluationEngine.removeProblems([evictedHash])
+        return cachedProblem
+
+    def solve(self, job, publish):
+        request = job.request
+        cachedProblem = self.getProblem(request)
+        job.problemHash = cachedProblem.problemHash
+        publish({'status': 'running', 'problemHash': cachedProblem.problemHash})
+
+        variables = cachedProblem.problemConfig['timePeriodConfig']
+        if 'timePeriods' in request:
+            variables = {int(depotId): [stringToSeconds(t) for t in timePeriods]
+                         for depotId, timePeriods in request['timePeriods'].items()}
+            if not cachedProblem.feasibleDomain.contains(variables):
+                raise ServiceError("The time periods are outside their windows or period sizes.")
+        elif cachedProblem.bestVariables is not None:
+            variables = cachedProblem.bestVariables
+        initialSolution = TimePeriodSolution(variables, cachedProblem.variableBounds, cachedProblem.intervalBounds)
+
+        if 'maxEvaluations' in request:
+            terminationCriterion = StoppingByEvaluations(max_evaluations=int(request['maxEvaluations']))
+        else:
+            terminationCriterion = StoppingByTime(max_seconds=float(request.get('maxSeconds', 10)))
+        evaluationEngine = self.evaluationEngine.forLine(cachedProblem.problemHash)
+        algorithm = ReplicaExchangeAnnealing(
+            problem=ServiceProblem(initialSolution, cachedProblem, evaluationEngine),
+            mutation=RandomMutationAll(0.5),
+            termination_criterion=terminationCriterion,
+            initial_solution=initialSolution,
+            numReplicas=int(request.get('numReplicas', self.defaultReplicas))
+        )
+        algorithm.observable.register(ProgressObserver(publish))
+        algorithm.run()
+        result = algorithm.get_result()
+        if cachedProblem.bestObjective is None or result.objectives[0] < cachedProblem.bestObjective:
+            cachedProblem.bestVariables = {depotId: list(timePeriods) for depotId, timePeriods in result.variables.items()}
+            cachedProblem.bestObjective = result.objectives[0]
+        return {
+            'timePeriods': result.getSolutionDict(),
+            'objective': result.objectives[0],
+            'evaluations': algorithm.evaluations,
+            'seconds': algorithm.total_computing_time
+        }
+
+    def getStatus(self):
+        with self.problemsLock:
+            problems = list(self.problems.items())
+        return {
+            'workers': self.numWorkers,
+            'evaluator': self.evaluator,
+            'queued': self.queue.qsize(),
+            'jobs': len(self.jobs),
+            'problems': {problemHash: {'bestObjective': problem.bestObjective, 'cache': problem.cache.getStats()}
+                         for problemHash, problem in problems}
+        }
+
+    async def handleConnection(self, reader, writer):
+        try:
+            request = await readRequest(reader)
+            if request is not None:
+                await self.handleRequest(writer, *request)
+        except ServiceError as e:
+            await writeJson(writer, e.status, {'error': str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handleRequest(self, writer, method, path, body):
+        """ POST /jobs            queues a job, answers with its id
+            POST /solve           queues a job and streams its events
+            GET  /jobs/{id}       state of a job, with its result when done
+            GET  /jobs/{id}/events  streams the events of a job
+            GET  /status          queue and cached problems
+            Events are streamed as NDJSON, the last one being the result.
+        """
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if method == 'POST' and parts in (['jobs'], ['solve']):
+            try:
+                jobRequest = json.loads(body)
+            except ValueError as e:
+                raise ServiceError(f"Invalid JSON: {e}")
+            job = self.submit(jobRequest)
+            if parts == ['jobs']:
+                await writeJson(writer, 202, job.getState())
+            else:
+                await streamEvents(writer, job)
+        elif method == 'GET' and len(parts) == 2 and parts[0] == 'jobs':
+            await writeJson(writer, 200, self.getJob(parts[1]).getState())
+        elif method == 'GET' and len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            await streamEvents(writer, self.getJob(parts[1]))
+        elif method == 'GET' and parts == ['status']:
+            await writeJson(writer, 200, self.getStatus())
+        elif parts in (['jobs'], ['solve'], ['status']):
+            raise ServiceError(f"Method {method} is not allowed on {path}.", 405)
+        else:
+            raise ServiceError(f"Unknown path {path}.", 404)
+
+    async def serve(self, socketPath=None, host='127.0.0.1', port=8750):
+        """ Serves until SIGINT or SIGTERM. """
+        loop = asyncio.get_event_loop()
+        stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        self.queue = asyncio.Queue()
+        runner = asyncio.ensure_future(self.runJobs())
+        if socketPath is not None:
+            server = await asyncio.start_unix_server(self.handleConnection, path=socketPath)
+            print(f"Solver service listening on {socketPath}")
+        else:
+            server = await asyncio.start_server(self.handleConnection, host, port)
+            print(f"Solver service listening on http://{host}:{port}")
+        try:
+            await stopping.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            runner.cancel()
+            if socketPath is not None and os.path.exists(socketPath):
+                os.remove(socketPath)
+
+
+async def readRequest(reader):
+    """ Returns (method, path, body) of an HTTP/1.1 request, None if the
+        connection was closed before one arrived.
+    """
+    requestLine = await reader.readline()
+    if not requestLine.strip():
+        return None
+    try:
+        method, path, _version = requestLine.decode('latin-1').split()
+    except ValueError:
+        raise ServiceError("Malformed request line.")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method.upper(), path, body
+
+
+async def writeJson(writer, status, obj):
+    body = json.dumps(obj).encode('utf-8')
+    writer.write(f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+
+
+async def streamEvents(writer, job):
+    """ Writes the events of job as chunked NDJSON until it is finished. """
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                 b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+    subscriber = job.subscribe()
+    try:
+        while True:
+            event = await subscriber.get()
+            line = json.dumps(event).encode('utf-8') + b'\n'
+            writer.write(f"{len(line):x}\r\n".encode('latin-1') + line + b"\r\n")
+            await writer.drain()
+            if event['status'] in ('done', 'failed'):
+                break
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        if subscriber in job.subscribers:
+            job.subscribers.remove(subscriber)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Long running solver that keeps its worker pool and "
+                                                 "compiled problems warm between jobs")
+    parser.add_argument('--socket', help="Listen on this Unix socket instead of TCP", default=None, type=str)
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', '-p', default=8750, type=int)
+    parser.add_argument('--workers', '-w', help="Worker processes, by default all cores but two",
+                        default=None, type=int)
+    parser.add_argument('--evaluator', '-e', help="Objective evaluator used during the search",
+                        choices=['analytic', 'simulation'], default='analytic', type=str)
+    parser.add_argument('--batch_size', help="Candidates sent to a worker at once", default=None, type=int)
+    parser.add_argument('--max_problems', help="Compiled problems kept warm", default=32, type=int)
+    parser.add_argument('--cache_size', help="Evaluations kept in memory per problem", default=100000, type=int)
+    args = parser.parse_args()
+    service = SolverService(args.workers, args.batch_size, args.evaluator, args.max_problems, args.cache_size)
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(service.serve(args.socket, args.host, args.port))
+    finally:
+        service.close()
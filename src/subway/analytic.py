@@ -0,0 +1,270 @@
+import bisect
+import heapq
+import numpy as np
+from .simulation.errors import SimulationError, AnalyticEvaluationError
+from .world import Depot, LaunchAndForgetDepot
+
+# Event kinds, in the order they are handled when everything else is equal
+RETURN = 0
+LAUNCH = 1
+
+
+def getDepots(subwayProblem):
+    return [depot for DepotClass in subwayProblem.depotClasses for _id, depot in DepotClass]
+
+
+def checkAnalyticSupport(subwayProblem):
+    """ Raises AnalyticEvaluationError if the problem uses features the
+        analytic evaluator can not reproduce, ie. anything but constant
+        dwell times and the Depot/LaunchAndForgetDepot launch policies.
+    """
+    for _id, station in subwayProblem.Station:
+        if station.dwellTime is None:
+            raise AnalyticEvaluationError(f"Station {station} has a time dependent dwell function.")
+    for depot in getDepots(subwayProblem):
+        if type(depot) not in (Depot, LaunchAndForgetDepot):
+            raise AnalyticEvaluationError(f"Unknown depot type {type(depot).__name__} of {depot}.")
+    for _id, route in subwayProblem.Route:
+        if len(route.stations) < 2:
+            raise AnalyticEvaluationError(f"Route {route} must have at least two stations.")
+
+
+def getRouteOffsets(route):
+    """ Returns (departureOffsets, returnOffset) of a trip on route,
+        relative to the time the train is launched to the first station.
+        departureOffsets[i] is when the train departs route.stations[i],
+        returnOffset is when it is back at the circulating depot.
+    """
+    departureOffsets = []
+    now = 0
+    for hop, fromStation in enumerate(route.stations[:-1]):
+        now += fromStation.dwellTime
+        departureOffsets.append(now)
+        now += route.getHopTime(hop)
+    now += route.stations[-1].dwellTime
+    departureOffsets.append(now)
+    returnOffset = now + max(route.turnAroundTime, route.lastStationToDepotTime)
+    return departureOffsets, returnOffset
+
+
+def getStationWaiting(departureTimes, arrivalsFunction):
+    """ Waiting accumulated at a station over the given departure times.
+        Same quantity as Station.trackWaitingTime summed over a run.
+    """
+    times = np.sort(departureTimes)
+    previousTimes = np.concatenate(([0], times[:-1]))
+    cumDemands = arrivalsFunction.interpolate(times)
+    previousCumDemands = np.concatenate(([arrivalsFunction(0)], cumDemands[:-1]))
+    return float(np.sum((times - previousTimes) * (cumDemands - previousCumDemands))) / 2.0
+
+
+class Checkpoint(object):
+    """ Replay state right before the first event at or after time.
+
+        maxHeadwayTime is the latest time a headway function was called at,
+        which can be later than time because of the depot-out delay of
+        initial launches. The state is valid for any other schedule whose
+        headway functions agree before max(time, maxHeadwayTime + 1).
+    """
+    def __init__(self, time, maxHeadwayTime, sequence, events, stationed, initialTrainCount,
+                 launchedCounter, routeIndex, tripLaunches, lastHeadway):
+        self.time = time
+        self.maxHeadwayTime = maxHeadwayTime
+        self.sequence = sequence
+        self.events = events
+        self.stationed = stationed
+        self.initialTrainCount = initialTrainCount
+        self.launchedCounter = launchedCounter
+        self.routeIndex = routeIndex
+        # {route: (launches, count)}, launches is shared with the replay that
+        # recorded the checkpoint and only its first count entries belong here.
+        self.tripLaunches = tripLaunches
+        self.lastHeadway = lastHeadway
+
+    def isValidFrom(self, changeTime):
+        """ True if nothing replayed up to this checkpoint depends on
+            headways at or after changeTime.
+        """
+        return self.time <= changeTime and self.maxHeadwayTime < changeTime
+
+
+class LaunchReplay(object):
+    """ Replays depot launches and train returns of a SubwayProblem, in the
+        order SimPy would process them, see computeTotalWaiting.
+
+        checkpointTimes: times at which the replay state is recorded, so that
+            a later replay of a schedule that only differs after one of them
+            can resume from there instead of starting over, see restore.
+        routeOffsets: {route: getRouteOffsets(route)} computed beforehand, eg.
+            once per problem, as dwell and travel times do not change.
+    """
+    def __init__(self, subwayProblem, checkpointTimes=(), routeOffsets=None):
+        self.subwayProblem = subwayProblem
+        self.dayEnd = subwayProblem.dayEndTimeSeconds
+        self.depots = getDepots(subwayProblem)
+        self.routes = [route for _id, route in subwayProblem.Route]
+        if routeOffsets is None:
+            routeOffsets = {route: getRouteOffsets(route) for route in self.routes}
+        self.routeOffsets = routeOffsets
+        self.checkpointTimes = sorted(checkpointTimes)
+        self.checkpoints = []
+        self.nextCheckpoint = 0
+
+        for depot in self.depots:
+            if depot.routeSequence is None or depot.headwayFunction is None:
+                raise AnalyticEvaluationError(f"Depot {depot} needs a routing sequence and a headway function.")
+
+        self.maxHeadwayTime = -1
+        self.stationed = {depot: len(depot.stationed) for depot in self.depots}
+        self.initialTrainCount = {}
+        self.launchedCounter = {depot: 0 for depot in self.depots}
+        self.routeIndex = {}
+        self.lastHeadway = {depot: None for depot in self.depots}
+        # {depot: (launchTimes, headways, index)} of depots launching every
+        # headway, see HeadwaySchedule.getLaunchTable. Tables belong to the
+        # current headway functions and are never checkpointed.
+        self.launchTables = {}
+        self.tripLaunches = {route: [] for route in self.routes}
+        # Entries are (time, scheduledAt, kind, sequence, target). SimPy processes
+        # events of the same time in the order they were scheduled.
+        self.events = [(depot.firstLaunchAt, -1, LAUNCH, sequence, depot)
+                       for sequence, depot in enumerate(self.depots)]
+        self.sequence = len(self.events)
+        heapq.heapify(self.events)
+
+    def recordCheckpoint(self, time):
+        tripLaunches = {route: (launches, len(launches)) for route, launches in self.tripLaunches.items()}
+        self.checkpoints.append(Checkpoint(time, self.maxHeadwayTime, self.sequence, list(self.events),
+                                           dict(self.stationed), dict(self.initialTrainCount),
+                                           dict(self.launchedCounter), dict(self.routeIndex),
+                                           tripLaunches, dict(self.lastHeadway)))
+
+    def restore(self, checkpoints, index):
+        """ Continues from checkpoints[index], recorded by a replay of the
+            same problem. The checkpoints before it are kept as this replay's
+            own, since both replays are identical up to there.
+        """
+        checkpoint = checkpoints[index]
+        self.maxHeadwayTime = checkpoint.maxHeadwayTime
+        self.sequence = checkpoint.sequence
+        self.events = list(checkpoint.events)
+        self.stationed = dict(checkpoint.stationed)
+        self.initialTrainCount = dict(checkpoint.initialTrainCount)
+        self.launchedCounter = dict(checkpoint.launchedCounter)
+        self.routeIndex = dict(checkpoint.routeIndex)
+        self.tripLaunches = {route: launches[:count] for route, (launches, count) in checkpoint.tripLaunches.items()}
+        self.lastHeadway = dict(checkpoint.lastHeadway)
+        self.launchTables = {}
+        self.checkpoints = checkpoints[:index + 1]
+        self.nextCheckpoint = bisect.bisect_right(self.checkpointTimes, checkpoint.time)
+
+    def run(self):
+        """ Replays up to the end of the day and returns the total waiting. """
+        dayEnd = self.dayEnd
+        events = self.events
+        checkpointTimes = self.checkpointTimes
+        stationed = self.stationed
+        initialTrainCount = self.initialTrainCount
+        launchedCounter = self.launchedCounter
+        routeIndex = self.routeIndex
+        lastHeadway = self.lastHeadway
+        launchTables = self.launchTables
+        while events:
+            now = events[0][0]
+            while self.nextCheckpoint < len(checkpointTimes) and now >= checkpointTimes[self.nextCheckpoint]:
+                self.recordCheckpoint(checkpointTimes[self.nextCheckpoint])
+                self.nextCheckpoint += 1
+            if now >= dayEnd:
+                break
+            now, _scheduledAt, kind, _sequence, depot = heapq.heappop(events)
+            if kind == RETURN:
+                stationed[depot] += 1
+                continue
+
+            if depot not in initialTrainCount:
+                initialTrainCount[depot] = stationed[depot]
+                routeIndex[depot] = 0
+            isLaunchAndForget = type(depot) is LaunchAndForgetDepot
+            if stationed[depot] == 0:
+                if isLaunchAndForget:
+                    continue
+                raise SimulationError(f"{depot} has ran out of trains.")
+            stationed[depot] -= 1
+            route = depot.routeSequence[routeIndex[depot]]
+            routeIndex[depot] = (routeIndex[depot] + 1) % len(depot.routeSequence)
+
+            launchAt = now
+            isDelayed = isLaunchAndForget or launchedCounter[depot] < initialTrainCount[depot]
+            if isDelayed:
+                launchAt += route.depotToFirstStationTime
+                if launchAt >= dayEnd:
+                    continue
+            launchedCounter[depot] += 1
+
+            departureOffsets, returnOffset = self.routeOffsets[route]
+            self.tripLaunches[route].append(launchAt)
+            heapq.heappush(events, (launchAt + returnOffset, launchAt + departureOffsets[-1],
+                                    RETURN, self.sequence, route.depot))
+            self.maxHeadwayTime = max(self.maxHeadwayTime, launchAt)
+            timeForNextLaunch = self.getHeadway(depot, launchAt, isDelayed)
+            lastHeadway[depot] = timeForNextLaunch
+            heapq.heappush(events, (launchAt + timeForNextLaunch, launchAt, LAUNCH, self.sequence + 1, depot))
+            self.sequence += 2
+        return self.getTotalWaiting()
+
+    def getHeadway(self, depot, launchAt, isDelayed):
+        """ Same as depot.headwayFunction(launchAt, lastHeadway). Once a
+            Depot launches without depot-out delay, its next launches are
+            exactly a headway apart and are read from a launch table.
+        """
+        launchTable = self.launchTables.get(depot)
+        if launchTable is not None:
+            launchTimes, headways, index = launchTable
+            if index < len(launchTimes) and launchTimes[index] == launchAt:
+                self.launchTables[depot] = (launchTimes, headways, index + 1)
+                return headways[index]
+            del self.launchTables[depot]
+        headwayFunction = depot.headwayFunction
+        if isDelayed or not hasattr(headwayFunction, 'getLaunchTable'):
+            return headwayFunction(launchAt, self.lastHeadway[depot])
+        launchTimes, headways = headwayFunction.getLaunchTable(launchAt, self.lastHeadway[depot], self.dayEnd)
+        if not launchTimes:
+            return headwayFunction(launchAt, self.lastHeadway[depot])
+        self.launchTables[depot] = (launchTimes, headways, 1)
+        return headways[0]
+
+    def getTotalWaiting(self):
+        dayEnd = self.dayEnd
+        stations = [station for _id, station in self.subwayProblem.Station]
+        stationDepartures = [[] for _station in stations]
+        for route, launches in self.tripLaunches.items():
+            if not launches:
+                continue
+            departureOffsets, _returnOffset = self.routeOffsets[route]
+            departures = np.add.outer(np.array(launches), np.array(departureOffsets))
+            for station, stationDepartureTimes in zip(route.stations, departures.T):
+                stationDepartureTimes = stationDepartureTimes[stationDepartureTimes < dayEnd]
+                stationDepartures[station.index].append(stationDepartureTimes)
+
+        totalWaiting = 0
+        for station in stations:
+            if stationDepartures[station.index]:
+                departureTimes = np.concatenate(stationDepartures[station.index])
+                if len(departureTimes):
+                    totalWaiting += getStationWaiting(departureTimes, station.arrivalsFunction)
+        return totalWaiting
+
+
+def computeTotalWaiting(subwayProblem):
+    """ Computes sum(station.accumulatedWaiting) of a simulation run
+        without running the SimPy simulation.
+
+        Depot launches and train returns are the only events that interact,
+        so only those are replayed, in the order SimPy would process them.
+        Every launch dispatches a trip whose station departures are fixed
+        offsets from the launch, the waiting time is then integrated over
+        all departures per station in one pass.
+        Raises SimulationError where the simulation would.
+        Headway functions must be fresh, as they are for a SimPy run.
+    """
+    return LaunchReplay(subwayProblem).run()
@@ -0,0 +1,141 @@
+from array import array
+import json
+import os
+import numpy as np
+from utils import secondsToString
+
+ACTIONS = ('departure', 'arrival', 'idle', 'soft-arrival')
+
+
+class EventStore(object):
+    """ Train events of a simulation run kept column by column.
+
+        Every event is one row of the parallel integer columns time (seconds),
+        node, action, train, trip and route, where node, action, train and
+        route are indices into nodeNames, actionNames, trainNames and
+        routeNames. Node indices are the compact node indices of the travel
+        time matrix (SubwayProblem.nodeIndex). Set with
+        SubwayProblem.setEventStore, it replaces the per event dicts of
+        Train.eventsLog, see getTrainLogs for that view.
+    """
+    COLUMNS = ('time', 'node', 'action', 'train', 'trip', 'route')
+
+    def __init__(self, nodeNames=(), trainNames=(), routeNames=(), actionNames=ACTIONS):
+        self.nodeNames = list(nodeNames)
+        self.trainNames = list(trainNames)
+        self.routeNames = list(routeNames)
+        self.actionNames = list(actionNames)
+        self.columns = {column: array('q') for column in self.COLUMNS}
+        # Codes of the simulation objects, only known to stores being recorded
+        self.nodeCodes = {}
+        self.noRouteCode = None
+        self.actionCodes = {action: code for code, action in enumerate(self.actionNames)}
+
+    @classmethod
+    def fromProblem(cls, subwayProblem):
+        """ An empty store for the nodes, trains and routes of subwayProblem. """
+        store = cls()
+        nodes = [station for _id, station in subwayProblem.Station] + \
+                [depot for DepotClass in subwayProblem.depotClasses for _id, depot in DepotClass]
+        # Nodes without travel times get indices after those of the matrix.
+        nodeCount = len(subwayProblem.nodeIndex)
+        for node in nodes:
+            if node._id in subwayProblem.nodeIndex:
+                store.nodeCodes[node] = subwayProblem.nodeIndex[node._id]
+            else:
+                store.nodeCodes[node] = nodeCount
+                nodeCount += 1
+        store.nodeNames = [''] * nodeCount
+        for node, code in store.nodeCodes.items():
+            store.nodeNames[code] = str(node)
+        # Trains and routes are coded by their dense index.
+        store.trainNames = [str(train) for _id, train in sorted(subwayProblem.Train, key=lambda item: item[1].index)]
+        store.routeNames = [str(route) for _id, route in sorted(subwayProblem.Route, key=lambda item: item[1].index)]
+        # Events of a train without a route are logged with route 'None'.
+        store.noRouteCode = len(store.routeNames)
+        store.routeNames.append(str(None))
+        return store
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def addEvent(self, time, node, action, train, tripNumber, route):
+        columns = self.columns
+        columns['time'].append(int(time))
+        columns['node'].append(self.nodeCodes[node])
+        columns['action'].append(self.actionCodes[action])
+        columns['train'].append(train.index)
+        columns['trip'].append(-1 if tripNumber is None else tripNumber)
+        columns['route'].append(self.noRouteCode if route is None else route.index)
+
+    def getColumn(self, column):
+        # Columns of a loaded store stay memory mapped int32 arrays
+        return np.asarray(self.columns[column])
+
+    def getEvent(self, row, times, nodes, actions):
+        return {
+            'time': secondsToString(times[row]),
+            'node': self.nodeNames[nodes[row]],
+            'action': self.actionNames[actions[row]]
+        }
+
+    def getTripKey(self, tripNumber):
+        return f'Trip #{None if tripNumber < 0 else tripNumber}'
+
+    def getTrainLogs(self):
+        """ Yields (trainName, eventsLog) of every train, one train at a
+            time, eventsLog being what Train.eventsLog would have held.
+        """
+        trains = self.getColumn('train')
+        order = np.argsort(trains, kind='stable')
+        bounds = np.searchsorted(trains[order], np.arange(len(self.trainNames) + 1))
+        times, nodes, actions, trips, routes = (self.getColumn(column).tolist() for column in
+                                                ('time', 'node', 'action', 'trip', 'route'))
+        for train, trainName in enumerate(self.trainNames):
+            eventsLog = {}
+            for row in order[bounds[train]:bounds[train + 1]].tolist():
+                tripKey = self.getTripKey(trips[row])
+                if tripKey not in eventsLog:
+                    eventsLog[tripKey] = {'route': self.routeNames[routes[row]], 'events': []}
+                eventsLog[tripKey]['events'].append(self.getEvent(row, times, nodes, actions))
+            yield trainName, eventsLog
+
+    def getTripLogs(self):
+        """ Yields (tripKey, trainName, routeName, events) of every trip in
+            trip number order, one trip at a time.
+        """
+        trips = self.getColumn('trip')
+        order = np.argsort(trips, kind='stable')
+        sortedTrips = trips[order]
+        starts = np.flatnonzero(np.diff(sortedTrips, prepend=sortedTrips[:1] - 1))
+        ends = np.append(starts[1:], len(order))
+        times, nodes, actions, trains, routes = (self.getColumn(column).tolist() for column in
+                                                 ('time', 'node', 'action', 'train', 'route'))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            rows = order[start:end].tolist()
+            events = [self.getEvent(row, times, nodes, actions) for row in rows]
+            yield (self.getTripKey(int(sortedTrips[start])), self.trainNames[trains[rows[0]]],
+                   self.routeNames[routes[rows[0]]], events)
+
+    def save(self, path):
+        """ Writes the directory path holding every column as an int32
+            <column>.npy and the name tables as names.json.
+        """
+        os.makedirs(path, exist_ok=True)
+        for column in self.COLUMNS:
+            np.save(os.path.join(path, f'{column}.npy'), self.getColumn(column).astype(np.int32))
+        with open(os.path.join(path, 'names.json'), 'w') as f:
+            json.dump({'nodeNames': self.nodeNames, 'trainNames': self.trainNames,
+                       'routeNames': self.routeNames, 'actionNames': self.actionNames}, f)
+
+    @classmethod
+    def load(cls, path, mmapMode='r'):
+        """ Reads a store written by save, its columns memory mapped
+            unless mmapMode is None.
+        """
+        with open(os.path.join(path, 'names.json')) as f:
+            names = json.load(f)
+        store = cls(names['nodeNames'], names['trainNames'], names['routeNames'], names['actionNames'])
+        store.columns = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mmapMode)
+                         for column in cls.COLUMNS}
+        return store
@@ -1,22 +1,9 @@
 from .simulation.errors import SimulationError
-
-def timeToTravel(_departFrom, _arriveTo, travelTime, Error=RuntimeError):
-    """
-    The time to travel between nodes in the subway
-    :param _departFrom: a Station like object or object Id
-    :param _arriveTo: a Station like object or object Id
-    :return: travel duration
-    """
-    # if isinstance(_departFrom, int):
-    #     departFrom, arriveTo = _departFrom, _arriveTo
-    # else:
-    departFrom, arriveTo = _departFrom._id, _arriveTo._id
-
-    if (departFrom, arriveTo) in travelTime:
-        return travelTime[(departFrom, arriveTo)]
-    else:
-        raise Error(f"No travel time info for {(departFrom, arriveTo)}")
-
+from array import array
+from bisect import bisect_right
+from functools import reduce
+from math import gcd
+import numpy as np
 
 def clamp(old, new, step):
     """
@@ -33,47 +20,122 @@ def clamp(old, new, step):
     raise RuntimeError("Unexpected clamp behavior")
 
 
-def smooth(step = 60):
-    # The user might want to specify transition size.
-    # smooth is a decorator that takes user argument and
-    # returns a decorator 'inner_smooth' which wraps
-    # 'headwayFunction'
-    def inner_smooth(headwayFunction, step = step):
-        # We want a gradual transition for headway times.
-        # Hence this decorator produces exactly that.
-        def wrapper(timepoint):
-            newHeadway = headwayFunction(timepoint)
-            wrapper.lastHeadway = clamp(wrapper.lastHeadway, newHeadway, step)
-            return wrapper.lastHeadway
-        wrapper.lastHeadway = None
-        # We have a statefull function. We might want to be able
-        # to reset it.
-        def reset():
-            wrapper.lastHeadway = None
-        wrapper.reset = reset
-        return wrapper
-    return inner_smooth
-
-def getHeadwayFunction(timePeriodSequence, headways, decorate = lambda x: x):
-    """ Returns a Headway Function.
-        timePeriods: an array of pairs (tB, tE), where
-            tB is the time period begins, and tE - time
-            it ends
-        headwaySequence: an array of acceptable headways corresponding
+class HeadwaySchedule(object):
+    """ Headways of a depot over a time period vector.
+
+        timePeriodSequence: period boundaries t0 <= t1 <= ... <= tn, period
+            i being [ti, ti+1)
+        headways: headway in seconds of each time period
+        step: the largest change between two consecutive headways, so that
+            the headway ramps gradually into a new period. None disables
+            smoothing.
+
+        The schedule is immutable, the previous headway is passed in by the
+        caller, so one schedule can be shared and pickled freely.
+    """
+    def __init__(self, timePeriodSequence, headways, step=60):
+        self.boundaries = tuple(timePeriodSequence)
+        self.timePeriods = tuple(zip(self.boundaries[:-1], self.boundaries[1:]))
+        assert len(self.timePeriods) == len(headways), "Time periods and headwaySequence must have the same number of elements"
+        self.headways = tuple(headways)
+        self.step = step
+
+    def __repr__(self):
+        return f"HeadwaySchedule({list(self.boundaries)}, {list(self.headways)}, step={self.step})"
+
+    def getPeriod(self, timepoint):
+        period = bisect_right(self.boundaries, timepoint) - 1
+        if period < 0 or period >= len(self.headways):
+            raise SimulationError(f"No headway is defined for time {timepoint}")
+        return period
+
+    def getHeadway(self, timepoint):
+        """ Headway of the time period timepoint is in, unsmoothed. """
+        return self.headways[self.getPeriod(timepoint)]
+
+    def __call__(self, timepoint, lastHeadway=None):
+        """ Time before the next launch, if a train was launched at
+            timepoint and the previous headway was lastHeadway.
+        """
+        if self.step is None:
+            return self.getHeadway(timepoint)
+        return clamp(lastHeadway, self.getHeadway(timepoint), self.step)
+
+    def getLaunchTable(self, firstLaunch, lastHeadway=None, until=None):
+        """ Returns (launchTimes, headways) of a depot launching at
+            firstLaunch and then whenever its headway has passed, up to the
+            end of the last time period or until. Entry i holds what
+            self(launchTimes[i], headways[i - 1]) returns.
+        """
+        end = self.boundaries[-1] if until is None else min(until, self.boundaries[-1])
+        launchTimes = []
+        headways = []
+        if firstLaunch >= end:
+            return launchTimes, headways
+        # Launch times only increase, so the period is advanced in place
+        # instead of being searched for on every launch.
+        period = self.getPeriod(firstLaunch)
+        lastPeriod = len(self.headways) - 1
+        timepoint = firstLaunch
+        while timepoint < end:
+            while period < lastPeriod and self.boundaries[period + 1] <= timepoint:
+                period += 1
+            headway = self.headways[period]
+            if self.step is not None:
+                headway = clamp(lastHeadway, headway, self.step)
+            launchTimes.append(timepoint)
+            headways.append(headway)
+            lastHeadway = headway
+            timepoint += headway
+        return launchTimes, headways
+
+
+def getHeadwayFunction(timePeriodSequence, headways, step=60):
+    """ Returns a Headway Function, see HeadwaySchedule.
+        timePeriodSequence: time period boundaries t0, t1, ..., tn
+        headways: an array of acceptable headways corresponding
             to each time period.
+        step: smoothing step between consecutive headways, or None
     """
-    timePeriods = tuple((begin, end) for begin, end in zip(timePeriodSequence[:-1], timePeriodSequence[1:]))
-    assert len(timePeriods) == len(headways), "Time periods and headwaySequence must have the same number of elements"
+    return HeadwaySchedule(timePeriodSequence, headways, step)
+
 
-    @decorate
-    def headwayFunction(x):
-        for (period, (tBegin, tEnd)) in enumerate(timePeriods):
-            if x >= tBegin and x < tEnd:
-                return headwayFunction.headways[period]
-        raise SimulationError(f"No headway is defined for time {x}")
-    headwayFunction.headways = headways
-    headwayFunction.timePeriods = timePeriods
-    #headwayFunction.__repr__ = lambda: "asdas"
-    return headwayFunction
+class CumulativeDemand(object):
+    """ Piecewise linear cumulative passenger demand, a replacement for
+        scipy's interp1d over (timeSlots, cumDemands).
+
+        The curve is sampled on the coarsest uniform grid that contains every
+        time slot (600 seconds for ttpJsonBuilder output), so a lookup is one
+        division and two array reads. Values are kept in a flat array('d')
+        and are never modified, so one table can be shared by every
+        evaluation and pickled cheaply to worker processes.
+    """
+    def __init__(self, timeSlots, cumDemands):
+        points = sorted(zip(timeSlots, cumDemands))
+        times = [int(t) for t, _ in points]
+        if times[0] != 0:
+            raise ValueError("Cumulative demand must start at time 0.")
+        self.step = reduce(gcd, times) or 1
+        self.endTime = times[-1]
+        grid = np.arange(0, self.endTime + 1, self.step)
+        self.values = array('d', np.interp(grid, times, [float(d) for _, d in points]))
 
+    def __call__(self, t):
+        if t < 0 or t > self.endTime:
+            raise ValueError(f"Time {t} is outside of the demand table.")
+        index, remainder = divmod(t, self.step)
+        index = int(index)
+        value = self.values[index]
+        if remainder:
+            value += (self.values[index + 1] - value) * remainder / self.step
+        return value
 
+    def interpolate(self, times):
+        """ Vectorized __call__ over a NumPy array of times. """
+        values = np.frombuffer(self.values, dtype=np.float64)
+        if len(times) and (times.min() < 0 or times.max() > self.endTime):
+            raise ValueError("Times are outside of the demand table.")
+        index, remainder = np.divmod(times, self.step)
+        index = index.astype(np.int64)
+        nextIndex = np.minimum(index + 1, len(values) - 1)
+        return values[index] + (values[nextIndex] - values[index]) * remainder / self.step
@@ -5,4 +5,8 @@ class SimulationError(RuntimeError):
 
 
 class SimulationInitializationError(RuntimeError):
-    pass
\ No newline at end of file
+    pass
+
+class AnalyticEvaluationError(RuntimeError):
+    """ Raised when a problem can not be evaluated without simulating it """
+    pass
@@ -2,8 +2,10 @@
 ENABLE_LOG = None
 ENABLE_DEBUG_PRINT = None
 
-def log(env, what):
-    if ENABLE_LOG: print(f"T{env.now:9}: {what}")
+def log(env, what, *args):
+    # The message is only formatted when logging is enabled, so that
+    # disabled logging costs nothing but the call itself.
+    if ENABLE_LOG: print(f"T{env.now:9}: {what.format(*args)}")
 
 
 def debugPrint(*args, **kwargs):
@@ -0,0 +1,238 @@
+import csv
+import io
+import json
+import math
+import os
+import pathlib
+import threading
+import time
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Columns of a telemetry record, one record per chain and interval
+TELEMETRY_FIELDS = ('time', 'run', 'chain', 'seconds', 'evaluations', 'evaluationsPerSecond', 'bestObjective',
+                    'currentObjective', 'temperature', 'acceptanceRate', 'cacheHitRate')
+
+# Record fields exported as Prometheus gauges, see renderPrometheus
+METRICS = {
+    'seconds': 'Computing time of the chain in seconds',
+    'evaluations': 'Candidates proposed by the chain',
+    'evaluationsPerSecond': 'Candidates proposed per second over the last interval',
+    'bestObjective': 'Best total waiting found by the chain',
+    'currentObjective': 'Total waiting of the current state of the chain',
+    'temperature': 'Annealing temperature of the chain',
+    'acceptanceRate': 'Share of the proposals accepted over the last interval',
+    'cacheHitRate': 'Share of the evaluations served from the evaluation cache'
+}
+
+
+class TelemetryWriter(object):
+    """ Appends telemetry records to a time series, CSV if path ends with
+        .csv and NDJSON otherwise.
+
+        Every process opens the file for appending on its first write, so
+        that chains of several worker processes write to the same file. The
+        process that owns the run calls create once beforehand.
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.format = 'csv' if self.path.suffix == '.csv' else 'ndjson'
+        self.file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
+    def create(self):
+        """ Empties the file, writing the CSV header. """
+        os.makedirs(self.path.parent, exist_ok=True)
+        with open(self.path, 'w', newline='') as f:
+            if self.format == 'csv':
+                csv.writer(f).writerow(TELEMETRY_FIELDS)
+
+    def write(self, records):
+        # One write per call, appends of a few records are not interleaved
+        # with those of other processes.
+        if self.file is None:
+            self.file = open(self.path, 'a', newline='')
+        if self.format == 'csv':
+            text = io.StringIO()
+            writer = csv.writer(text)
+            for record in records:
+                writer.writerow([record[field] for field in TELEMETRY_FIELDS])
+            text = text.getvalue()
+        else:
+            text = ''.join(json.dumps(record) + '\n' for record in records)
+        self.file.write(text)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TelemetryObserver(object):
+    """ Records the chains of an annealing algorithm every interval
+        seconds of computing time to a TelemetryWriter.
+
+        The algorithm has to pass its chains as 'CHAINS' observable data:
+        per chain a dict of temperature, currentObjective, bestObjective,
+        proposals and acceptances, the last two counted from the start,
+        see ReplicaExchangeAnnealing.getChainStates. Rates are taken over
+        the interval since the previous record, the cache hit rate from
+        problem.cache if there is one. run names the optimization the chains
+        belong to.
+    """
+    def __init__(self, writer, run='', interval=1.0):
+        self.writer = writer
+        self.run = run
+        self.interval = interval
+        self.lastRecorded = None
+        self.lastData = None
+        # Proposals, acceptances and computing time of every chain at its
+        # previous record
+        self.previous = {}
+
+    def update(self, *args, **kwargs):
+        self.lastData = kwargs
+        seconds = kwargs['COMPUTING_TIME']
+        if self.lastRecorded is not None and seconds - self.lastRecorded < self.interval:
+            return
+        self.record(kwargs)
+
+    def finish(self):
+        """ Records the last state seen, if it was not recorded yet. """
+        if self.lastData is not None and self.lastData['COMPUTING_TIME'] != self.lastRecorded:
+            self.record(self.lastData)
+        self.writer.close()
+
+    def record(self, data):
+        seconds = data['COMPUTING_TIME']
+        self.lastRecorded = seconds
+        cache = getattr(data['PROBLEM'], 'cache', None)
+        cacheHitRate = cache.getStats()['hitRate'] if cache is not None else None
+        now = time.time()
+        records = []
+        for chain, state in enumerate(data['CHAINS']):
+            proposals, acceptances = state['proposals'], state['acceptances']
+            previousProposals, previousAcceptances, previousSeconds = self.previous.get(chain, (0, 0, 0.0))
+            self.previous[chain] = (proposals, acceptances, seconds)
+            newProposals = proposals - previousProposals
+            elapsed = seconds - previousSeconds
+            records.append({
+                'time': now,
+                'run': self.run,
+                'chain': chain,
+                'seconds': seconds,
+                'evaluations': proposals,
+                'evaluationsPerSecond': newProposals / elapsed if elapsed > 0 else None,
+                'bestObjective': state['bestObjective'],
+                'currentObjective': state['currentObjective'],
+                'temperature': state['temperature'],
+                'acceptanceRate': (acceptances - previousAcceptances) / newProposals if newProposals else None,
+                'cacheHitRate': cacheHitRate
+            })
+        self.writer.write(records)
+
+
+def readRecords(path, offset=0):
+    """ Returns (records, offset) of the complete records written to a
+        telemetry time series after offset, see TelemetryWriter.
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode('utf-8').splitlines()
+    offset += end
+    if path.suffix != '.csv':
+        return [json.loads(line) for line in lines if line.strip()], offset
+    records = []
+    for row in csv.reader(lines):
+        if not row or row[0] == TELEMETRY_FIELDS[0]:
+            continue
+        record = dict(zip(TELEMETRY_FIELDS, row))
+        records.append({field: value if field in ('run', 'chain') else (float(value) if value else None)
+                        for field, value in record.items()})
+    return records, offset
+
+
+def formatLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatValue(value):
+    # Starved schedules score INF, which Prometheus spells +Inf
+    value = float(value)
+    return ('+Inf' if value > 0 else '-Inf') if math.isinf(value) else repr(value)
+
+
+def renderPrometheus(latestRecords):
+    """ Prometheus text exposition of the latest record of every chain,
+        {(run, chain): record}, one gauge per field of METRICS.
+    """
+    lines = []
+    for field, description in METRICS.items():
+        name = 'ttp_solver_' + ''.join('_' + c.lower() if c.isupper() else c for c in field)
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        for (run, chain), record in sorted(latestRecords.items(), key=lambda item: str(item[0])):
+            value = record.get(field)
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            lines.append(f'{name}{{run="{formatLabel(run)}",chain="{formatLabel(chain)}"}} {formatValue(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer only exists from Python 3.7
+    daemon_threads = True
+
+
+class PrometheusEndpoint(object):
+    """ Serves GET /metrics, the latest telemetry of every chain in the
+        Prometheus text format, from a background thread. The time series
+        at path is followed on every request, so chains of any process
+        writing to it are included.
+    """
+    def __init__(self, path, port, host='127.0.0.1'):
+        self.path = path
+        self.offset = 0
+        self.latestRecords = {}
+        self.lock = threading.Lock()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = endpoint.getMetrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def getMetrics(self):
+        with self.lock:
+            records, self.offset = readRecords(self.path, self.offset)
+            for record in records:
+                self.latestRecords[(record['run'], record['chain'])] = record
+            return renderPrometheus(self.latestRecords)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
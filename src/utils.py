@@ -1,41 +1,36 @@
 import re
-import copy
-from functools import wraps, lru_cache
+import multiprocessing as mp
+from functools import wraps
 from time import time
-
-class ClassFactory(type):
-    def __new__(cls, name, bases, dct):
-        dct['_instances'] = {}
-        return super().__new__(cls, name, bases, dct)
-
-    def __call__(cls, *args, **kwargs):
-        instance = super().__call__(*args, **kwargs)
-        cls._instances[kwargs["_id"]] = instance
+from feasibleDomain import DepotDomain
+
+class Registry(object):
+    """ The objects of one class belonging to one problem, by _id.
+        Calling the registry creates an object, passing the owner as the
+        first argument, and registers it under its _id keyword argument:
+            Station = Registry(subway.world.Station, problem)
+            Station(name, arrivals, dwell, _id=1)
+            Station[1], len(Station), for _id, station in Station
+    """
+    def __init__(self, entityClass, owner):
+        self.entityClass = entityClass
+        self.__name__ = entityClass.__name__
+        self.owner = owner
+        self._instances = {}
+
+    def __call__(self, *args, **kwargs):
+        instance = self.entityClass(self.owner, *args, **kwargs)
+        self._instances[kwargs["_id"]] = instance
         return instance
 
-    def __iter__(cls):
-        # return iter(cls._instances)
-        return (iter(cls._instances.items()))
+    def __iter__(self):
+        return iter(self._instances.items())
 
-    def __getitem__(cls, _id):
-        return cls._instances[_id]
-
-    def __len__(cls):
-        return len(cls._instances)
-
-    def __copy__(self):
-        cls = self.__class__
-        result = cls.__new__(cls)
-        result.__dict__.update(self.__dict__)
-        return result
+    def __getitem__(self, _id):
+        return self._instances[_id]
 
-    def __deepcopy__(self, memo):
-        cls = self.__class__
-        result = cls.__new__(cls)
-        memo[id(self)] = result
-        for k, v in self.__dict__.items():
-            setattr(result, k, copy.deepcopy(v, memo))
-        return result
+    def __len__(self):
+        return len(self._instances)
 
 def timeit(f):
     @wraps(f)
@@ -88,7 +83,6 @@ def getFeasibleTimePeriods(subwayProblem, problemConfig, timeUnitsInMinutes=40):
     timeUnitsInSeconds = timeUnitsInMinutes * 60
     depotIds = problemConfig['headwayConfig'].keys()
     answerSets = {}
-    sorter = lambda x: tuple(sorted(x.values()))
     for depotId in depotIds:
         intervalSizeLowerBoundsInSeconds = tuple(problemConfig['periodMinSizes'][depotId])
         intervalSizeUpperBoundsInSeconds = tuple(problemConfig['periodMaxSizes'][depotId])
@@ -105,14 +99,10 @@ def getFeasibleTimePeriods(subwayProblem, problemConfig, timeUnitsInMinutes=40):
                == numHeadways \
                == len(initialTimePeriodsInSeconds) - 1
 
-        variableDomains = tuple([range(begin, end+1, timeUnitsInSeconds) for begin, end in zip(variableLowerBoundsInSeconds, variableUpperBoundsInSeconds)])
-
-        cspSolution = modelAndSolveCsp(variableDomains,
-                                                intervalSizeLowerBoundsInSeconds,
-                                                intervalSizeUpperBoundsInSeconds)
-
-        cspSolution = tuple(map(sorter, cspSolution))
-        answerSets[depotId] = cspSolution
+        feasibleDomain = DepotDomain(tuple(zip(variableLowerBoundsInSeconds, variableUpperBoundsInSeconds)),
+                                     tuple(zip(intervalSizeLowerBoundsInSeconds, intervalSizeUpperBoundsInSeconds)),
+                                     timeUnitsInSeconds, anchors=initialTimePeriodsInSeconds)
+        answerSets[depotId] = tuple(map(tuple, feasibleDomain.enumerate().tolist()))
     return answerSets
     """
     dict_sorter = lambda x: dict(sorted(x.items()))
@@ -136,5 +126,11 @@ def atof(text):
 def natural_keys(text):
     return [ atof(c) for c in re.split(r'[+-]?([0-9]+(?:[.][0-9]*)?|[.][0-9]+)', text) ]
 
+def getWorkerCount(reservedCores=2):
+    """ Number of worker processes to use: all cores but reservedCores,
+        and at least one.
+    """
+    return max(1, mp.cpu_count() - reservedCores)
+
 def argmin(a):
     return min(range(len(a)), key=lambda x: a[x])
\ No newline at end of file
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# The modules of src import each other by their flat names.
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / 'src'))
@@ -0,0 +1,115 @@
+""" Revisited time periods must be served from the evaluation cache, and
+    from the evaluation store of other processes and runs, with the
+    objective they were first scored with.
+"""
+import copy
+import pathlib
+import random
+import pytest
+import problemLoader
+import solver
+from evaluation import EvaluationCache, EvaluationEngine, ProblemEvaluator, SharedEvaluationStore, \
+     evaluateBatchCached, getProblemHash, getVariablesKey, INF
+from optimization import TimePeriodSolution, RandomMutationAll
+from utils import getVariableBounds
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+
+def loadProblem():
+    problemObj = problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json')
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    return problemObj, problemConfig
+
+
+def getSolutions(problemConfig, count):
+    random.seed(0)
+    bounds = getVariableBounds(problemConfig)
+    solution = TimePeriodSolution(problemConfig['timePeriodConfig'], bounds['variableBounds'],
+                                  bounds['intervalBounds'])
+    # count distinct vectors, mutations may leave a vector as it is
+    solutions = {getVariablesKey(solution.variables): solution}
+    while len(solutions) < count:
+        solution = RandomMutationAll(0.5).execute(copy.copy(solution))
+        solutions.setdefault(getVariablesKey(solution.variables), solution)
+    return list(solutions.values())
+
+
+def test_cacheHitsAndMisses(tmp_path):
+    store = SharedEvaluationStore(tmp_path / 'evaluations.sqlite', 'problem')
+    cache = EvaluationCache(maxSize=2, sharedStore=store)
+    variables = [{99: [0, 600 * i]} for i in range(3)]
+    assert cache.get(variables[0]) is None
+    for i, timePeriods in enumerate(variables):
+        cache.put(timePeriods, 1000.0 + i)
+    assert len(cache) == 2 and len(store) == 3
+    assert cache.get(variables[2]) == 1002.0
+    # Evicted from memory, still in the store
+    assert cache.get(variables[0]) == 1000.0
+    assert cache.getStats() == {'hits': 1, 'sharedHits': 1, 'misses': 1, 'hitRate': 2 / 3, 'size': 2}
+
+    # Another process or run of the same problem
+    otherCache = EvaluationCache(sharedStore=SharedEvaluationStore(store.path, 'problem'))
+    assert otherCache.get(variables[1]) == 1001.0 and otherCache.sharedHits == 1
+    otherProblem = EvaluationCache(sharedStore=SharedEvaluationStore(store.path, 'otherProblem'))
+    assert otherProblem.get(variables[1]) is None
+    store.close()
+
+
+def test_recordStoreIsOnlyWritten(tmp_path):
+    recordStore = SharedEvaluationStore(tmp_path / 'evaluations.sqlite')
+    recordStore.put(getVariablesKey({99: [0, 600]}), 1000.0)
+    cache = EvaluationCache(recordStore=recordStore)
+    assert cache.get({99: [0, 600]}) is None
+    cache.put({99: [0, 1200]}, 500.0)
+    assert recordStore.getBest() == ({99: [0, 1200]}, 500.0)
+    recordStore.close()
+
+
+def test_batchHitsMatchEvaluation(tmp_path):
+    problemObj, problemConfig = loadProblem()
+    solutions = getSolutions(problemConfig, 6)
+    evaluator = ProblemEvaluator(problemObj, 'analytic', maxReplays=0)
+    expected = [evaluator.evaluate(problemConfig, solution.variables)[0] for solution in solutions]
+
+    store = SharedEvaluationStore(tmp_path / 'evaluations.sqlite', getProblemHash(problemObj, problemConfig))
+    cache = EvaluationCache(sharedStore=store)
+    with EvaluationEngine(problemObj, numWorkers=2, batchSize=2) as engine:
+        # Duplicates within a batch are scored once
+        batch = [copy.copy(solution) for solution in solutions[:4] + solutions[:2]]
+        evaluateBatchCached(engine, cache, problemConfig, batch)
+        assert [solution.objectives[0] for solution in batch] == \
+            pytest.approx(expected[:4] + expected[:2], rel=1e-9)
+        assert cache.misses == 6 and len(store) == 4
+
+        # Hits do not keep the headwayFunctions of the solution they were copied from
+        batch = [copy.copy(solution) for solution in solutions]
+        for solution in batch:
+            solution.headwayFunctions = {}
+        evaluateBatchCached(engine, cache, problemConfig, batch)
+    assert [solution.objectives[0] for solution in batch] == pytest.approx(expected, rel=1e-9)
+    assert all(solution.headwayFunctions is None for solution in batch)
+    assert cache.hits == 4 and cache.misses == 8 and len(store) == 6
+    store.close()
+
+
+@pytest.mark.parametrize('storedObjective', [3e10, INF])
+def test_warmStartFromStore(tmp_path, capsys, storedObjective):
+    # Runs start from the best stored evaluation, feasible ones only, also
+    # above 2 ** 31 like those of the scaled lines.
+    problemObj, problemConfig = loadProblem()
+    storedSolution = getSolutions(problemConfig, 2)[1]
+    storePath = tmp_path / 'evaluations.sqlite'
+    store = SharedEvaluationStore(storePath, getProblemHash(problemObj, problemConfig))
+    store.put(getVariablesKey(storedSolution.variables), storedObjective)
+    store.close()
+
+    solver.main(DATA_PATH / 'Line9780Problem.json', None, algorithmName='descent', numWorkers=1, maxEvaluations=2,
+                outputPath=tmp_path / 'output', evaluationStorePath=storePath)
+    output = capsys.readouterr().out
+    assert (f'Warm start from stored objective {storedObjective}' in output) == (storedObjective < INF)
+    assert (f'Inital : {storedSolution}' in output) == (storedObjective < INF)
+    store = SharedEvaluationStore(storePath, getProblemHash(problemObj, problemConfig))
+    assert len(store) > 1 and store.getBest()[1] < storedObjective
+    store.close()
@@ -0,0 +1,128 @@
+""" The analytic evaluator, and its replays resumed from checkpoints, must
+    give the objective of the SimPy simulation, which stays the reference.
+"""
+import copy
+import pathlib
+import random
+import pytest
+import simpy
+import problemLoader
+import subway.simulation.utils as u
+from benchmark import scaleProblem
+from evaluation import ProblemEvaluator, SharedEvaluationStore, runSimulation, INF
+from optimization import TimePeriodSolution, RandomMutationAll
+from problemGenerator import generateProblem
+from telemetry import TelemetryWriter, readRecords, renderPrometheus
+from utils import getVariableBounds
+
+u.ENABLE_LOG = False
+u.ENABLE_DEBUG_PRINT = False
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+PROBLEMS = {
+    'Line9780': lambda: problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json'),
+    'branches': lambda: generateProblem(numStations=40, numTrains=20, numBranches=2, seed=1),
+    'depots': lambda: generateProblem(numStations=40, numDepots=2, numTrains=24, seed=2),
+    'launchAndForget': lambda: generateProblem(numStations=40, numDepots=2, numTrains=24, numBranches=2,
+                                               numLaunchAndForgetDepots=1, seed=3),
+}
+
+
+def simulate(problemObj, problemConfig, variables):
+    subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
+    problemLoader.loadHeadways(problemConfig, subwayProblem, variables)
+    env = simpy.Environment()
+    problemLoader.loadEnvironment(env, subwayProblem)
+    return runSimulation(env, subwayProblem)
+
+
+def getMutants(problemConfig, count, seed=0):
+    # A chain of mutants, so that consecutive vectors share a prefix of
+    # the day and the incremental evaluator resumes its replays.
+    random.seed(seed)
+    bounds = getVariableBounds(problemConfig)
+    solution = TimePeriodSolution(problemConfig['timePeriodConfig'], bounds['variableBounds'],
+                                  bounds['intervalBounds'])
+    mutants = [solution.variables]
+    for _ in range(count - 1):
+        solution = RandomMutationAll(random.choice([0.1, 0.5])).execute(copy.copy(solution))
+        mutants.append(solution.variables)
+    return mutants
+
+
+def assertClose(actual, expected):
+    if expected == INF:
+        assert actual == INF
+    else:
+        assert actual == pytest.approx(expected, rel=1e-9)
+
+
+@pytest.mark.parametrize('name', sorted(PROBLEMS))
+def test_analyticMatchesSimulation(name):
+    problemObj = PROBLEMS[name]()
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    analytic = ProblemEvaluator(problemObj, 'analytic', maxReplays=0)
+    assert analytic.getSubwayProblem() is not None and analytic.evaluator == 'analytic'
+    for variables in getMutants(problemConfig, 6):
+        assertClose(analytic.evaluate(problemConfig, variables)[0], simulate(problemObj, problemConfig, variables))
+
+
+@pytest.mark.parametrize('name', sorted(PROBLEMS))
+def test_resumedReplayMatchesFreshReplay(name):
+    problemObj = PROBLEMS[name]()
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    incremental = ProblemEvaluator(problemObj, 'analytic')
+    fresh = ProblemEvaluator(problemObj, 'analytic', maxReplays=0)
+    for variables in getMutants(problemConfig, 40, seed=1):
+        assertClose(incremental.evaluate(problemConfig, variables)[0], fresh.evaluate(problemConfig, variables)[0])
+
+
+def test_starvedLineRanksWorse(tmp_path):
+    # The feasible objective of s400-t200-d2 is above 2 ** 31, a line short
+    # of trains must still score worse, also once stored and read back.
+    baseProblem = problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json')
+    objectives = {}
+    for numTrains in (200, 8):
+        problemObj = scaleProblem(baseProblem, 400, numTrains, 2)
+        problemConfig = next(problemLoader.problemConfigGenerator(
+            problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+        objectives[numTrains] = ProblemEvaluator(problemObj, 'analytic').evaluate(
+            problemConfig, problemConfig['timePeriodConfig'])[0]
+    assert 2 ** 31 < objectives[200] < objectives[8] == INF
+
+    store = SharedEvaluationStore(tmp_path / 'evaluations.sqlite')
+    store.put(((1, (0, 600)),), objectives[8])
+    store.put(((1, (0, 1200)),), objectives[200])
+    assert store.get(((1, (0, 600)),)) == INF
+    assert store.getBest() == ({1: [0, 1200]}, objectives[200])
+    store.close()
+
+    for suffix in ('.csv', '.ndjson'):
+        writer = TelemetryWriter(tmp_path / ('telemetry' + suffix))
+        writer.create()
+        writer.write([dict(time=0.0, run='run', chain='0', seconds=1.0, evaluations=1.0, evaluationsPerSecond=1.0,
+                           bestObjective=objectives[8], currentObjective=objectives[200], temperature=1.0,
+                           acceptanceRate=0.0, cacheHitRate=0.0)])
+        writer.close()
+        record = readRecords(writer.path)[0][0]
+        assert record['bestObjective'] == INF and record['currentObjective'] == objectives[200]
+    assert 'ttp_solver_best_objective{run="run",chain="0"} +Inf' in renderPrometheus({('run', '0'): record})
+
+
+def test_starvedGeneratedLineRanksWorse():
+    # gen-s200-t150-d3-lf1 scores about 3.2e9, keeping a single train in
+    # every depot starves it.
+    objectives = []
+    for numStationedTrains in (None, 1):
+        problemObj = generateProblem(numStations=200, numDepots=3, numTrains=150, numBranches=2,
+                                     numLaunchAndForgetDepots=1, demandResolution=300)
+        for depot in problemObj['lineNodes']['depots']:
+            depot['stationedTrains'] = depot['stationedTrains'][:numStationedTrains]
+        problemConfig = next(problemLoader.problemConfigGenerator(
+            problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+        objectives.append(ProblemEvaluator(problemObj, 'analytic').evaluate(
+            problemConfig, problemConfig['timePeriodConfig'])[0])
+    assert 2 ** 31 < objectives[0] < objectives[1] == INF
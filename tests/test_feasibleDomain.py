@@ -0,0 +1,80 @@
+""" The feasible domain must hold exactly the time periods the mutation
+    operators and the boundary neighbourhood can reach from the configured
+    ones.
+"""
+import copy
+import itertools
+import pathlib
+import random
+import pytest
+import problemLoader
+from feasibleDomain import DepotDomain, TimePeriodDomain
+from optimization import TimePeriodSolution, RandomMutationAll, BoundaryNeighbourhood
+from utils import getVariableBounds
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+
+def getFeasibleVectors(anchors, variableBounds, intervalBounds, timeUnitInSeconds):
+    # Every vector on the grids through the anchors, checked one by one
+    domains = [range(anchor - (anchor - lower) // timeUnitInSeconds * timeUnitInSeconds, upper + 1, timeUnitInSeconds)
+               for anchor, (lower, upper) in zip(anchors, variableBounds)]
+    return [list(timePeriods) for timePeriods in itertools.product(*domains)
+            if all(minSize <= t2 - t1 <= maxSize for t1, t2, (minSize, maxSize) in
+                   zip(timePeriods[:-1], timePeriods[1:], intervalBounds))]
+
+
+def test_domainMatchesBruteForce():
+    random.seed(0)
+    for _ in range(200):
+        numVariables = random.randint(1, 5)
+        anchors = sorted(random.randint(0, 40) * 150 for _ in range(numVariables))
+        windows = [random.randint(0, 8) * 250 for _ in range(numVariables)]
+        variableBounds = [(anchor - window, anchor + window) for anchor, window in zip(anchors, windows)]
+        intervalBounds = [(random.randint(0, 10) * 200, random.randint(0, 20) * 300) for _ in range(numVariables - 1)]
+        timeUnitInSeconds = random.choice([300, 600])
+        vectors = getFeasibleVectors(anchors, variableBounds, intervalBounds, timeUnitInSeconds)
+        domain = DepotDomain(variableBounds, intervalBounds, timeUnitInSeconds, anchors=anchors)
+        assert domain.size == len(vectors)
+        assert domain.enumerate().tolist() == vectors
+        for index, timePeriods in enumerate(vectors):
+            assert domain.contains(timePeriods)
+            assert domain.rank(timePeriods) == index
+            assert domain.unrank(index) == timePeriods
+
+
+@pytest.mark.parametrize('window', [2700, 300, 3600])
+def test_domainHoldsMutants(window):
+    # Windows that are not multiples of 600 seconds put the lower bounds
+    # off the grid the mutations step on.
+    problemObj = problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json')
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    problemConfig['plusOrMinusWindows'] = {depotId: (0,) + (window,) * (len(windows) - 2) + (0,)
+                                           for depotId, windows in problemConfig['plusOrMinusWindows'].items()}
+    bounds = getVariableBounds(problemConfig)
+    domain = TimePeriodDomain(bounds['variableBounds'], bounds['intervalBounds'],
+                              anchors=problemConfig['timePeriodConfig'])
+    assert domain.contains(problemConfig['timePeriodConfig'])
+
+    random.seed(1)
+    solution = TimePeriodSolution(problemConfig['timePeriodConfig'], bounds['variableBounds'],
+                                  bounds['intervalBounds'])
+    for _ in range(200):
+        solution = RandomMutationAll(0.5).execute(copy.copy(solution))
+        assert domain.contains(solution.variables)
+        # The neighbourhood holds exactly the single boundary steps the
+        # domain contains.
+        neighbourhood = BoundaryNeighbourhood(solution)
+        moves = [neighbour.variables for neighbour in neighbourhood.getSolutions()]
+        expected = []
+        for depotId, timePeriods in solution.variables.items():
+            for timeSlot in range(1, len(timePeriods) - 1):
+                for delta in (-600, 600):
+                    variables = copy.deepcopy(solution.variables)
+                    variables[depotId][timeSlot] += delta
+                    if domain.contains(variables):
+                        expected.append(variables)
+        assert sorted(map(repr, moves)) == sorted(map(repr, expected))
+    for _ in range(20):
+        assert domain.contains(domain.sample())
@@ -0,0 +1,97 @@
+""" Descent and tabu search must only ever score feasible time periods and
+    never return a solution worse than the one they started from.
+"""
+import copy
+import pathlib
+import random
+import pytest
+import problemLoader
+from evaluation import ProblemEvaluator, getVariablesKey, INF
+from feasibleDomain import TimePeriodDomain
+from optimization import TimePeriodSolution, TimePeriodsProblemBase, RandomMutationAll, NeighbourhoodSearch
+from problemGenerator import generateProblem
+from jmetal.util.termination_criterion import StoppingByEvaluations
+from utils import getVariableBounds
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+PROBLEMS = {
+    'Line9780': lambda: problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json'),
+    'depots': lambda: generateProblem(numStations=40, numDepots=2, numTrains=24, numBranches=2,
+                                      numLaunchAndForgetDepots=1, seed=3),
+}
+
+
+class RecordingProblem(TimePeriodsProblemBase):
+    """ Scores solutions in this process, checking each is feasible. """
+    def __init__(self, feasibleSolution, problemObj, problemConfig, domain):
+        super().__init__(feasibleSolution)
+        self.problemEvaluator = ProblemEvaluator(problemObj, 'analytic')
+        self.problemConfig = problemConfig
+        self.domain = domain
+        self.evaluated = 0
+
+    def evaluate(self, feasibleSolution):
+        assert self.domain.contains(feasibleSolution.variables)
+        self.evaluated += 1
+        feasibleSolution.objectives[0] = self.problemEvaluator.evaluate(self.problemConfig,
+                                                                        feasibleSolution.variables)[0]
+        return feasibleSolution
+
+
+class StarvingProblem(RecordingProblem):
+    """ Every move away from the initial solution starves the line. """
+    def evaluate(self, feasibleSolution):
+        super().evaluate(feasibleSolution)
+        if getVariablesKey(feasibleSolution.variables) != getVariablesKey(self.feasibleSolution.variables):
+            feasibleSolution.objectives[0] = INF
+        return feasibleSolution
+
+
+def createSearch(name, problemClass, tabuTenure, sampleSize=None, maxSteps=1, maxEvaluations=300):
+    random.seed(0)
+    problemObj = PROBLEMS[name]()
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    bounds = getVariableBounds(problemConfig)
+    domain = TimePeriodDomain(bounds['variableBounds'], bounds['intervalBounds'],
+                              anchors=problemConfig['timePeriodConfig'])
+    initialSolution = TimePeriodSolution(problemConfig['timePeriodConfig'], bounds['variableBounds'],
+                                         bounds['intervalBounds'])
+    # A start away from the configured time periods leaves room to improve
+    for _ in range(5):
+        initialSolution = RandomMutationAll(0.5).execute(copy.copy(initialSolution))
+    problem = problemClass(initialSolution, problemObj, problemConfig, domain)
+    search = NeighbourhoodSearch(problem, StoppingByEvaluations(max_evaluations=maxEvaluations),
+                                 initialSolution, sampleSize=sampleSize, tabuTenure=tabuTenure, maxSteps=maxSteps)
+    initialObjective = problem.evaluate(copy.copy(initialSolution)).objectives[0]
+    return search, problem, initialObjective
+
+
+@pytest.mark.parametrize('name', sorted(PROBLEMS))
+@pytest.mark.parametrize('tabuTenure, sampleSize, maxSteps', [(0, None, 1), (0, None, 2), (8, None, 1), (8, 4, 1)])
+def test_searchNeverReturnsWorse(name, tabuTenure, sampleSize, maxSteps):
+    search, problem, initialObjective = createSearch(name, RecordingProblem, tabuTenure, sampleSize, maxSteps)
+    search.run()
+    result = search.get_result()
+    assert problem.domain.contains(result.variables)
+    assert result.objectives[0] <= initialObjective < INF
+    assert result.objectives[0] <= search.solutions[0].objectives[0]
+    assert result.objectives[0] == pytest.approx(
+        ProblemEvaluator(PROBLEMS[name](), 'analytic', maxReplays=0).evaluate(
+            problem.problemConfig, result.variables)[0], rel=1e-9)
+    if tabuTenure == 0 and sampleSize is None:
+        assert search.converged or search.evaluations >= 300
+    assert search.evaluations == problem.evaluated - 1
+
+
+@pytest.mark.parametrize('tabuTenure', [0, 8])
+def test_searchKeepsFeasibleStart(tabuTenure):
+    # Tabu search moves on to the starved neighbours, but returns the start
+    search, problem, initialObjective = createSearch('Line9780', StarvingProblem, tabuTenure, maxEvaluations=100)
+    search.run()
+    result = search.get_result()
+    assert getVariablesKey(result.variables) == getVariablesKey(problem.feasibleSolution.variables)
+    assert result.objectives[0] == initialObjective < INF
+    assert search.converged == (tabuTenure == 0)
+    assert (search.solutions[0].objectives[0] == INF) == (tabuTenure > 0)
@@ -0,0 +1,74 @@
+""" Worker processes evaluating the problems mapped from SharedProblems must
+    score every time period vector as an evaluator building its problem
+    from JSON in this process.
+"""
+import copy
+import os
+import pathlib
+import pickle
+import random
+import pytest
+import problemLoader
+from evaluation import EvaluationEngine, ProblemEvaluator, shareProblems
+from optimization import TimePeriodSolution, RandomMutationAll
+from problemGenerator import generateProblem
+from utils import getVariableBounds
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+
+@pytest.fixture(scope='module')
+def lines():
+    # {lineKey: (problemObj, problemConfig, [variables])}
+    random.seed(0)
+    problemObjs = {
+        None: problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json'),
+        'depots': generateProblem(numStations=40, numDepots=2, numTrains=24, numBranches=2,
+                                  numLaunchAndForgetDepots=1, seed=3)
+    }
+    lines = {}
+    for lineKey, problemObj in problemObjs.items():
+        problemConfig = next(problemLoader.problemConfigGenerator(
+            problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+        bounds = getVariableBounds(problemConfig)
+        solution = TimePeriodSolution(problemConfig['timePeriodConfig'], bounds['variableBounds'],
+                                      bounds['intervalBounds'])
+        variablesList = [solution.variables]
+        for _ in range(11):
+            solution = RandomMutationAll(0.5).execute(copy.copy(solution))
+            variablesList.append(solution.variables)
+        lines[lineKey] = (problemObj, problemConfig, variablesList)
+    return lines
+
+
+def evaluateInProcess(problemObj, problemConfig, variablesList, evaluator='analytic'):
+    # Replays resumed from checkpoints may round differently
+    problemEvaluator = ProblemEvaluator(problemObj, evaluator, maxReplays=0)
+    return pytest.approx([problemEvaluator.evaluate(problemConfig, variables)[0] for variables in variablesList],
+                         rel=1e-9)
+
+
+def test_mappedProblemsMatchJson(lines):
+    sharedProblems = shareProblems({lineKey: problemObj for lineKey, (problemObj, _, _) in lines.items()})
+    # As handed to a worker process
+    mappedProblems = pickle.loads(pickle.dumps(sharedProblems))
+    for lineKey, (problemObj, problemConfig, variablesList) in lines.items():
+        problemEvaluator = ProblemEvaluator(None, 'analytic', sharedProblems=mappedProblems, lineKey=lineKey)
+        assert [problemEvaluator.evaluate(problemConfig, variables)[0] for variables in variablesList] == \
+            evaluateInProcess(problemObj, problemConfig, variablesList)
+    mappedProblems.close()
+    sharedProblems.close()
+    assert not os.path.exists(sharedProblems.path)
+
+
+@pytest.mark.parametrize('evaluator', ['analytic', 'simulation'])
+def test_workersMatchInProcessEvaluation(lines, evaluator):
+    problemObjs = {lineKey: problemObj for lineKey, (problemObj, _, _) in lines.items()}
+    with EvaluationEngine(numWorkers=2, batchSize=3, evaluator=evaluator, problemObjs=problemObjs) as engine:
+        path = engine.lineProblems[None].path
+        for lineKey, (problemObj, problemConfig, variablesList) in lines.items():
+            assert engine.forLine(lineKey).evaluate(problemConfig, variablesList) == \
+                evaluateInProcess(problemObj, problemConfig, variablesList, evaluator)
+        with pytest.raises(KeyError):
+            engine.evaluate(lines[None][1], lines[None][2], 'otherLine')
+    assert not os.path.exists(path)
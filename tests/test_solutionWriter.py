@@ -0,0 +1,107 @@
+""" Every output format must hold the logs of the simulated solution that
+    the indented JSON files of the original writer held.
+"""
+import json
+import pathlib
+import numpy as np
+import pytest
+import simpy
+import problemLoader
+from solutionWriter import SolutionLogWriter, writeJsonObject
+from solver import writeJsonSolution
+from subway.eventStore import EventStore
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+
+@pytest.fixture(scope='module')
+def problem():
+    problemObj = problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json')
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    return problemObj, problemConfig
+
+
+def writeSolution(problem, outputPath, outputFormat):
+    problemObj, problemConfig = problem
+    outputPath.mkdir()
+    writeJsonSolution(problemObj, problemConfig, problemConfig['timePeriodConfig'], outputPath, outputFormat)
+    return outputPath
+
+
+def simulateTrainLogs(problem):
+    # The per event dicts of Train.eventsLog, without an EventStore
+    problemObj, problemConfig = problem
+    subwayProblem = problemLoader.createSubwayProblemFromJson(problemObj)
+    problemLoader.loadHeadways(problemConfig, subwayProblem, problemConfig['timePeriodConfig'])
+    env = simpy.Environment()
+    problemLoader.loadEnvironment(env, subwayProblem)
+    env.run(until=subwayProblem.dayEndTimeSeconds)
+    return {str(train): train.eventsLog for _id, train in subwayProblem.Train}
+
+
+def readJson(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_writeJsonObjectMatchesJsonDump(tmp_path, indent):
+    items = [('a', [1, 2, {'b': 'c'}]), ('d', {}), ('e', [])]
+    with open(tmp_path / 'items.json', 'w') as f:
+        writeJsonObject(f, iter(items), indent)
+    separators = None if indent else (',', ':')
+    assert (tmp_path / 'items.json').read_text() == json.dumps(dict(items), indent=indent, separators=separators)
+    with open(tmp_path / 'empty.json', 'w') as f:
+        writeJsonObject(f, [], indent)
+    assert (tmp_path / 'empty.json').read_text() == '{}'
+
+
+def test_outputFormatsHoldTheSameLogs(problem, tmp_path):
+    trainLogs = simulateTrainLogs(problem)
+    trips = {tripNumberKey: {'train': trainName, 'route': tripLog['route'], 'events': tripLog['events']}
+             for trainName, eventsLog in trainLogs.items() for tripNumberKey, tripLog in eventsLog.items()}
+
+    indented = writeSolution(problem, tmp_path / 'json', 'json')
+    assert (indented / 'TrainLog.json').read_text() == json.dumps(trainLogs, indent=2)
+    assert readJson(indented / 'TripsLog.json') == trips
+
+    compact = writeSolution(problem, tmp_path / 'compact', 'compact')
+    for fileName in ('TrainLog.json', 'TripsLog.json', 'DepotDeparturesLog.json', 'StationDeparturesLog.json'):
+        assert '\n' not in (compact / fileName).read_text()
+        assert readJson(compact / fileName) == readJson(indented / fileName)
+
+    streamed = writeSolution(problem, tmp_path / 'ndjson', 'ndjson')
+    assert not (streamed / 'TrainLog.json').exists()
+    with open(streamed / 'TripsLog.ndjson') as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == len(trips)
+    assert {record.pop('trip'): record for record in records} == trips
+    assert readJson(streamed / 'StationDeparturesLog.json') == readJson(indented / 'StationDeparturesLog.json')
+
+
+def test_unknownOutputFormat(tmp_path):
+    with pytest.raises(ValueError):
+        SolutionLogWriter(tmp_path, 'xml')
+
+
+@pytest.mark.parametrize('mmapMode', ['r', None])
+def test_eventLogRoundTrip(problem, tmp_path, mmapMode):
+    eventLog = writeSolution(problem, tmp_path / 'npy', 'npy') / 'EventLog'
+    assert sorted(path.name for path in eventLog.iterdir()) == \
+        sorted([f'{column}.npy' for column in EventStore.COLUMNS] + ['names.json'])
+    store = EventStore.load(eventLog, mmapMode)
+    assert isinstance(store.columns['time'], np.memmap) == (mmapMode is not None)
+    copied = tmp_path / 'copy'
+    store.save(copied)
+    copy = EventStore.load(copied, mmapMode)
+    assert len(copy) == len(store) > 0
+    for column in EventStore.COLUMNS:
+        assert np.array_equal(copy.getColumn(column), store.getColumn(column))
+
+    # The logs derived from the EventLog are those written directly
+    indented = writeSolution(problem, tmp_path / 'json', 'json')
+    with SolutionLogWriter(tmp_path / 'npy', 'json') as writer:
+        writer.writeEventStore(store)
+    for fileName in ('TrainLog.json', 'TripsLog.json'):
+        assert (tmp_path / 'npy' / fileName).read_text() == (indented / fileName).read_text()
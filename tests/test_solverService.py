@@ -0,0 +1,114 @@
+""" Jobs sent to the solver service must go from queued through running to
+    done or failed, and unknown jobs, problems and paths must be answered
+    with 404.
+"""
+import asyncio
+import json
+import pathlib
+import problemLoader
+from feasibleDomain import TimePeriodDomain
+from solverService import SolverService
+from utils import getVariableBounds, stringToSeconds
+
+DATA_PATH = pathlib.Path(__file__).resolve().parents[1] / 'data'
+
+
+async def request(port, method, path, body=None):
+    """ Returns (status, JSON body) of an HTTP request, the list of events
+        of a streamed response.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = b'' if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode('utf-8'))
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n"
+                 .encode('latin-1') + data)
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    status = int(head.split()[1])
+    if b'Transfer-Encoding: chunked' not in head:
+        return status, json.loads(content)
+    events = []
+    while True:
+        size, _, content = content.partition(b'\r\n')
+        if int(size, 16) == 0:
+            return status, events
+        events.append(json.loads(content[:int(size, 16)]))
+        content = content[int(size, 16) + 2:]
+
+
+def runService(session):
+    """ Runs session(service, port) against a service listening on a free
+        port.
+    """
+    service = SolverService(numWorkers=2)
+    loop = asyncio.new_event_loop()
+
+    async def serve():
+        service.queue = asyncio.Queue()
+        runner = asyncio.ensure_future(service.runJobs())
+        server = await asyncio.start_server(service.handleConnection, '127.0.0.1', 0)
+        try:
+            await session(service, server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await server.wait_closed()
+            runner.cancel()
+    try:
+        loop.run_until_complete(serve())
+    finally:
+        loop.close()
+        service.close()
+
+
+def test_jobLifecycle():
+    problemObj = problemLoader.getJsonProblem(DATA_PATH / 'Line9780Problem.json')
+    problemConfig = next(problemLoader.problemConfigGenerator(
+        problemObj, problemLoader.createSubwayProblemFromJson(problemObj)))
+    bounds = getVariableBounds(problemConfig)
+    domain = TimePeriodDomain(bounds['variableBounds'], bounds['intervalBounds'],
+                              anchors=problemConfig['timePeriodConfig'])
+
+    async def session(service, port):
+        status, state = await request(port, 'POST', '/jobs', {'problem': problemObj, 'maxEvaluations': 40})
+        assert status == 202 and state['status'] == 'queued'
+        status, events = await request(port, 'GET', f"/jobs/{state['jobId']}/events")
+        assert status == 200
+        assert [event['status'] for event in events[:2]] == ['queued', 'running']
+        assert events[-1]['status'] == 'done' and all(event['jobId'] == state['jobId'] for event in events)
+        status, state = await request(port, 'GET', f"/jobs/{state['jobId']}")
+        assert status == 200 and state['status'] == 'done' and state['result'] == events[-1]['result']
+        variables = {int(depotId): list(map(stringToSeconds, timePeriods))
+                     for depotId, timePeriods in state['result']['timePeriods'].items()}
+        assert domain.contains(variables)
+
+        # The cached problem is solved again, from its best time periods
+        status, events = await request(port, 'POST', '/solve', {'problemHash': state['problemHash'],
+                                                                'maxEvaluations': 40})
+        assert status == 200 and events[-1]['status'] == 'done'
+        assert events[-1]['result']['objective'] <= state['result']['objective']
+        status, serviceStatus = await request(port, 'GET', '/status')
+        assert status == 200 and list(serviceStatus['problems']) == [state['problemHash']]
+        assert serviceStatus['problems'][state['problemHash']]['cache']['hits'] > 0
+
+        # Infeasible start, failing on the executor
+        status, events = await request(port, 'POST', '/solve', {
+            'problemHash': state['problemHash'], 'maxEvaluations': 40,
+            'timePeriods': {depotId: ['05:00:00', '05:00:00'] for depotId in state['result']['timePeriods']}})
+        assert events[-1]['status'] == 'failed' and 'outside' in events[-1]['error']
+    runService(session)
+
+
+def test_errorStatuses():
+    async def session(service, port):
+        for method, path, body, expected in [('GET', '/jobs/999', None, 404),
+                                             ('GET', '/jobs/first', None, 404),
+                                             ('GET', '/jobs/999/events', None, 404),
+                                             ('POST', '/jobs', {'problemHash': 'unknown'}, 404),
+                                             ('GET', '/unknown', None, 404),
+                                             ('DELETE', '/jobs', None, 405),
+                                             ('POST', '/jobs', b'{', 400),
+                                             ('POST', '/solve', {'maxSeconds': 1}, 400)]:
+            status, response = await request(port, method, path, body)
+            assert (status, 'error' in response) == (expected, True)
+        assert len(service.jobs) == 0
+    runService(session)